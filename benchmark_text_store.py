@@ -0,0 +1,75 @@
+## This script measures what the compressed store of the txt files brings on a month of txt files: the space saved,
+## and the time the merge workers take to read the texts from the store compared to the plain files.
+## The month folder is copied to a temporary folder, which is packed, so the original is left untouched.
+##
+## Usage:
+##   python benchmark_text_store.py unprocessed_txts_2007_to_2023/2301
+#####################################################################################################################
+## Importing the required libraries
+import os
+import shutil
+import argparse
+import tempfile
+from time import perf_counter
+from scientific_dataset_arxiv.textio import read_nonempty_text, read_text_after_term
+from scientific_dataset_arxiv.textstore import LEVEL, list_texts, pack_folder, store_path
+from scientific_dataset_arxiv.config import search_term
+
+#####################################################################################################################
+## Functions
+
+## Function to time the reads of a list of files
+def time_reads(txt_files, repeat):
+    """
+    Read every file the way both merge scripts do, and time it.
+
+    Args:
+        txt_files (list): The paths of the txt files.
+        repeat (int): The number of passes over the files, the best one is kept.
+
+    Returns:
+        float: The seconds of the fastest pass.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        tic = perf_counter()
+        for fn in txt_files:
+            read_nonempty_text(fn)
+            read_text_after_term(fn, search_term)
+        best = min(best, perf_counter() - tic)
+    return best
+
+
+#####################################################################################################################
+#####################################################################################################################
+
+## Main code
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the compressed store of the txt files on a month folder.')
+    parser.add_argument('folder', help='A month folder of txt files.')
+    parser.add_argument('--level', type=int, default=LEVEL, help='The zstd compression level.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of passes over the files.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, os.path.basename(os.path.normpath(args.folder)))
+        shutil.copytree(args.folder, folder, ignore=shutil.ignore_patterns('*.pdf', '*.sqlite'))
+
+        txt_files = list_texts(folder)
+        plain_bytes = sum(os.path.getsize(fn) for fn in txt_files)
+        print(f"{len(txt_files)} txt files, {plain_bytes / 2**20:.1f} MB")
+
+        plain_time = time_reads(txt_files, args.repeat)
+
+        tic = perf_counter()
+        pack_folder(folder, args.level)
+        pack_time = perf_counter() - tic
+
+        packed_bytes = os.path.getsize(store_path(folder))
+        packed_time = time_reads(txt_files, args.repeat)
+
+    print(f"Store: {packed_bytes / 2**20:.1f} MB, {plain_bytes / packed_bytes:.1f}x smaller, packed in {pack_time:.2f} seconds at level {args.level}")
+    print(f"Plain files: {plain_time:.2f} seconds, {plain_bytes / 2**20 / plain_time:.0f} MB/s")
+    print(f"Store:       {packed_time:.2f} seconds, {plain_bytes / 2**20 / packed_time:.0f} MB/s")
@@ -3,9 +3,19 @@
 import os
 from time import time
 from glob import glob
+from functools import lru_cache
 from multiprocessing import Pool, cpu_count # Pool is used to create multiple processes
-from scientific_dataset_arxiv.fulltext import convert_directory_parallel, reextension
-from scientific_dataset_arxiv.config import start_year, end_year, max_pdfs_per_month, skip_n
+from concurrent.futures import ThreadPoolExecutor
+from scientific_dataset_arxiv.fulltext import convert_directory_parallel, reextension, rejection_path, setup_logging
+from scientific_dataset_arxiv.arxiv_ids import select_versions, split_id_version
+from scientific_dataset_arxiv.config import start_year, end_year, max_pdfs_per_month, skip_n, pdf_version, conversion_search_term, quarantine_attempts
+from scientific_dataset_arxiv.config import download_concurrency, max_download_concurrency, download_base_url
+from scientific_dataset_arxiv.config import conversion_batch_files, conversion_batch_bytes, lease_dir, lease_ttl, mp_start_method, compress_texts
+from scientific_dataset_arxiv.config import staging_budget, staging_min_free, sample_fraction, sample_seed
+from scientific_dataset_arxiv.config import search_term, section_headings
+from scientific_dataset_arxiv.leases import LeaseDirectory, claimed_units
+from scientific_dataset_arxiv.governor import governor_from_config, parse_size
+from scientific_dataset_arxiv.staging import StagingArea
 
 
 #####################################################################################################################
@@ -26,17 +36,44 @@ def create_folder(directory_path):
     if not os.path.exists(directory_path):
         os.makedirs(directory_path)
 
-def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_folder_path, workers=cpu_count(), max_results=max_pdfs_per_month, skip_first_n=skip_n):
+## Function to get the ids sampled from the metadata of a year
+@lru_cache(maxsize=2)
+def sampled_ids(yy):
     """
-    Downloads a folder from the bucket, skipping PDFs with corresponding TXT files.
+    Draw the sample of a year from its metadata, as the merge scripts do, see `sampling.py`.
+
+    Args:
+        yy (str): The year in two-digit format.
+
+    Returns:
+        frozenset: The sampled ids.
+    """
+    from scientific_dataset_arxiv.merge import load_metadata
+    from scientific_dataset_arxiv.sampling import sample_metadata
+
+    metadata_df = load_metadata(yy)
+    sample = frozenset(sample_metadata(metadata_df, sample_fraction, sample_seed)['id'])
+    print(f"Sampled {len(sample)} of the {len(metadata_df)} papers of 20{yy}.")
+    return sample
+
+def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_folder_path, workers=download_concurrency, max_results=max_pdfs_per_month, skip_first_n=skip_n, version=pdf_version, staging=None, sample=None):
+    """
+    Downloads a folder from the bucket, skipping PDFs with corresponding TXT files or that were rejected before.
+    Only one version of every paper is downloaded, see `version`.
+    The bucket is listed with the storage client and the PDFs are fetched with the asynchronous downloader.
+    With a staging area, every PDF waits for room in the area before being downloaded into it.
+    With a sample, the whole folder is listed and only the sampled papers are downloaded.
 
     Args:
         bucket_name (str): The name of the bucket.
         bucket_folder_name (str): The name of the folder in the bucket.
         local_folder_path (str): The local path where the folder will be downloaded.
-        workers (int, optional): The number of workers to use for parallel downloading. Defaults to the number of CPUs.
+        workers (int, optional): The initial number of parallel downloads, adjusted to the throughput. Defaults to 16.
         max_results (int, optional): The maximum number of results to retrieve from the bucket. Defaults to 10000.
         skip_first_n (int, optional): The number of results to skip. Defaults to 0.
+        version (str or int, optional): The version to keep per paper, see `select_versions`. Defaults to 'latest'.
+        staging (StagingArea, optional): The bounded staging area to download into. Defaults to None.
+        sample (frozenset, optional): The ids of the papers to download, see `sampled_ids`. Defaults to None.
 
     Returns:
         None
@@ -45,7 +82,9 @@ def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_fold
         None
     """
 
-    from google.cloud.storage import Client, transfer_manager
+    from google.cloud.storage import Client
+    from scientific_dataset_arxiv.downloader import download_many_to_path
+    from scientific_dataset_arxiv.textstore import TextStore, store_path
 
     # Create the folder if it doesn't exist
     create_folder(local_folder_path)
@@ -65,8 +104,22 @@ def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_fold
     # Normalize all paths in existing_txt_files and convert to a set for faster lookup
     existing_txt_files = set(os.path.normpath(path) for path in existing_txt_files)
 
-    # Filter blobs to download (skip PDFs with corresponding TXT)
-    blobs_to_download = []
+    # TXT files packed into the compressed store of the month count as well
+    if os.path.exists(store_path(local_folder_path)):
+        with TextStore(local_folder_path) as store:
+            existing_txt_files.update(os.path.normpath(name) for name in store.names())
+
+    # Rejected PDFs are treated like converted ones, they would only be rejected again
+    existing_rejected_files = glob(f"{local_folder_path}/**/*.rejected", recursive=True)
+    existing_txt_files.update(os.path.normpath(reextension(os.path.relpath(path, local_folder_path), 'txt')) for path in existing_rejected_files)
+
+    # A sample is drawn from the whole folder, whatever the order of the listing
+    if sample is not None:
+        max_results, skip_first_n = None, 0
+
+    # List the blob names, skipping the first n blobs, with their sizes for the staging area
+    listed_blob_names = []
+    blob_sizes = {}
     skip_count = 0
     for blob in bucket.list_blobs(prefix=bucket_folder_name, max_results=max_results):
 
@@ -75,9 +128,21 @@ def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_fold
             skip_count += 1
             continue
 
-        # Get blob name
-        blob_name = blob.name
-        
+        # Skip the papers out of the sample
+        if sample is not None and split_id_version(blob.name)[0] not in sample:
+            continue
+
+        listed_blob_names.append(blob.name)
+        blob_sizes[blob.name] = blob.size or 0
+
+    # Keep only one version per paper, so that superseded versions are never downloaded
+    selected_blob_names = select_versions(listed_blob_names, version)
+    print(f"Selected {len(selected_blob_names)} of {len(listed_blob_names)} PDFs in {bucket_folder_name} after picking the {version} version.")
+
+    # Filter blobs to download (skip PDFs with corresponding TXT)
+    blob_names = []
+    for blob_name in selected_blob_names:
+
         # Get the corresponding txt file name
         txt_filename = reextension(blob_name, 'txt')
 
@@ -87,17 +152,16 @@ def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_fold
         # Check if corresponding TXT file exists using set membership
         # If the txt file does not exist, add the blob to the list of blobs to download
         if txt_filename not in existing_txt_files:
-            blobs_to_download.append(blob)
-
-
-    blob_names = [blob.name for blob in blobs_to_download]
+            blob_names.append(blob_name)
 
     if not blob_names:
         print(f"No new PDFs to download in {bucket_folder_name}, as all have corresponding TXT files or the total pdfs are less than {skip_first_n}.")
         return
 
-    results = transfer_manager.download_many_to_path(
-        bucket, blob_names, destination_directory=local_folder_path, max_workers=workers, skip_if_exists=True
+    results = download_many_to_path(
+        bucket_name, blob_names, destination_directory=local_folder_path, base_url=download_base_url,
+        initial_concurrency=workers, max_concurrency=max(workers, max_download_concurrency), skip_if_exists=True,
+        staging=staging, blob_sizes=[blob_sizes[name] for name in blob_names]
     )
 
     for name, result in zip(blob_names, results):
@@ -107,14 +171,14 @@ def download_folder_transfer_manager(bucket_name, bucket_folder_name, local_fold
         if isinstance(result, Exception):
             print("Failed to download {} due to exception: {}".format(name, result))
         else:
-            print("Downloaded {} to {}.".format(name, local_folder_path + name))
+            print("Downloaded {} to {}.".format(name, os.path.join(local_folder_path, name)))
 
 
 
 ## Function to delete the original pdfs after they are converted to txt files
 def delete_pdfs_safe(directory_path):
     """
-    Deletes PDF files safely by checking if there is a corresponding TXT file.
+    Deletes PDF files safely by checking if there is a corresponding TXT file, or a record of the PDF being rejected.
 
     Args:
         directory_path (str): The path to the directory containing the PDF and TXT files.
@@ -137,8 +201,8 @@ def delete_pdfs_safe(directory_path):
         ## Get the txt file name
         txt_name = reextension(pdf, 'txt')
 
-        ## Check if the txt file exists
-        if txt_name in txt_files:
+        ## Check if the txt file exists, or if the pdf was rejected
+        if txt_name in txt_files or os.path.exists(rejection_path(pdf)):
             try:
                 os.remove(pdf)
                 print(f"Deleted PDF: {pdf}")
@@ -149,6 +213,87 @@ def delete_pdfs_safe(directory_path):
             print(f"No corresponding TXT file found for: {pdf}, hence will not delete")  # Handle missing TXT
 
 
+## Function to download, convert and clean up the pdfs of a month
+def download_convert_month(yymm, local_folder_path):
+    """
+    Download the PDFs of a month, convert them to TXT files and delete the converted PDFs.
+
+    With a staging budget, the PDFs are downloaded into a bounded staging area and converted while the download goes
+    on, each one being deleted once converted, see `StagingArea`. The download waits whenever the area is full.
+
+    Args:
+        yymm (str): The year and month in YYMM format.
+        local_folder_path (str): The local folder of the month.
+
+    Returns:
+        None
+    """
+    download_kwargs = dict(bucket_name='arxiv-dataset', bucket_folder_name=f'arxiv/arxiv/pdf/{yymm}', local_folder_path=local_folder_path,
+                           sample=sampled_ids(yymm[:2]) if sample_fraction is not None else None)
+    convert_kwargs = dict(search_term=conversion_search_term, batch_files=conversion_batch_files, batch_bytes=conversion_batch_bytes,
+                          start_method=mp_start_method, governor=governor_from_config(cpu_count()), quarantine_attempts=quarantine_attempts,
+                          heading_term=search_term if section_headings else None)
+
+    if staging_budget is None:
+        ## Download all (max 10,000) the pdfs published on Arxiv in the year 20yy and month mm
+        print(f"Downloading PDFs for {yymm}.")
+        download_folder_transfer_manager(**download_kwargs)
+
+        ## Convert all the pdfs in the yymm directory to text, within the memory budget if there is one
+        print(f"Converting PDFs to TXTs for {yymm}.")
+        convert_directory_parallel(local_folder_path, cpu_count(), **convert_kwargs)
+
+    else:
+        ## Download in the background, and convert the pdfs as they arrive, so that the staged pdfs stay in the budget
+        print(f"Downloading and converting PDFs for {yymm} within a staging budget of {staging_budget}.")
+        create_folder(local_folder_path)
+        staging = StagingArea(local_folder_path, parse_size(staging_budget), parse_size(staging_min_free))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            download = executor.submit(download_folder_transfer_manager, staging=staging, **download_kwargs)
+            download.add_done_callback(lambda _: staging.close())
+
+            try:
+                convert_directory_parallel(local_folder_path, cpu_count(), staging=staging, **convert_kwargs)
+            except BaseException:
+                staging.abort()
+                raise
+
+            ## Raises the error of the download, if any
+            download.result()
+
+        print(f"{staging.report()} for {yymm}.")
+    
+    ## Delete them pdfs if they have been converted to txts
+    print(f"Deleting PDFs for {yymm}.")
+    delete_pdfs_safe(local_folder_path)
+
+    ## Pack the txts into the compressed store of the month, once the pdfs they come from are gone
+    if compress_texts:
+        from scientific_dataset_arxiv.textstore import pack_folder
+        print(f"Compressed {pack_folder(local_folder_path)} TXTs for {yymm}.")
+
+
+## Function to get the settings the txt files depend on
+def convert_params():
+    """
+    Get the config that changes which txt files are produced, to tell the outputs of other settings apart.
+
+    Returns:
+        dict: The settings, JSON serializable.
+    """
+    return {
+        'max_pdfs_per_month': max_pdfs_per_month,
+        'skip_n': skip_n,
+        'pdf_version': pdf_version,
+        'conversion_search_term': conversion_search_term,
+        'quarantine_attempts': quarantine_attempts,
+        'compress_texts': compress_texts,
+        'sample_fraction': sample_fraction,
+        'sample_seed': sample_seed,
+    }
+
+
 ## Creating a list for the year and month
 def create_yymm_list(start_year, end_year):
     """
@@ -188,12 +333,19 @@ def create_yymm_list(start_year, end_year):
 
 if __name__ == '__main__':
 
+    ## Send the conversion logs to logs/fulltext.log
+    setup_logging()
+
     ## Track time
     tic = time()
 
     ## Create a yymm list from the year 2020 to 2023
     yymm_list = create_yymm_list(start_year, end_year)
 
+    ## Only process the months this machine claims, when the work is shared with other machines
+    if lease_dir is not None:
+        yymm_list = claimed_units(yymm_list, LeaseDirectory(os.path.join(lease_dir, 'download_convert'), ttl=lease_ttl, params=convert_params()))
+
     ## loop to download the files, convert them to text and delete the pdfs
     for yymm in yymm_list:
 
@@ -204,17 +356,8 @@ if __name__ == '__main__':
         ## Create a local folder path
         local_folder_path = f'unprocessed_txts_{start_year}_to_{end_year}/{yymm}'
         
-        ## Download all (max 10,000) the pdfs published on Arxiv in the year 20yy and month mm
-        print(f"Downloading PDFs for {yymm}.")
-        download_folder_transfer_manager(bucket_name='arxiv-dataset', bucket_folder_name=f'arxiv/arxiv/pdf/{yymm}', local_folder_path=local_folder_path)
-
-        ## Convert all the pdfs in the yymm directory to text
-        print(f"Converting PDFs to TXTs for {yymm}.")
-        convert_directory_parallel(local_folder_path, cpu_count())
-        
-        ## Delete them pdfs if they have been converted to txts
-        print(f"Deleting PDFs for {yymm}.")
-        delete_pdfs_safe(local_folder_path)
+        ## Download, convert and delete the pdfs of the month
+        download_convert_month(yymm, local_folder_path)
     
     ## Track time
     toc = time()
@@ -2,14 +2,17 @@
 ## The metadata dataframe is then saved to a parquet file
 #####################################################################################################################
 ## Importing the required libraries
-from datasets import load_dataset
-from glob import glob
-import pandas as pd
+## pandas and datasets are imported in the functions using them, so that the workers started with the 'spawn'
+## start method, which import this script again, don't import them
 import os
 from time import time
-from multiprocessing import Pool
 from functools import partial
-from scientific_dataset_arxiv.config import start_year, end_year, search_term
+from scientific_dataset_arxiv.config import start_year, end_year, search_term, section_headings, merge_chunksize, lease_dir, lease_ttl, mp_start_method
+from scientific_dataset_arxiv.config import sample_fraction, sample_seed, pdf_version
+from scientific_dataset_arxiv.leases import LeaseDirectory, claimed_units
+from scientific_dataset_arxiv.stats import STATS_COLUMNS
+from scientific_dataset_arxiv.merge_workers import process_article
+from scientific_dataset_arxiv import merge
 
 ## Function to create a folder if it doesn't exist
 def create_folder(directory_path):
@@ -45,106 +48,77 @@ def create_yy_list(start_year, end_year):
 
     return yy_list
 
-## Function to extract the article from the text file
-def find_text_after_term(content, term):
+## Function to get the settings the yearly files depend on
+def merge_params():
     """
-    Extracts the text after a given term in the content.
-
-    Parameters:
-    content (str): The content to search for the term.
-    term (str): The term to search for.
+    Get the config that changes the yearly files, to tell the outputs of other settings apart.
 
     Returns:
-    str: The text after the term, or None if the term is not found.
+        dict: The settings, JSON serializable.
     """
-    ## Find the index of the term in the content
-    index = content.find(term.lower()) 
-
-    ## If the term is found in the content
-    if index != -1:
-        
-        ## Extract the text after the term
-        selection = content[index:] 
-
-        ## Return the selection
-        return selection
-    
-    else:
-        return None
+    return {'dataset': 'articles', 'search_term': search_term, 'section_headings': section_headings, 'sample_fraction': sample_fraction, 'sample_seed': sample_seed,
+            'pdf_version': pdf_version}
 
-## Function to extract the id from the file path
-def extract_id_from_file(file_path):
+## Function to join the articles of a month with the metadata
+def join_articles(metadata_df, results):
     """
-    Extract the id from the file path.
+    Join the articles extracted from the txt files of a month with the title and abstract of the metadata.
 
     Args:
-        file_path (str): The path of the file.
+        metadata_df (pd.DataFrame): The metadata dataframe of the year.
+        results (list): The results of `process_article`.
 
     Returns:
-        str: The id extracted from the file path.
+        pd.DataFrame: The results of the month, lowercased.
     """
-    ## Extract the original filename from the file path
-    original_filename = os.path.basename(file_path)
+    import pandas as pd
 
-    ## Extract the id from the original filename
-    id_without_version = original_filename.split('v')[0]
+    ## Join the articles with the title and abstract of the metadata
+    month_df = metadata_df[['id', 'title', 'abstract']].merge(pd.DataFrame(results, columns=['id', 'article', *STATS_COLUMNS]), on='id')
 
-    return id_without_version
+    ## Turn the texts of the dataframe to lowercase, the statistics are numbers
+    if not month_df.empty:
+        text_columns = ['id', 'title', 'abstract', 'article']
+        month_df[text_columns] = month_df[text_columns].apply(lambda x: x.str.lower())
 
-## Function to process a file
-def process_file(file_path, metadata_df):
+    return month_df
+
+## Function to create the dataset of a year
+def merge_year(yy, txt_folder, dataset_file, keep_parts=False):
     """
-    Process a file and extract metadata.
+    Merge the metadata of a year with the articles extracted from its txt files, and save it to a parquet file.
+
+    Every month is saved to a part file as soon as it is done, so a crashed run resumes from the last completed
+    month, see `scientific_dataset_arxiv.merge.merge_year`.
 
     Args:
-        file_path (str): The path of the file to be processed.
-        metadata_df (pd.DataFrame): The metadata dataframe.
+        yy (str): The year in two-digit format.
+        txt_folder (str): The folder holding the txt files in yymm subfolders.
+        dataset_file (str): The path of the parquet file to write.
+        keep_parts (bool, optional): Keep the part files of the months once compacted. Defaults to False.
 
     Returns:
-        pd.DataFrame: The processed metadata as a dataframe.
+        int: The number of rows of the dataset, or None if no file could be processed.
     """
-    ## Extract the id from the file path
-    id_without_version = extract_id_from_file(file_path)
-
-    ## Add a try except block to handle the UnicodeDecodeError or a general error
-    try:
-        ## Open the file and read the content
-        with open(file_path, 'r', encoding='utf-8') as rf:
-            content = rf.read().lower() ## Convert the content to lower case
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-        return None
-    
-    ## Find the text after the term 'introduction'
-    article = find_text_after_term(content, search_term)
-
-    ## Get the metadata for the id
-    metadata = metadata_df[metadata_df['id'] == id_without_version]
+    # Create a new function with the search term as a default argument
+    process = partial(process_article, term=search_term, sections=section_headings)
 
-    ## If the metadata is found
-    if not metadata.empty and article is not None:
-
-        ## Get the title, abstract and article in lower case
-        title = metadata['title'].values[0]
-        abstract = metadata['abstract'].values[0]
-
-        ## Create a new row
-        new_row = pd.DataFrame({'id': [id_without_version], 'title': [title], 'abstract': [abstract], 'article': [article]}, index=[0])
-
-        return new_row
-    else:
-        print(f"Metadata or Article not found for {file_path}")
-        return None
+    return merge.merge_year(yy, txt_folder, dataset_file, process, join_articles, chunksize=merge_chunksize, start_method=mp_start_method,
+                            sample_fraction=sample_fraction, sample_seed=sample_seed, keep_parts=keep_parts, version=pdf_version)
 
 
 ## Main code
 
-yy_list = create_yy_list(start_year, end_year)
+if __name__ == '__main__':
 
-dataset_path = f'arxiv_dataset_{start_year}_to_{end_year}'
-create_folder(dataset_path)
+    yy_list = create_yy_list(start_year, end_year)
 
-if __name__ == '__main__':
+    ## Only process the years this machine claims, when the work is shared with other machines
+    if lease_dir is not None:
+        yy_list = claimed_units(yy_list, LeaseDirectory(os.path.join(lease_dir, 'merge_articles'), ttl=lease_ttl, params=merge_params()))
+
+    dataset_path = f'arxiv_dataset_{start_year}_to_{end_year}'
+    create_folder(dataset_path)
 
     ## Track time
     tic = time()
@@ -152,61 +126,12 @@ if __name__ == '__main__':
     for yy in yy_list:
 
         ## Skip datasets that have already been processed
-        if os.path.exists(f'{dataset_path}/arxiv_dataset_20{yy}.parquet'):
+        dataset_file = f'{dataset_path}/arxiv_dataset_20{yy}.parquet'
+        if os.path.exists(dataset_file):
             print(f'Dataset for 20{yy} already exists. Skipping...')
             continue
 
-        ## Load the trimmed dataframe into memory
-        print('Loading the trimmed metadata dataframe into memory')
-
-        REPO_ID = "bluuebunny/arxiv_metadata_by_year"
-        FILENAME = f'data/arxiv_metadata_20{yy}.parquet'
-        dataset = load_dataset(REPO_ID, data_files=FILENAME, verification_mode='no_checks')
-
-        metadata_df = dataset['train'].to_pandas()
-
-
-        ## Get a list of all txt files from the extracted_articles
-        txt_files = glob(f'unprocessed_txts_{start_year}_to_{end_year}/{yy}*/**/*.txt', recursive=True)
-        txt_files.sort()
-
-        ## Track the progress
-        print(f'Processing {len(txt_files)} files')
-
-        ## Process the files in parallel
-        pool = Pool()
-
-        # Create a new function with metadata_df as a default argument
-        process_file_with_metadata = partial(process_file, metadata_df=metadata_df)
-        
-        # Use the new function with pool.map
-        results = pool.map(process_file_with_metadata, txt_files)
-
-        # Close the pool and wait for all worker processes to finish
-        pool.close()
-        pool.join()
-
-        ## Concatenate the results into a single dataframe
-        try:
-            dataset_df = pd.concat([res for res in results if res is not None], ignore_index=True)
-        except Exception as e:
-            print(f"Error concatenating results: {e}")
-            continue
-        
-        ## Remove duplicates
-        dataset_df.drop_duplicates(subset=['id'], keep='last', inplace=True)
-
-        ## Turn the contents of the dataframe to lowercase
-        print('Turning the contents of the dataframe to lowercase')
-        dataset_df = dataset_df.apply(lambda x: x.str.lower())
-
-        ## Save the dataset dataframe to a parquet file
-        print('Saving the dataset dataframe to a parquet file')
-        dataset_file = f'{dataset_path}/arxiv_dataset_20{yy}.parquet'
-        dataset_df.to_parquet(dataset_file, index=False)
-
-        ## Print the shape of the dataset dataframe
-        print(f'Shape of dataset dataframe: {dataset_df.shape}')
+        merge_year(yy, f'unprocessed_txts_{start_year}_to_{end_year}', dataset_file)
 
     ## Track the time
     toc = time()
@@ -1,14 +1,17 @@
 ## This file takes all the unprocessed text files and then merges them into a single parquet file by the year.
 #####################################################################################################################
 ## Importing the required libraries
-from datasets import load_dataset
-from glob import glob
-import pandas as pd
+## pandas and datasets are imported in the functions using them, so that the workers started with the 'spawn'
+## start method, which import this script again, don't import them
 import os
 from time import time
-from multiprocessing import Pool
 from functools import partial
-from scientific_dataset_arxiv.config import start_year, end_year
+from scientific_dataset_arxiv.config import start_year, end_year, search_term, merge_chunksize, lease_dir, lease_ttl, mp_start_method
+from scientific_dataset_arxiv.config import sample_fraction, sample_seed, pdf_version
+from scientific_dataset_arxiv.leases import LeaseDirectory, claimed_units
+from scientific_dataset_arxiv.stats import STATS_COLUMNS
+from scientific_dataset_arxiv.merge_workers import process_fulltext
+from scientific_dataset_arxiv import merge
 
 ## Function to create a folder if it doesn't exist
 def create_folder(directory_path):
@@ -44,75 +47,69 @@ def create_yy_list(start_year, end_year):
 
     return yy_list
 
-## Function to extract the id from the file path
-def extract_id_from_file(file_path):
+## Function to get the settings the yearly files depend on
+def merge_params():
     """
-    Extract the id from the file path.
+    Get the config that changes the yearly files, to tell the outputs of other settings apart.
+
+    Returns:
+        dict: The settings, JSON serializable.
+    """
+    return {'dataset': 'raw', 'search_term': search_term, 'sample_fraction': sample_fraction, 'sample_seed': sample_seed,
+            'pdf_version': pdf_version}
+
+## Function to join the full texts of a month with the metadata
+def join_fulltexts(metadata_df, results):
+    """
+    Join the full texts of the txt files of a month and their statistics with the metadata.
 
     Args:
-        file_path (str): The path of the file.
+        metadata_df (pd.DataFrame): The metadata dataframe of the year.
+        results (list): The results of `process_fulltext`.
 
     Returns:
-        str: The id extracted from the file path.
+        pd.DataFrame: The results of the month.
     """
-    ## Extract the original filename from the file path
-    original_filename = os.path.basename(file_path)
-
-    ## Extract the id from the original filename
-    id_without_version = original_filename.split('v')[0]
+    import pandas as pd
 
-    return id_without_version
+    return metadata_df.merge(pd.DataFrame(results, columns=['id', 'fulltext', *STATS_COLUMNS]), on='id')
 
-## Function to process a file
-def process_file(file_path, metadata_df):
+## Function to create the dataset of a year
+def merge_year(yy, txt_folder, dataset_file, keep_parts=False):
     """
-    Process a file and extract metadata.
+    Merge the metadata of a year with the full text of its txt files, and save it to a parquet file.
+
+    Every month is saved to a part file as soon as it is done, so a crashed run resumes from the last completed
+    month, see `scientific_dataset_arxiv.merge.merge_year`.
 
     Args:
-        file_path (str): The path of the file to be processed.
-        metadata_df (pd.DataFrame): The metadata dataframe.
+        yy (str): The year in two-digit format.
+        txt_folder (str): The folder holding the txt files in yymm subfolders.
+        dataset_file (str): The path of the parquet file to write.
+        keep_parts (bool, optional): Keep the part files of the months once compacted. Defaults to False.
 
     Returns:
-        pd.DataFrame: The processed metadata as a dataframe.
+        int: The number of rows of the dataset, or None if no file could be processed.
     """
-    ## Extract the id from the file path
-    id_without_version = extract_id_from_file(file_path)
-
-    ## Get the metadata for the id
-    metadata = metadata_df[metadata_df['id'] == id_without_version]
-
-    ## If the metadata is found
-    if not metadata.empty:
-        ## Add a try except block to handle the UnicodeDecodeError or a general error
-        try:
-            ## Get the plain text from the file
-            with open(file_path, 'r', encoding='utf-8') as rf:
-                plain_txt = rf.read()
-
-            ## Add the article to the metadata only if it's not empty
-            if plain_txt.strip():
-                new_row = metadata.copy()
-                new_row['fulltext'] = plain_txt
-                return new_row
-            else:
-                print(f"Empty text for {id_without_version}")
-                return None
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
-            return None
-    else:
-        print(f"Metadata not found for {id_without_version}")
-        return None
+    # Create a new function with the search term, whose offset goes into the statistics
+    process = partial(process_fulltext, term=search_term)
+
+    return merge.merge_year(yy, txt_folder, dataset_file, process, join_fulltexts, chunksize=merge_chunksize, start_method=mp_start_method,
+                            sample_fraction=sample_fraction, sample_seed=sample_seed, keep_parts=keep_parts, version=pdf_version)
 
 
 ## Main code
 
-yy_list = create_yy_list(start_year, end_year)
+if __name__ == '__main__':
 
-dataset_path = f'arxiv_raw_dataset_{start_year}_to_{end_year}'
-create_folder(dataset_path)
+    yy_list = create_yy_list(start_year, end_year)
 
-if __name__ == '__main__':
+    ## Only process the years this machine claims, when the work is shared with other machines
+    if lease_dir is not None:
+        yy_list = claimed_units(yy_list, LeaseDirectory(os.path.join(lease_dir, 'merge_raw'), ttl=lease_ttl, params=merge_params()))
+
+    dataset_path = f'arxiv_raw_dataset_{start_year}_to_{end_year}'
+    create_folder(dataset_path)
 
     ## Track time
     tic = time()
@@ -125,57 +122,7 @@ if __name__ == '__main__':
             print(f"Dataset for 20{yy} already exists. Skipping.")
             continue
 
-        ## Load the trimmed dataframe into memory
-        print('Loading the trimmed metadata dataframe into memory')
-
-        REPO_ID = "bluuebunny/arxiv_metadata_by_year"
-        FILENAME = f'data/arxiv_metadata_20{yy}.parquet'
-        dataset = load_dataset(REPO_ID, data_files=FILENAME, verification_mode='no_checks')
-
-        metadata_df = dataset['train'].to_pandas()
-
-
-        ## Get a list of all txt files from the unprocessed_txts
-        txt_files = glob(f'unprocessed_txts_{start_year}_to_{end_year}/{yy}*/**/*.txt', recursive=True)
-        txt_files.sort()
-
-        ## Track the progress
-        print(f'Processing {len(txt_files)} files')
-
-        ## Process the files in parallel
-        pool = Pool()
-
-        # Create a new function with metadata_df as a default argument
-        process_file_with_metadata = partial(process_file, metadata_df=metadata_df)
-        
-        # Use the new function with pool.map
-        results = pool.map(process_file_with_metadata, txt_files)
-
-        # Close the pool and wait for all worker processes to finish
-        pool.close()
-        pool.join()
-
-        ## Concatenate the results into a single dataframe
-        try:
-            dataset_df = pd.concat([res for res in results if res is not None], ignore_index=True)
-        except Exception as e:
-            print(f"Error concatenating results for 20{yy}: {e}")
-            continue
-        
-        ## Remove duplicates
-        dataset_df.drop_duplicates(subset=['id'], keep='last', inplace=True)
-
-        # ## Turn the contents of the dataframe to lowercase
-        # print('Turning the contents of the dataframe to lowercase')
-        # dataset_df = dataset_df.apply(lambda x: x.str.lower())
-
-        ## Save the dataset dataframe to a parquet file
-        print('Saving the dataset dataframe to a parquet file')
-        dataset_file = f'{dataset_path}/arxiv_raw_dataset_20{yy}.parquet'
-        dataset_df.to_parquet(dataset_file, index=False)
-
-        ## Print the shape of the dataset dataframe
-        print(f'Shape of dataset dataframe: {dataset_df.shape}')
+        merge_year(yy, f'unprocessed_txts_{start_year}_to_{end_year}', dataset_file)
 
     ## Track the time
     toc = time()
@@ -4,7 +4,7 @@ import os
 import pandas as pd
 from time import time
 from glob import glob
-from scientific_dataset_arxiv.config import start_year, end_year
+from scientific_dataset_arxiv.config import start_year, end_year, near_duplicate_threshold, mp_start_method
 
 def create_folder(directory_path):
     """
@@ -16,19 +16,82 @@ def create_folder(directory_path):
     if not os.path.exists(directory_path):
         os.makedirs(directory_path)
 
-def merge_parquet_files(directory_path, output_file_path):
+def merge_parquet_files(directory_path, output_file_path, threshold=None):
     """
     Merge all the parquet files in a directory into a single parquet file.
 
     Args:
         directory_path (str): The path of the directory containing the parquet files.
         output_file_path (str): The path of the output merged parquet file.
+        threshold (float, optional): Leave out the near-duplicates above this similarity. Defaults to None, keep them.
     """
     parquet_files = glob(f"{directory_path}/**/*.parquet", recursive=True)
+
+    ## Don't merge the output of a previous run into itself, nor the monthly parts of an unfinished year
+    parquet_files = [file for file in parquet_files if os.path.abspath(file) != os.path.abspath(output_file_path)]
+    parquet_files = [file for file in parquet_files if not os.path.dirname(file).endswith('_parts')]
+    parquet_files.sort()
+
+    exclude_ids = None
+    if threshold is not None:
+        exclude_ids = find_near_duplicates(parquet_files, near_duplicates_file(output_file_path), threshold)
+
+    merge_parquet_file_list(parquet_files, output_file_path, exclude_ids)
+
+def near_duplicates_file(output_file_path):
+    """
+    Get the path of the near-duplicate index kept next to a merged parquet file.
+
+    Args:
+        output_file_path (str): The path of the output merged parquet file.
+
+    Returns:
+        str: The path of the index.
+    """
+    return os.path.join(os.path.dirname(output_file_path), 'near_duplicates.sqlite')
+
+def find_near_duplicates(parquet_files, index_file, threshold):
+    """
+    Index the parquet files for near-duplicates, and save the list of near-duplicates to a csv file next to the index.
+
+    The index only grows with the files that weren't indexed yet, the earliest text of a group of near-duplicates
+    is kept.
+
+    Args:
+        parquet_files (list): The paths of the parquet files, in order.
+        index_file (str): The path of the index.
+        threshold (float): The similarity above which two texts are near-duplicates.
+
+    Returns:
+        set: The ids of the near-duplicates.
+    """
+    from scientific_dataset_arxiv.neardup import index_files
+
+    duplicates = index_files(index_file, parquet_files, threshold, start_method=mp_start_method)
+
+    csv_file = os.path.splitext(index_file)[0] + '.csv'
+    pd.DataFrame(duplicates, columns=['id', 'duplicate_of', 'similarity']).to_csv(csv_file, index=False)
+    print(f"Found {len(duplicates)} near-duplicates, listed in {csv_file}")
+
+    return {row[0] for row in duplicates}
+
+def merge_parquet_file_list(parquet_files, output_file_path, exclude_ids=None):
+    """
+    Merge a list of parquet files into a single parquet file.
+
+    Args:
+        parquet_files (list): The paths of the parquet files to merge.
+        output_file_path (str): The path of the output merged parquet file.
+        exclude_ids (set, optional): The ids of the rows to leave out, e.g. near-duplicates.
+    """
     df = pd.read_parquet(parquet_files[0])
     for file in parquet_files[1:]:
         temp_df = pd.read_parquet(file)
         df = pd.concat([df, temp_df], ignore_index=True)
+
+    if exclude_ids:
+        df = df[~df['id'].isin(exclude_ids)]
+
     df.to_parquet(output_file_path, index=False)
     print(f"Successfully merged all the parquet files to {output_file_path}")
 
@@ -39,7 +102,7 @@ if __name__ == '__main__':
 
     directory_path = f'arxiv_dataset_{start_year}_to_{end_year}'
     output_file_path = os.path.join(directory_path, 'merged_articles.parquet')
-    merge_parquet_files(directory_path, output_file_path)
+    merge_parquet_files(directory_path, output_file_path, near_duplicate_threshold)
 
     ## Print the time taken
     toc = time()
@@ -0,0 +1,73 @@
+## This script publishes the datasets to the Hugging Face Hub, in place of the upload notebook.
+## The yearly parquet files (and the txt files of every month, for the dump repo) are cut into shards of
+## publish_shard_size in a staging folder, and only the shards that changed since the last run are uploaded, in
+## parallel. An interrupted run picks up where it stopped. The repos are set in scientific_dataset_arxiv/config.py.
+##
+## The token is read from the HUGGINGFACE_TOKEN environment variable. To try it without the Hub, set
+## publish_endpoint to a local folder, where the repos are written instead.
+#####################################################################################################################
+## Importing the required libraries
+import os
+import logging
+from time import time
+from scientific_dataset_arxiv.config import (start_year, end_year, publish_repo_id, publish_raw_repo_id, publish_txt_repo_id,
+                                             publish_shard_size, publish_workers, publish_endpoint, publish_staging_dir)
+from scientific_dataset_arxiv.governor import parse_size
+from scientific_dataset_arxiv.publish import open_repo, publish
+from merge_metadata_articles_by_year import create_yy_list
+
+#####################################################################################################################
+## Functions
+
+## Function to publish files to a repo
+def publish_to_repo(repo_id, sources, staging_root=publish_staging_dir):
+    """
+    Publish files or folders to a dataset repo, under its data folder.
+
+    Args:
+        repo_id (str): The repo.
+        sources (list): The parquet files or folders to publish, the missing ones are skipped.
+        staging_root (str, optional): The folder of the shards of every repo. Defaults to publish_staging_dir.
+
+    Returns:
+        int: The number of shards uploaded.
+    """
+    repo = open_repo(repo_id, publish_endpoint)
+    staging_dir = os.path.join(staging_root, repo_id)
+    uploaded = publish(repo, sources, staging_dir, parse_size(publish_shard_size), publish_workers)
+    print(f"Uploaded {uploaded} shards to {repo_id}")
+    return uploaded
+
+
+#####################################################################################################################
+#####################################################################################################################
+
+## Main code
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    ## Track time
+    tic = time()
+
+    yy_list = create_yy_list(start_year, end_year)
+
+    if publish_repo_id is not None:
+        dataset_path = f'arxiv_dataset_{start_year}_to_{end_year}'
+        publish_to_repo(publish_repo_id, [f'{dataset_path}/arxiv_dataset_20{yy}.parquet' for yy in yy_list])
+
+    if publish_raw_repo_id is not None:
+        dataset_path = f'arxiv_raw_dataset_{start_year}_to_{end_year}'
+        publish_to_repo(publish_raw_repo_id, [f'{dataset_path}/arxiv_raw_dataset_20{yy}.parquet' for yy in yy_list])
+
+    if publish_txt_repo_id is not None:
+        txt_folder = f'unprocessed_txts_{start_year}_to_{end_year}'
+        if os.path.isdir(txt_folder):
+            publish_to_repo(publish_txt_repo_id, sorted(os.path.join(txt_folder, yymm) for yymm in os.listdir(txt_folder)))
+        else:
+            print(f"No txt files to publish to {publish_txt_repo_id}, {txt_folder} doesn't exist")
+
+    ## Track time
+    toc = time()
+    print(f"Time taken: {toc - tic:.2f} seconds")
@@ -0,0 +1,241 @@
+## This script runs the whole pipeline: download and convert the pdfs of every month, merge them with the metadata
+## by year, find the near-duplicates across the years, and merge the years into a single parquet file. The search
+## index of the years is built too if enabled in the config, and the outputs are published to the Hub repos set in
+## the config.
+## Every stage is fingerprinted from the config it depends on and the outputs of the stages before it, and is skipped
+## when it is up to date. Re-running after a config tweak only recomputes the stages the tweak affects.
+##
+## Usage:
+##   python run_pipeline.py                      # articles dataset, as merge_metadata_articles_by_year.py
+##   python run_pipeline.py --dataset raw        # raw dataset, as merge_metadata_unprocessed_by_year.py
+##   python run_pipeline.py --dry-run            # show which stages would run
+##   python run_pipeline.py --force convert/2312 # re-run a stage (and what depends on it), e.g. for the current month
+#####################################################################################################################
+## Importing the required libraries
+import os
+import argparse
+from time import time
+from scientific_dataset_arxiv.stages import Stage, StageCache, clear_outputs, run_stages
+from scientific_dataset_arxiv import config
+
+#####################################################################################################################
+## Functions
+
+## Settings of the convert stages whose change invalidates outputs: the PDFs rejected for not holding the term
+## The others only add work (e.g. max_pdfs_per_month, sample_fraction, pdf_version, the merge picks the version) or
+## change how the txt files are kept, so the txt files of the previous settings are kept
+INVALIDATING_CONVERT_PARAMS = {'conversion_search_term': ('search_term',)}
+
+## Function to clear the outputs of a month invalidated by a change of settings
+def clean_month(local_folder_path, changed):
+    """
+    Clear the rejections of a month that the changed settings invalidate, the txt files and stores are kept.
+
+    Args:
+        local_folder_path (str): The folder of the month.
+        changed (set): The changed settings, see `run_stages`.
+    """
+    from scientific_dataset_arxiv.fulltext import clear_rejections
+
+    reasons = [reason for param in changed for reason in INVALIDATING_CONVERT_PARAMS.get(param, ())]
+    if reasons:
+        print(f'Cleared {clear_rejections(local_folder_path, reasons)} rejections of {os.path.basename(local_folder_path)}.')
+
+## Function to clear the monthly parts of a year invalidated by a change of settings or months
+def clean_year(dataset_file, changed):
+    """
+    Clear the monthly parts of a year that must be merged again: every part when the merge settings changed, or only
+    the parts of the months whose txt files changed. The yearly file is replaced once the parts are compacted.
+
+    Args:
+        dataset_file (str): The path of the yearly parquet file.
+        changed (set): The changed settings and convert stages, e.g. 'convert/0704', see `run_stages`.
+    """
+    from scientific_dataset_arxiv.checkpoints import parts_folder, part_file
+
+    if any(not name.startswith('convert/') for name in changed):
+        clear_outputs([parts_folder(dataset_file)])
+    else:
+        clear_outputs([path for path in (part_file(dataset_file, name.split('/')[1]) for name in changed) if os.path.exists(path)])
+
+## Function to create the stages of the pipeline
+def build_stages(dataset, data_dir):
+    """
+    Create the stages of the pipeline for the years in the config.
+
+    The folders don't depend on the year range, so that changing it only adds or removes stages:
+    {data_dir}/unprocessed_txts/{yymm} for the txt files, and {data_dir}/arxiv_dataset (or arxiv_raw_dataset)
+    for the yearly and merged parquet files.
+
+    Args:
+        dataset (str): 'articles' for the text after the search term, or 'raw' for the full text.
+        data_dir (str): The folder holding every output of the pipeline.
+
+    Returns:
+        list: The stages.
+    """
+    ## Imported here so that --help doesn't pull the heavy dependencies
+    from download_convert import create_folder, create_yymm_list, download_convert_month, convert_params
+    from merge_parquet import merge_parquet_file_list, near_duplicates_file, find_near_duplicates
+
+    if dataset == 'articles':
+        from merge_metadata_articles_by_year import merge_year, merge_params
+        dataset_prefix = 'arxiv_dataset'
+    elif dataset == 'raw':
+        ## The search term only goes into the search_term_offset statistics column
+        from merge_metadata_unprocessed_by_year import merge_year, merge_params
+        dataset_prefix = 'arxiv_raw_dataset'
+    else:
+        raise ValueError(f'Unknown dataset: {dataset}')
+
+    txt_folder = os.path.join(data_dir, 'unprocessed_txts')
+    dataset_path = os.path.join(data_dir, dataset_prefix)
+    create_folder(dataset_path)
+
+    stages = []
+    merge_stage_names = []
+    dataset_files = []
+
+    yymm_list = create_yymm_list(config.start_year, config.end_year)
+    yy_list = sorted(set(yymm[:2] for yymm in yymm_list))
+
+    for yymm in yymm_list:
+        local_folder_path = os.path.join(txt_folder, yymm)
+        stages.append(Stage(
+            name=f'convert/{yymm}',
+            run=lambda yymm=yymm, local_folder_path=local_folder_path: download_convert_month(yymm, local_folder_path),
+            outputs=[local_folder_path],
+            params=dict(convert_params(), yymm=yymm),
+            patterns=('.txt', '.json', '.rejected', '.sqlite'),
+            ## Only the PDFs rejected for another search term, the txt files are still valid
+            clean=lambda changed, local_folder_path=local_folder_path: clean_month(local_folder_path, changed),
+        ))
+
+    for yy in yy_list:
+        dataset_file = os.path.join(dataset_path, f'{dataset_prefix}_20{yy}.parquet')
+        stages.append(Stage(
+            name=f'merge/{dataset}/{yy}',
+            ## The monthly parts are kept, so that only the months that changed are merged again
+            run=lambda yy=yy, dataset_file=dataset_file: merge_year(yy, txt_folder, dataset_file, keep_parts=True),
+            outputs=[dataset_file],
+            params=dict(merge_params(), yy=yy),
+            deps=[f'convert/{yymm}' for yymm in yymm_list if yymm.startswith(yy)],
+            ## The parts of the months that changed would be reused otherwise
+            clean=lambda changed, dataset_file=dataset_file: clean_year(dataset_file, changed),
+        ))
+        merge_stage_names.append(f'merge/{dataset}/{yy}')
+        dataset_files.append(dataset_file)
+
+    merged_file = os.path.join(dataset_path, 'merged_articles.parquet')
+    index_file = near_duplicates_file(merged_file)
+    merge_deps = list(merge_stage_names)
+
+    def existing_dataset_files():
+        ## Years without any article have no parquet file
+        return [file for file in dataset_files if os.path.exists(file)]
+
+    if config.near_duplicate_threshold is not None:
+        ## The index only indexes the years it hasn't seen yet
+        stages.append(Stage(
+            name=f'neardup/{dataset}',
+            run=lambda: find_near_duplicates(existing_dataset_files(), index_file, config.near_duplicate_threshold),
+            outputs=[index_file],
+            params={'years': yy_list, 'near_duplicate_threshold': config.near_duplicate_threshold},
+            deps=merge_stage_names,
+        ))
+        merge_deps.append(f'neardup/{dataset}')
+
+    if config.search_index:
+        from scientific_dataset_arxiv.search import index_files as index_search
+
+        ## Only the months that changed are indexed again
+        stages.append(Stage(
+            name=f'search/{dataset}',
+            run=lambda: index_search(os.path.join(dataset_path, 'search_index.sqlite'), existing_dataset_files()),
+            outputs=[os.path.join(dataset_path, 'search_index.sqlite')],
+            params={'years': yy_list},
+            deps=merge_stage_names,
+        ))
+
+    ## The yearly files go to the repo of the dataset, the txt files of every month to the dump repo
+    publish_repo_id = config.publish_repo_id if dataset == 'articles' else config.publish_raw_repo_id
+    staging_root = os.path.join(data_dir, config.publish_staging_dir)
+    publish_params = {'years': yy_list, 'publish_shard_size': config.publish_shard_size, 'publish_endpoint': config.publish_endpoint}
+
+    if publish_repo_id is not None:
+        from publish_to_hf import publish_to_repo
+        stages.append(Stage(
+            name=f'publish/{dataset}',
+            run=lambda: publish_to_repo(publish_repo_id, dataset_files, staging_root),
+            outputs=[os.path.join(staging_root, publish_repo_id, 'manifest.json')],
+            params=dict(publish_params, repo_id=publish_repo_id),
+            deps=merge_stage_names,
+        ))
+
+    if config.publish_txt_repo_id is not None:
+        from publish_to_hf import publish_to_repo
+        month_folders = [os.path.join(txt_folder, yymm) for yymm in yymm_list]
+        stages.append(Stage(
+            name='publish/txt',
+            run=lambda: publish_to_repo(config.publish_txt_repo_id, month_folders, staging_root),
+            outputs=[os.path.join(staging_root, config.publish_txt_repo_id, 'manifest.json')],
+            params=dict(publish_params, repo_id=config.publish_txt_repo_id),
+            deps=[f'convert/{yymm}' for yymm in yymm_list],
+        ))
+
+    def merge_all():
+        parquet_files = existing_dataset_files()
+        if not parquet_files:
+            return
+
+        exclude_ids = None
+        if config.near_duplicate_threshold is not None:
+            from scientific_dataset_arxiv.neardup import NearDuplicateIndex
+            with NearDuplicateIndex(index_file, config.near_duplicate_threshold) as index:
+                exclude_ids = index.duplicate_ids()
+
+        merge_parquet_file_list(parquet_files, merged_file, exclude_ids)
+
+    stages.append(Stage(
+        name=f'merge_parquet/{dataset}',
+        run=merge_all,
+        outputs=[merged_file],
+        params={'years': yy_list, 'near_duplicate_threshold': config.near_duplicate_threshold},
+        deps=merge_deps,
+    ))
+
+    return stages
+
+
+#####################################################################################################################
+#####################################################################################################################
+
+## Main code
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run the stages of the pipeline that are out of date.')
+    parser.add_argument('--dataset', choices=['articles', 'raw'], default='articles', help='Which dataset to build.')
+    parser.add_argument('--data-dir', default='.', help='The folder holding every output of the pipeline.')
+    parser.add_argument('--force', action='append', default=[], metavar='PREFIX', help='Re-run the stages starting with PREFIX, e.g. convert/2312 or merge/articles/.')
+    parser.add_argument('--dry-run', action='store_true', help='Only show which stages would run.')
+    args = parser.parse_args()
+
+    ## Send the conversion logs to logs/fulltext.log
+    from scientific_dataset_arxiv.fulltext import setup_logging
+    setup_logging()
+
+    ## Track time
+    tic = time()
+
+    stages = build_stages(args.dataset, args.data_dir)
+
+    ## Both datasets share the record, and so the convert stages
+    cache = StageCache(os.path.join(args.data_dir, '.pipeline.json'))
+    ran = run_stages(stages, cache, force=args.force, dry_run=args.dry_run)
+
+    print(f"{len(ran)} of {len(stages)} stages {'would run' if args.dry_run else 'ran'}.")
+
+    ## Track time
+    toc = time()
+    print(f"Time taken: {toc - tic:.2f} seconds.")
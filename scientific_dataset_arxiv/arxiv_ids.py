@@ -0,0 +1,95 @@
+#####################################################################################################################
+## Helpers to work with arxiv ids and the versions stored in the bucket, e.g. arxiv/arxiv/pdf/0704/0704.0001v2.pdf
+## Old style ids are stored without their slash, e.g. arxiv/arxiv/pdf/0701/math0701001v1.pdf for math/0701001, and are
+## given back in the form of the metadata.
+
+import os
+import re
+
+#####################################################################################################################
+
+## Matches the file name of a versioned arxiv id, new style (e.g. 0704.0001v2.pdf or 1501.00001v1.txt) or old style,
+## possibly with a subject class (e.g. math0701001v1.pdf or math.GT0309136v2.pdf)
+VERSIONED_ID = re.compile(r'^(?:(?P<id>\d{4}\.\d{4,5})|(?P<archive>[a-z\-]+)(?:\.[A-Z]{2})?(?P<number>\d{7}))(?:v(?P<version>\d+))?(?:\.\w+)?$')
+
+#####################################################################################################################
+
+## Function to split a path into the arxiv id and its version
+def split_id_version(path):
+    """
+    Split the file name of a path into the arxiv id and its version.
+
+    Args:
+        path (str): A blob name or a local path, e.g. 'arxiv/arxiv/pdf/0704/0704.0001v2.pdf'.
+
+    Returns:
+        tuple: The id without version and the version as an int, e.g. ('0704.0001', 2). Old style ids are in the
+               form of the metadata, without subject class, e.g. ('math/0701001', 1) for 'math0701001v1.pdf'.
+               The version is None if the file name does not carry one.
+    """
+    filename = os.path.basename(path)
+
+    match = VERSIONED_ID.match(filename)
+    if match is None:
+        return os.path.splitext(filename)[0], None
+
+    arxiv_id = match.group('id') or '{}/{}'.format(match.group('archive'), match.group('number'))
+    version = match.group('version')
+    return arxiv_id, int(version) if version is not None else None
+
+## Function to keep one version per arxiv id
+def select_versions(paths, version='latest'):
+    """
+    Keep a single version of every arxiv id in a list of paths.
+
+    Args:
+        paths (list): Blob names or local paths of versioned files.
+        version (str or int, optional): Which version to keep per id.
+            'latest' keeps the highest version, 'first' the lowest one, and an int keeps that exact version,
+            falling back to the latest one when the id was never revised that far.
+            None keeps every version. Defaults to 'latest'.
+
+    Returns:
+        list: The selected paths, in the order they first appeared in `paths`.
+    """
+    if version is None:
+        return list(paths)
+
+    if version not in ('latest', 'first') and not isinstance(version, int):
+        raise ValueError(f"Unknown version selection: {version!r}")
+
+    ## Map every id to the path that should be kept
+    selected = {}
+    order = []
+    for path in paths:
+        arxiv_id, file_version = split_id_version(path)
+
+        if arxiv_id not in selected:
+            selected[arxiv_id] = (file_version, path)
+            order.append(arxiv_id)
+            continue
+
+        kept_version, _ = selected[arxiv_id]
+
+        ## Files without a version can't be compared, keep the first one seen
+        if file_version is None or kept_version is None:
+            continue
+
+        if version == 'first':
+            replace = file_version < kept_version
+        elif version == 'latest':
+            replace = file_version > kept_version
+        else:
+            ## Exact version wins, otherwise prefer the latest one as a fallback
+            replace = kept_version != version and (file_version == version or file_version > kept_version)
+
+        if replace:
+            selected[arxiv_id] = (file_version, path)
+
+    return [selected[arxiv_id][1] for arxiv_id in order]
+
+## Function to get the month of an id
+def id_month(id_):
+    """ The yymm of an id like '0704.0001' or 'math/0701001', 'other' for the ids without one """
+    prefix = id_.split('/')[-1][:4]
+    return prefix if prefix.isdigit() else 'other'
@@ -0,0 +1,100 @@
+#####################################################################################################################
+
+## Per-month part files of the merge scripts
+## The results of every month are flushed to `{dataset}_parts/{yymm}.parquet` as soon as the month is done, so that a
+## crashed year resumes from the last completed month. Once every month is done, the parts are compacted into the
+## yearly parquet file and removed, or kept so that only the months that changed are merged again on the next run.
+## pandas and pyarrow are imported in the functions, see the note at the top of the merge scripts.
+
+import os
+import shutil
+from glob import glob
+
+#####################################################################################################################
+
+## Function to get the folder holding the parts of a dataset file
+def parts_folder(dataset_file):
+    """
+    Get the folder holding the part files of a dataset file.
+
+    Args:
+        dataset_file (str): The path of the yearly parquet file.
+
+    Returns:
+        str: The path of the folder, e.g. 'arxiv_dataset_2007_parts' for 'arxiv_dataset_2007.parquet'.
+    """
+    return os.path.splitext(dataset_file)[0] + '_parts'
+
+## Function to get the path of the part of a month
+def part_file(dataset_file, yymm):
+    """
+    Get the path of the part file of a month.
+
+    Args:
+        dataset_file (str): The path of the yearly parquet file.
+        yymm (str): The month.
+
+    Returns:
+        str: The path of the part file.
+    """
+    return os.path.join(parts_folder(dataset_file), f'{yymm}.parquet')
+
+## Function to save the part of a month
+def write_part(df, dataset_file, yymm):
+    """
+    Save the results of a month, atomically so that a crash never leaves a truncated part behind.
+
+    Args:
+        df (pd.DataFrame): The results of the month, possibly empty.
+        dataset_file (str): The path of the yearly parquet file.
+        yymm (str): The month.
+    """
+    path = part_file(dataset_file, yymm)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+## Function to merge the parts into the yearly file
+def compact_parts(dataset_file, keep_parts=False):
+    """
+    Append the parts of a year to the yearly parquet file, one part at a time, and remove them unless kept.
+
+    Only a month is held in memory at once. The months don't share papers, so there are no duplicates to drop across
+    parts. The parts are cast to a common schema, e.g. for a column that is all null in a month.
+
+    Args:
+        dataset_file (str): The path of the yearly parquet file.
+        keep_parts (bool, optional): Keep the parts, to merge again only the months whose part is removed.
+            Defaults to False.
+
+    Returns:
+        int: The number of rows of the dataset, or None if the parts hold no row.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    part_files = sorted(glob(os.path.join(parts_folder(dataset_file), '*.parquet')))
+    part_files = [file for file in part_files if pq.read_metadata(file).num_rows > 0]
+
+    if not part_files:
+        return None
+
+    ## A single schema for the year, read from the footers of the parts
+    schema = pa.unify_schemas([pq.read_schema(file) for file in part_files], promote_options='permissive')
+
+    ## Save the dataset to a parquet file, then drop the parts it replaces
+    tmp_path = dataset_file + '.tmp'
+    rows = 0
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for file in part_files:
+            table = pq.read_table(file)
+            writer.write_table(table if table.schema.equals(schema) else table.cast(schema))
+            rows += table.num_rows
+
+    os.replace(tmp_path, dataset_file)
+    if not keep_parts:
+        shutil.rmtree(parts_folder(dataset_file))
+
+    return rows
@@ -14,9 +14,135 @@ end_year = 2023
 max_pdfs_per_month = 20000
 skip_n = 10000
 #####################################################################################################################
+## Here you can build a small but representative dataset quickly, e.g. sample_fraction = 0.01 for 1% of the papers.
+## The sample is drawn from the metadata, stratified by month and primary arXiv category (when the metadata has the
+## categories) with at least one paper per group, and the papers are picked by a hash of their id and sample_seed, so
+## every run picks the same ones. Only the sampled papers are downloaded, converted and merged, and max_pdfs_per_month
+## and skip_n are ignored. With run_pipeline.py, use another --data-dir to keep the full dataset next to the sample.
+## Leave it None to process every paper.
+## The following is used in download_convert.py and merge_metadata_*_by_year.py
+sample_fraction = None
+sample_seed = 0
+#####################################################################################################################
+## The bucket keeps every version of a paper (v1, v2, ...), but only one of them ends up in the dataset.
+## Here you can choose which version is downloaded and converted, so that the others are never fetched.
+## 'latest' keeps the most recent version, 'first' keeps the original submission and an int, e.g. 1, keeps that
+## exact version (falling back to the latest one if the paper was never revised that far).
+## Set it to None to download every version. The merge scripts pick the same version among the txt files of a month,
+## e.g. the ones converted by a run that downloaded every version, and merge every version when it is None.
+## The following is used in download_convert.py and merge_metadata_*_by_year.py
+pdf_version = 'latest'
+#####################################################################################################################
+## Here you can tune the downloads, which are independent of the number of CPUs.
+## The downloader starts with download_concurrency parallel downloads and adjusts it to the measured throughput,
+## never going above max_download_concurrency. Failed downloads are retried and partial downloads resumed.
+## download_base_url is the server hosting the bucket; point it to a local server to test without Google Cloud.
+## The following is used in download_convert.py
+download_concurrency = 16
+max_download_concurrency = 64
+download_base_url = 'https://storage.googleapis.com'
+#####################################################################################################################
 ## Here you can decide on the search term in the text file to extract the article.
 ## The extracted article is the content after the search term.
 ## The search term is case-insensitive.
 ## The default search term is 'introduction'.
-## The following is used in merge_metadata_articles.py
-search_term = 'introduction'
\ No newline at end of file
+## With section_headings, the article starts at the first heading titled like the search term (e.g. '1 Introduction'),
+## found in the heading index saved by the conversion, and only falls back to the first occurrence of the term when
+## there is no such heading. The conversion only indexes the headings of the pages holding the search term, and none
+## when section_headings is False, e.g. for the raw dataset, so that the conversion isn't slowed down by the fonts of
+## every page. Months converted before a change of these settings fall back to the first occurrence of the term.
+## The following is used in merge_metadata_articles.py and download_convert.py
+search_term = 'introduction'
+section_headings = True
+#####################################################################################################################
+## PDFs are checked for garbage text and scans on their first pages before being fully converted.
+## Rejected PDFs get a .rejected file with the reason next to them and are never downloaded or converted again.
+## If you only build the article dataset, you can also reject PDFs that don't contain a search term at conversion
+## time, e.g. conversion_search_term = search_term. Keep it None for the raw dataset, which keeps every text.
+## PDFs whose conversion fails or times out are retried with another extraction strategy, in a slower lane, and are
+## quarantined (rejected with the reason 'quarantined') after quarantine_attempts failures over all runs.
+## The following is used in download_convert.py
+conversion_search_term = None
+quarantine_attempts = 3
+#####################################################################################################################
+## Work is sent to the worker processes in batches, to cut the overhead per task on small files.
+## A conversion task holds at most conversion_batch_files PDFs and conversion_batch_bytes bytes of PDFs.
+## Each PDF keeps its own timeout inside a batch.
+## merge_chunksize is the number of txt files per task in the merge scripts, None picks one from the number of files.
+## The conversion settings are used in download_convert.py, merge_chunksize in merge_metadata_*_by_year.py
+conversion_batch_files = 16
+conversion_batch_bytes = 64 * 2**20
+merge_chunksize = None
+#####################################################################################################################
+## To spread the work over several machines, set lease_dir to a folder on a volume shared by all of them, and run
+## the same scripts on every machine. Each machine claims months (in download_convert.py) or years (in the merge
+## scripts) through lease files in that folder, and takes over the work of machines that stop renewing their lease
+## for lease_ttl seconds. The machines' clocks must be in sync, and the output folders must be shared as well.
+## download_convert.py only returns once every month is done by some machine, so the merge scripts can follow it.
+## A month or year finished with other settings, e.g. before a config change, is done again.
+## Leave it None to process every month and year on this machine.
+## The following is used in download_convert.py and merge_metadata_*_by_year.py
+lease_dir = None
+lease_ttl = 30*60
+#####################################################################################################################
+## Here you can store the txt files of every month compressed, in a texts.sqlite file in the month folder, once the
+## month is converted. Every text is compressed on its own with zstd and a dictionary trained on the month, so the
+## merge scripts still read them one by one, and the txt files take several times less space.
+## See benchmark_text_store.py to measure the gain on your txt files.
+## The following is used in download_convert.py
+compress_texts = False
+#####################################################################################################################
+## Here you can bound the disk space taken by the PDFs of a month, e.g. staging_budget = '20GB', to run on a small
+## local disk. The PDFs of the month are then converted while they are downloaded, and deleted as soon as they are
+## converted; the download waits while the PDFs on disk reach the budget, or while the disk has less than
+## staging_min_free free. The most disk used by the PDFs of every month is printed.
+## Leave it None to download all the PDFs of a month before converting them.
+## The following is used in download_convert.py
+staging_budget = None
+staging_min_free = '1GB'
+#####################################################################################################################
+## Here you can choose how the worker processes are started: 'fork', 'spawn' or 'forkserver'.
+## None uses the platform default ('fork' on Linux). The worker modules import only what they need, so 'spawn' starts
+## lean workers; their start-up time is reported in the logs.
+## The following is used in download_convert.py and merge_metadata_*_by_year.py
+mp_start_method = None
+#####################################################################################################################
+## Here you can cap the memory used by the conversion and merge workers, e.g. memory_budget = '48GB'.
+## The number of workers is then adjusted to the measured size of the workers and the memory left on the machine,
+## and workers that outgrow their share of the budget are replaced with fresh ones.
+## worker_memory_estimate is the size assumed for a worker before any can be measured.
+## Leave memory_budget None to always use one worker per CPU.
+## The following is used in download_convert.py and merge_metadata_*_by_year.py
+memory_budget = None
+worker_memory_estimate = '512MB'
+#####################################################################################################################
+## Near-duplicates, e.g. papers cross-listed or submitted again under a new id, are found with MinHash signatures
+## and left out of the merged parquet file. Two texts are near-duplicates when they share about
+## near_duplicate_threshold of their runs of 5 words; the earliest one is kept.
+## The index is saved to near_duplicates.sqlite next to the merged file and only indexes the years it hasn't seen, the
+## list of near-duplicates goes to near_duplicates.csv. Set it to e.g. 0.8 to leave them out, None keeps them.
+## The following is used in merge_parquet.py
+near_duplicate_threshold = None
+#####################################################################################################################
+## Here you can build a full-text search index over the title, abstract and text of the papers, to spot-check the
+## dataset without loading it, e.g. python search_index.py "dark matter". The index is saved to search_index.sqlite in
+## the dataset folder, about the size of the texts, and only indexes the months that changed.
+## The following is used in run_pipeline.py and search_index.py
+search_index = False
+#####################################################################################################################
+## Here you can publish the datasets to the Hugging Face Hub with publish_to_hf.py (or run_pipeline.py).
+## Set the repos to publish to, None skips a repo: the yearly files of the article and raw datasets, and the txt files
+## of every month packed in tar files. The repos are created on the Hub if they don't exist yet. Every file is cut into shards of about publish_shard_size, and only the shards
+## that changed since the last run are uploaded, by publish_workers parallel uploads. A file that fits in a shard keeps
+## its name in the repo, e.g. data/arxiv_dataset_2007.parquet; a larger one is replaced by its shards.
+## The shards are kept in publish_staging_dir, with a manifest of what was uploaded.
+## publish_endpoint is the url of the Hub, None for the public Hub; set it to a local folder to try the publishing.
+## The token is read from the HUGGINGFACE_TOKEN environment variable.
+## The following is used in publish_to_hf.py and run_pipeline.py
+publish_repo_id = None  # e.g. 'bluuebunny/arxiv_dataset_by_year'
+publish_raw_repo_id = None  # e.g. 'bluuebunny/arxiv_raw_dataset_by_year'
+publish_txt_repo_id = None  # e.g. 'bluuebunny/arxiv_dump'
+publish_shard_size = '500MB'
+publish_workers = 8
+publish_endpoint = None
+publish_staging_dir = 'publish_staging'
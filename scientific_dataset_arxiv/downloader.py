@@ -0,0 +1,261 @@
+#####################################################################################################################
+
+## Asynchronous downloader for the public arxiv bucket
+## Files are fetched over plain HTTP(S) through a single pooled session, so any server laying out
+## `{base_url}/{bucket_name}/{blob_name}` can stand in for Google Cloud Storage, e.g. `python -m http.server`.
+
+import asyncio
+import os
+import logging
+from time import monotonic
+
+import aiohttp
+
+#####################################################################################################################
+
+BASE_URL = 'https://storage.googleapis.com'  # Public endpoint of Google Cloud Storage
+CHUNK_SIZE = 1 << 16  # Bytes read from the socket at a time
+RETRIES = 5  # Number of retries per file
+BACKOFF = 1.0  # Seconds to wait before the first retry, doubled on every retry
+ADJUST_INTERVAL = 5.0  # Seconds between two adjustments of the concurrency
+REQUEST_TIMEOUT = 5*60  # Timeout in seconds for a single file
+
+## Status codes worth retrying, anything else >= 400 is a permanent failure
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+class ConcurrencyController:
+    """
+    Limit the number of concurrent downloads and tune that limit to the measured throughput.
+
+    Every `interval` seconds the throughput of the last interval is compared with the previous one. The limit keeps
+    moving in the same direction as long as throughput improves, and turns around when it drops (hill climbing).
+
+    Args:
+        initial (int): The starting number of concurrent downloads.
+        minimum (int): The lowest allowed number of concurrent downloads.
+        maximum (int): The highest allowed number of concurrent downloads.
+        interval (float, optional): Seconds between two adjustments. Defaults to ADJUST_INTERVAL.
+    """
+    def __init__(self, initial, minimum, maximum, interval=ADJUST_INTERVAL):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.interval = interval
+
+        self.active = 0
+        self.step = max(1, self.limit // 4)
+        self.direction = 1
+        self.window_bytes = 0
+        self.window_start = monotonic()
+        self.last_throughput = None
+        self.total_bytes = 0
+        self._condition = None
+
+    @property
+    def condition(self):
+        ## Created lazily so that it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        """ Wait until a download slot is free and take it """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        """ Give a download slot back """
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    async def record(self, nbytes):
+        """ Account for downloaded bytes and adjust the limit at the end of every interval """
+        self.window_bytes += nbytes
+        self.total_bytes += nbytes
+
+        elapsed = monotonic() - self.window_start
+        if elapsed < self.interval:
+            return
+
+        throughput = self.window_bytes / elapsed
+        if self.last_throughput is not None and throughput < 0.95 * self.last_throughput:
+            self.direction = -self.direction
+
+        previous_limit = self.limit
+        self.limit = min(max(self.limit + self.direction * self.step, self.minimum), self.maximum)
+
+        ## Bounce off the bounds instead of sticking to them
+        if self.limit == previous_limit:
+            self.direction = -self.direction
+
+        log.debug('Throughput {:.1f} MB/s with {} downloads, limit set to {}'.format(throughput / 1e6, previous_limit, self.limit))
+
+        self.last_throughput = throughput
+        self.window_bytes = 0
+        self.window_start = monotonic()
+
+        async with self.condition:
+            self.condition.notify_all()
+
+
+class PermanentDownloadError(Exception):
+    """ Raised for responses that won't get better by retrying, e.g. a 404 """
+
+
+async def download_file(session, url, path, controller, retries=RETRIES, backoff=BACKOFF):
+    """
+    Download a single file, resuming from a partial `.part` file if one exists.
+
+    Args:
+        session (aiohttp.ClientSession): The pooled session.
+        url (str): The url of the file.
+        path (str): The local path of the file.
+        controller (ConcurrencyController): The controller accounting for the throughput.
+        retries (int, optional): The number of retries. Defaults to RETRIES.
+        backoff (float, optional): Seconds before the first retry, doubled on every retry. Defaults to BACKOFF.
+
+    Returns:
+        None on success, or the exception of the last attempt.
+    """
+    part_path = path + '.part'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    for attempt in range(retries + 1):
+        try:
+            ## Resume from whatever a previous attempt or run left behind
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+
+            async with session.get(url, headers=headers) as response:
+
+                ## The partial file already holds the whole content
+                if response.status == 416 and offset:
+                    os.replace(part_path, path)
+                    return None
+
+                if response.status in RETRY_STATUSES:
+                    response.raise_for_status()
+                if response.status >= 400:
+                    raise PermanentDownloadError('{} returned {}'.format(url, response.status))
+
+                ## The server ignored the range, start over
+                mode = 'ab' if response.status == 206 else 'wb'
+
+                with open(part_path, mode) as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+                        await controller.record(len(chunk))
+
+            os.replace(part_path, path)
+            return None
+
+        except PermanentDownloadError as e:
+            return e
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            if attempt == retries:
+                return e
+
+            delay = backoff * 2 ** attempt
+            log.debug('Retrying {} in {:.1f} seconds after: {}'.format(url, delay, e))
+            await asyncio.sleep(delay)
+
+
+async def download_many(urls_and_paths, initial_concurrency, max_concurrency, retries=RETRIES, backoff=BACKOFF, staging=None, sizes=None):
+    """
+    Download many files concurrently through a single pooled session.
+
+    With a staging area, every file waits for its size to fit in the area before its download starts, in order, and
+    is handed over to the area once downloaded, see `staging.StagingArea`.
+
+    Args:
+        urls_and_paths (list): Tuples of (url, local path).
+        initial_concurrency (int): The starting number of concurrent downloads.
+        max_concurrency (int): The highest number of concurrent downloads.
+        retries (int, optional): The number of retries per file. Defaults to RETRIES.
+        backoff (float, optional): Seconds before the first retry, doubled on every retry. Defaults to BACKOFF.
+        staging (StagingArea, optional): The bounded staging area the files are downloaded into.
+        sizes (list, optional): The size of every file, required with a staging area.
+
+    Returns:
+        list: None or an exception for each file, in order.
+    """
+    controller = ConcurrencyController(initial_concurrency, 1, max_concurrency)
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        ## The files wait for room one at a time, so they are downloaded in order
+        reserving = asyncio.Lock()
+
+        async def limited(url, path, size):
+            if staging is not None:
+                async with reserving:
+                    await staging.reserve(path, size)
+
+            await controller.acquire()
+            try:
+                result = await download_file(session, url, path, controller, retries, backoff)
+            finally:
+                await controller.release()
+
+            if staging is not None:
+                if result is None:
+                    staging.add(path)
+                else:
+                    staging.discard(path)
+            return result
+
+        tic = monotonic()
+        results = await asyncio.gather(*(limited(url, path, size) for (url, path), size in zip(urls_and_paths, sizes or [0] * len(urls_and_paths))))
+        elapsed = monotonic() - tic
+
+    log.info('Downloaded {:.1f} MB in {:.1f} seconds, final concurrency {}'.format(controller.total_bytes / 1e6, elapsed, controller.limit))
+
+    return results
+
+
+def download_many_to_path(bucket_name, blob_names, destination_directory, base_url=BASE_URL, initial_concurrency=16, max_concurrency=64, skip_if_exists=True, staging=None, blob_sizes=None):
+    """
+    Download blobs of a public bucket to a local directory, keeping the blob names as relative paths.
+
+    Args:
+        bucket_name (str): The name of the bucket.
+        blob_names (list): The names of the blobs to download.
+        destination_directory (str): The local directory the blobs are downloaded into.
+        base_url (str, optional): The server hosting the bucket. Defaults to Google Cloud Storage.
+        initial_concurrency (int, optional): The starting number of concurrent downloads. Defaults to 16.
+        max_concurrency (int, optional): The highest number of concurrent downloads. Defaults to 64.
+        skip_if_exists (bool, optional): Don't download blobs that already exist locally. Defaults to True.
+        staging (StagingArea, optional): A bounded staging area to download the blobs into, see `download_many`.
+        blob_sizes (list, optional): The size of every blob from the listing, required with a staging area.
+
+    Returns:
+        list: None or an exception for each blob, in the order of `blob_names`.
+    """
+    results = [None] * len(blob_names)
+    pending = []
+    for i, blob_name in enumerate(blob_names):
+        path = os.path.join(destination_directory, blob_name)
+
+        if skip_if_exists and os.path.exists(path):
+            continue
+
+        url = '{}/{}/{}'.format(base_url.rstrip('/'), bucket_name, blob_name)
+        pending.append((i, url, path))
+
+    if pending:
+        sizes = [blob_sizes[i] for i, _, _ in pending] if blob_sizes is not None else None
+        downloaded = asyncio.run(download_many([(url, path) for _, url, path in pending], initial_concurrency, max_concurrency, staging=staging, sizes=sizes))
+        for (i, _, _), result in zip(pending, downloaded):
+            results[i] = result
+
+    return results
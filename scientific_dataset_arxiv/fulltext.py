@@ -3,43 +3,110 @@
 ## Import pymupdf library to extract text from pdf files
 import fitz
 from . import fixunicode
+from .stats import text_stats, write_stats
+from .sections import page_lines, detect_headings
 
-from multiprocessing import Pool, cpu_count
+import multiprocessing
+from multiprocessing import cpu_count
 from pebble import ProcessPool, ProcessExpired
-from functools import partial
-from concurrent.futures import TimeoutError
+from concurrent.futures import CancelledError, wait, FIRST_COMPLETED
+from collections import deque
 
 import os
 import glob
+import json
 import re
 import logging
+import signal
+import threading
+from time import time
 
 #####################################################################################################################
 
-TIMEOUT = 2*60  # Timeout in seconds
+TIMEOUT = 2*60  # Timeout in seconds, per PDF
+START_METHOD = None  # Start method of the worker processes, e.g. 'spawn', None for the platform default
+GOVERNOR_INTERVAL = 5  # Seconds between two memory samples when a governor limits the workers
+STAGING_INTERVAL = 1  # Seconds between two checks for downloaded PDFs when they are converted as they arrive
+BATCH_FILES = 16  # Maximum number of PDFs sent to a worker at once
+BATCH_BYTES = 64 * 2**20  # Maximum total size of the PDFs sent to a worker at once
+WATCHDOG_MARGIN = 30  # Seconds of grace on top of the timeout before a worker without progress is stopped
+
+PROBE_PAGES = 3  # Number of leading pages probed before the full extraction
+MAX_WORD_LENGTH = 45  # Average word length above which the extracted text is considered garbage
+SCANNED_PAGE_CHARS = 100  # Pages with images and less text than this are considered scanned
+
+QUARANTINE_ATTEMPTS = 3  # Failed conversions after which a PDF is quarantined, i.e. rejected for good
+FALLBACK_TIMEOUT = 10*60  # Timeout in seconds, per PDF in the fallback lane
+PAGE_TIMEOUT = 20  # Timeout in seconds, per page in the fallback lane
+FALLBACK_FLAGS = fitz.TEXT_MEDIABOX_CLIP | fitz.TEXT_DEHYPHENATE  # Text flags of the fallback lane: ligatures expanded, lines dehyphenated
+FALLBACK_NICENESS = 10  # Niceness of the fallback workers, so they yield the CPUs to the main lane
 
 #####################################################################################################################
 
 ## Set up logging
-# Create the log folder if it doesn't exist
-log_folder = 'logs'  # Change this to your desired folder name
-os.makedirs(log_folder, exist_ok=True)  # Create folder if it doesn't exist
+## Nothing is configured at import time, so that importing this module (e.g. in a spawned worker) has no side effects
+LOG_FOLDER = 'logs'  # Change this to your desired folder name
+
+def setup_logging(log_folder: str = LOG_FOLDER):
+    """
+    Send the logs to {log_folder}/fulltext.log, creating the folder if it doesn't exist.
+
+    Parameters
+    ----------
+    log_folder : str
+        Folder of the log file
+
+    Returns
+    -------
+    log_file : str
+        Path of the log file
+    """
+    os.makedirs(log_folder, exist_ok=True)  # Create folder if it doesn't exist
+
+    # Get the filename of this module
+    current_filename = os.path.basename(__file__)
+    current_filename = current_filename.split('.')[0]
+
+    # Define the log file path within the folder
+    log_file = os.path.join(log_folder, f'{current_filename}.log')  # Join folder path and filename
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename=log_file,  # Specify the log file path
+        filemode='a'  # Append logs to the file
+    )
+    return log_file
 
-# Get the filename of the currently executed Python script
-current_filename = os.path.basename(__file__)
-current_filename = current_filename.split('.')[0]
+def init_worker(started: float, log_folder: str = LOG_FOLDER, niceness: int = 0, progress: tuple = None):
+    """
+    Initializer of the conversion workers: set up logging and record how long
+    the worker took to start.
+
+    Parameters
+    ----------
+    started : float
+        time() in the parent when the pool was created
 
-# Define the log file path within the folder
-log_file = os.path.join(log_folder, f'{current_filename}.log')  # Join folder path and filename
+    log_folder : str
+        Folder of the log file, see `setup_logging`
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename=log_file,  # Specify the log file path
-    filemode='a'  # Append logs to the file
-)
+    niceness : int
+        Lower the priority of the worker by this much, e.g. for the fallback lane
+
+    progress : tuple of multiprocessing arrays
+        Heartbeats and finished file counts shared with the parent, one slot
+        per batch in flight, see `iter_convert_results`
+    """
+    global _progress
+    _progress = progress
+    setup_logging(log_folder)
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+    log.info('Worker {} started in {:.2f} seconds'.format(os.getpid(), time() - started))
 
 log = logging.getLogger(__name__)
+_progress = None  # Progress arrays shared with the parent, in a worker
 
 #####################################################################################################################
 
@@ -59,6 +126,148 @@ def reextension(filename: str, extension: str) -> str:
     name, _ = os.path.splitext(filename)
     return '{}.{}'.format(name, extension)
 
+## Exception raised when a pdf is rejected by the quality checks
+class RejectedPDF(RuntimeError):
+    """
+    Raised when the text of a PDF is not worth extracting.
+
+    Args:
+        pdffile (str): The path to the rejected PDF file.
+        reason (str): Why the PDF was rejected, e.g. 'scanned' or 'word_length'.
+        detail (str, optional): Human readable details about the rejection.
+    """
+    def __init__(self, pdffile, reason, detail=''):
+        self.pdffile = pdffile
+        self.reason = reason
+        self.detail = detail
+        super().__init__('Rejected "{}" ({}): {}'.format(pdffile, reason, detail))
+
+## Function to open a pdf, rejecting the files that can't be
+def open_pdf(pdffile: str):
+    """
+    Open a PDF with PyMuPDF. Empty and unreadable files would fail the same
+    way on every retry, so they are rejected right away instead of going
+    through the failure runs of the main and fallback lanes.
+
+    Raises
+    ------
+    RejectedPDF
+        If the file is empty or can't be opened as a PDF
+    """
+    if os.stat(pdffile).st_size == 0:
+        raise RejectedPDF(pdffile, 'empty', 'zero-byte file')
+
+    try:
+        return fitz.open(pdffile)
+    except Exception as e:
+        raise RejectedPDF(pdffile, 'unreadable', str(e)) from e
+
+## Function to get the path of the file recording a rejection
+def rejection_path(pdffile: str) -> str:
+    """ Path of the marker file recording why `pdffile` was rejected """
+    return reextension(pdffile, 'rejected')
+
+## Function to record the rejection of a pdf next to it
+def record_rejection(error: RejectedPDF):
+    """
+    Write the reason of a rejection next to the PDF, so it isn't downloaded or converted again.
+
+    Args:
+        error (RejectedPDF): The rejection to record.
+    """
+    with open(rejection_path(error.pdffile), 'w', encoding='utf-8') as f:
+        f.write('{}\t{}\n'.format(error.reason, error.detail))
+
+## Function to forget the rejections of a folder for some reasons
+def clear_rejections(directory: str, reasons) -> int:
+    """
+    Remove the .rejected files of a folder recording one of `reasons`, e.g.
+    the PDFs rejected for a search term that is no longer used, so that
+    they are downloaded and converted again.
+
+    Parameters
+    ----------
+    directory : str
+        Folder holding the .rejected files, searched recursively
+
+    reasons : iterable of str
+        The reasons of the rejections to remove, e.g. ['search_term']
+
+    Returns
+    -------
+    removed : int
+        Number of .rejected files removed
+    """
+    reasons = set(reasons)
+    removed = 0
+    for path in glob.glob(os.path.join(directory, '**', '*.rejected'), recursive=True):
+        with open(path, 'r', encoding='utf-8') as f:
+            reason = f.read().split('\t', 1)[0].strip()
+
+        if reason in reasons:
+            os.remove(path)
+            removed += 1
+
+    return removed
+
+## Function to get the path of the file recording the failed conversions of a pdf
+def failure_path(pdffile: str) -> str:
+    """ Path of the file counting the failed conversions of `pdffile` """
+    return reextension(pdffile, 'failed')
+
+## Function to read the number of failed conversions of a pdf
+def failed_attempts(pdffile: str) -> int:
+    """ Number of failed conversions of `pdffile` so far """
+    try:
+        with open(failure_path(pdffile), 'r', encoding='utf-8') as f:
+            return json.load(f)['attempts']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+## Function to record a failed conversion of a pdf
+def record_failure(pdffile: str, lane: str, max_attempts: int = QUARANTINE_ATTEMPTS) -> bool:
+    """
+    Count a failed conversion of a PDF, and quarantine it after `max_attempts`
+    failures: it is then recorded as rejected, so that it is never downloaded
+    or converted again and its PDF can be deleted.
+
+    Parameters
+    ----------
+    pdffile : str
+        Path to the PDF file
+
+    lane : str
+        The lane that failed, 'main' or 'fallback'
+
+    max_attempts : int
+        Number of failures after which the PDF is quarantined
+
+    Returns
+    -------
+    quarantined : bool
+        Whether the PDF was quarantined
+    """
+    attempts = failed_attempts(pdffile) + 1
+
+    if attempts >= max_attempts:
+        error = RejectedPDF(pdffile, 'quarantined', 'conversion failed {} times, last in the {} lane'.format(attempts, lane))
+        log.warning(error)
+        record_rejection(error)
+        clear_failure(pdffile)
+        return True
+
+    with open(failure_path(pdffile), 'w', encoding='utf-8') as f:
+        json.dump({'attempts': attempts, 'lane': lane}, f)
+    return False
+
+## Function to forget the failed conversions of a pdf
+def clear_failure(pdffile: str):
+    """ Remove the record of failed conversions of `pdffile`, if any """
+    try:
+        os.remove(failure_path(pdffile))
+    except FileNotFoundError:
+        pass
+
 ## Function to extract text from a pdf file
 def extract_text_from_pdf(pdf_path):
     """
@@ -99,47 +308,281 @@ def average_word_length(txt):
     avgw = nc / (nw + 1)
     return avgw
 
+## Function to extract the text of a page with its lines
+def extract_page(page, heading_term: str = None):
+    """
+    Extract the plain text of a page, and its lines with their font for the
+    heading index when the page holds `heading_term`. Reading the fonts
+    costs about as much as the text itself, so only the pages that can hold
+    the heading looked for pay for it.
+
+    Parameters
+    ----------
+    page : fitz.Page
+        The page
+
+    heading_term : str
+        The (lowercase) title of the headings to index, None to skip the lines
+
+    Returns
+    -------
+    text : str
+        The plain text of the page, as `page.get_text()` would return it
+    lines : list of tuple
+        The lines of the page with their font, see `sections.page_lines`,
+        empty when the page doesn't hold `heading_term`
+    """
+    if heading_term is None:
+        return page.get_text('text'), []
+
+    textpage = page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+    text = page.get_text('text', textpage=textpage)
+    if heading_term not in text.lower():
+        return text, []
+    return text, page_lines(page, textpage)
+
+def probe_pdf(doc, pdffile: str, pages: int = PROBE_PAGES, heading_term: str = None):
+    """
+    Run cheap quality checks on the first pages of an opened PDF, so that
+    garbage documents are rejected before the full extraction.
+
+    Parameters
+    ----------
+    doc : fitz.Document
+        The opened PDF
+    pdffile : str
+        Path to the PDF file, used in the rejection
+    pages : int
+        Number of leading pages to probe
+    heading_term : str
+        The (lowercase) title of the headings to index, see `extract_page`
+
+    Returns
+    -------
+    texts : list of str
+        The text of the probed pages, to be reused by the full extraction
+    lines : list of list
+        The lines of the probed pages, see `extract_page`
+
+    Raises
+    ------
+    RejectedPDF
+        If the PDF has no pages, looks scanned or its text is garbage
+    """
+    if doc.page_count == 0:
+        raise RejectedPDF(pdffile, 'no_pages')
+
+    texts = []
+    lines = []
+    scanned_pages = 0
+    for page_number in range(min(pages, doc.page_count)):
+        page = doc[page_number]
+        text, font_lines = extract_page(page, heading_term)
+        texts.append(text)
+        lines.append(font_lines)
+
+        ## A page made of images with (almost) no text layer is a scan
+        if len(text.strip()) < SCANNED_PAGE_CHARS and page.get_images():
+            scanned_pages += 1
+
+    if scanned_pages == len(texts):
+        raise RejectedPDF(pdffile, 'scanned', '{} of the first {} pages are images without text'.format(scanned_pages, len(texts)))
+
+    wordlength = average_word_length(''.join(texts))
+    if wordlength > MAX_WORD_LENGTH:
+        raise RejectedPDF(pdffile, 'word_length', 'average word length of {:.1f} in the first {} pages'.format(wordlength, len(texts)))
+
+    return texts, lines
+
 #####################################################################################################################
 
-def fulltext(pdffile: str):
+def extract_fulltext(pdffile: str, search_term: str = None, heading_term: str = None):
     """
     Given a pdf file, extract the unicode text and run through very basic
-    unicode normalization routines. Determine the best extracted text and
-    return as a string.
+    unicode normalization routines, and gather statistics about it.
+
+    The first pages are probed with `probe_pdf` before the rest of the
+    document is extracted, and the (costly) normalization only runs once
+    the text passed every check. With a `heading_term`, the heading
+    candidates of the pages holding it are detected from the font of their
+    lines, see `sections.detect_headings`.
 
     Parameters
     ----------
     pdffile : str
         Path to PDF file from which to extract text
 
-    timelimit : int
-        Time in seconds to allow the extraction routines to run
+    search_term : str
+        If given, reject PDFs whose text doesn't contain this term (case-insensitive)
+
+    heading_term : str
+        If given, index the headings of the pages holding this term (case-insensitive),
+        e.g. the search term of the article dataset
 
     Returns
     -------
     fulltext : str
         The full plain text of the PDF
+    stats : dict
+        The page count and the statistics of the text, see `stats.text_stats`,
+        with the heading candidates and the font size of the body text
+
+    Raises
+    ------
+    RejectedPDF
+        If the PDF failed one of the quality checks
     """
     if not os.path.isfile(pdffile):
         raise FileNotFoundError(pdffile)
 
-    if os.stat(pdffile).st_size == 0:  # file is empty
-        raise RuntimeError('"{}" is an empty file'.format(pdffile))
-
-    output = extract_text_from_pdf(pdffile)
+    log.info(f"Extracting text from {pdffile}")
 
-    output = fixunicode.fix_unicode(output)
-    wordlength = average_word_length(output)
-
-    if wordlength <= 45:
+    heading_term = heading_term.lower() if heading_term is not None else None
 
+    doc = open_pdf(pdffile)
+    try:
+        texts, lines = probe_pdf(doc, pdffile, heading_term=heading_term)
+        for page_number in range(len(texts), doc.page_count):
+            text, font_lines = extract_page(doc[page_number], heading_term)
+            texts.append(text)
+            lines.append(font_lines)
+    finally:
+        doc.close()
+
+    ## Look for the search term page by page, to avoid a lowercased copy of the whole text
+    if search_term is not None:
+        term = search_term.lower()
+        if not any(term in text.lower() for text in texts):
+            raise RejectedPDF(pdffile, 'search_term', '"{}" not found'.format(search_term))
+
+    ## Normalized page by page, so that the headings are located page by page
+    pages = [fixunicode.fix_unicode(text) for text in texts]
+    output = ''.join(pages)
+    stats = dict(text_stats(output), page_count=len(texts))
+    wordlength = stats['average_word_length']
+
+    if wordlength <= MAX_WORD_LENGTH:
+
+        stats['headings'], stats['body_font_size'] = detect_headings(texts, pages, lines, fixunicode.fix_unicode)
         log.debug('Fixed unicode and extracted text from "{}"'.format(pdffile))
-        return output
+        return output, stats
 
     else:
-        raise RuntimeError(
-            'No accurate text could be extracted from "{}"'.format(pdffile)
-        )
+        raise RejectedPDF(pdffile, 'word_length', 'average word length of {:.1f}'.format(wordlength))
+
+class PageTimeout(Exception):
+    """ Raised in the fallback lane when a single page takes longer than its time limit """
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout('Page took longer than its time limit')
+
+def extract_fulltext_fallback(pdffile: str, search_term: str = None, page_timeout: int = PAGE_TIMEOUT):
+    """
+    Extraction strategy of the fallback lane, for PDFs whose regular
+    extraction failed or timed out.
+
+    Pages are extracted one by one with other text flags (see
+    `FALLBACK_FLAGS`) and in reading order, each with its own time limit.
+    Pages that fail or time out are skipped, as long as they are less than
+    half of the document. The quality checks of `extract_fulltext` apply to
+    the extracted text, but nothing is probed beforehand.
+
+    Parameters
+    ----------
+    pdffile : str
+        Path to PDF file from which to extract text
+
+    search_term : str
+        If given, reject PDFs whose text doesn't contain this term (case-insensitive)
+
+    page_timeout : int
+        Time limit in seconds for every single page
+
+    Returns
+    -------
+    fulltext : str
+        The full plain text of the PDF
+    stats : dict
+        The page count, the number of skipped pages and the statistics of the text
+
+    Raises
+    ------
+    RejectedPDF
+        If the PDF failed one of the quality checks
+    """
+    if not os.path.isfile(pdffile):
+        raise FileNotFoundError(pdffile)
+
+    log.info(f"Extracting text from {pdffile} in the fallback lane")
+
+    use_alarm = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+    texts = []
+    skipped = 0
+    doc = open_pdf(pdffile)
+    try:
+        if doc.page_count == 0:
+            raise RejectedPDF(pdffile, 'no_pages')
+
+        for page_number in range(doc.page_count):
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, page_timeout)
+            try:
+                texts.append(doc[page_number].get_text('text', flags=FALLBACK_FLAGS, sort=True))
+            except Exception as e:
+                log.warning('Skipping page {} of "{}": {}'.format(page_number, pdffile, e))
+                skipped += 1
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        doc.close()
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    if skipped * 2 > skipped + len(texts):
+        raise RuntimeError('{} of the {} pages of "{}" failed'.format(skipped, skipped + len(texts), pdffile))
+
+    if search_term is not None:
+        term = search_term.lower()
+        if not any(term in text.lower() for text in texts):
+            raise RejectedPDF(pdffile, 'search_term', '"{}" not found'.format(search_term))
+
+    output = fixunicode.fix_unicode(''.join(texts))
+    stats = dict(text_stats(output), page_count=skipped + len(texts), skipped_pages=skipped)
+
+    if stats['average_word_length'] > MAX_WORD_LENGTH:
+        raise RejectedPDF(pdffile, 'word_length', 'average word length of {:.1f}'.format(stats['average_word_length']))
+
+    return output, stats
+
+def fulltext(pdffile: str, search_term: str = None):
+    """
+    Given a pdf file, extract the unicode text and run through very basic
+    unicode normalization routines. Determine the best extracted text and
+    return as a string.
+
+    Parameters
+    ----------
+    pdffile : str
+        Path to PDF file from which to extract text
+
+    search_term : str
+        If given, reject PDFs whose text doesn't contain this term (case-insensitive)
+
+    Returns
+    -------
+    fulltext : str
+        The full plain text of the PDF
+
+    Raises
+    ------
+    RejectedPDF
+        If the PDF failed one of the quality checks, see `extract_fulltext`
+    """
+    return extract_fulltext(pdffile, search_term)[0]
     
 def sorted_files(globber: str):
     """
@@ -202,17 +645,22 @@ def convert_directory(path: str):
     for pdffile in pdffiles:
         txtfile = reextension(pdffile, 'txt')
 
-        ## Skip conversion when there is a text file already
-        if os.path.exists(txtfile):
+        ## Skip conversion when there is a text file or a rejection already
+        if os.path.exists(txtfile) or os.path.exists(rejection_path(pdffile)):
             log.info('Skipping "{}"'.format(pdffile))
             continue
 
         # we don't want this function to stop half way because of one failed
         # file so just charge onto the next one
         try:
-            text = fulltext(pdffile)
+            text, stats = extract_fulltext(pdffile)
+            write_stats(txtfile, stats)
             with open(txtfile, 'w', encoding='utf-8') as f:
                 f.write(text)
+        except RejectedPDF as e:
+            log.info(e)
+            record_rejection(e)
+            continue
         except Exception as e:
             log.error("Conversion failed for '{}'".format(pdffile))
             log.exception(e)
@@ -221,17 +669,352 @@ def convert_directory(path: str):
         outlist.append(pdffile)
     return outlist
 
-def convert_directory_parallel(path: str, processes: int = cpu_count()):
+def make_batches(files: list, max_files: int, max_bytes: int):
+    """
+    Group files into batches of at most `max_files` files and `max_bytes`
+    bytes, a single file larger than `max_bytes` making its own batch.
+
+    Parameters
+    ----------
+    files : list of str
+        Paths of the files to group, kept in order
+
+    max_files : int
+        Maximum number of files per batch
+
+    max_bytes : int
+        Maximum total size in bytes of a batch, None for no limit
+
+    Returns
+    -------
+    batches : list of list of str
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+
+    for fn in files:
+        size = os.path.getsize(fn) if max_bytes is not None else 0
+
+        if batch and (len(batch) >= max_files or (max_bytes is not None and batch_bytes + size > max_bytes)):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+
+        batch.append(fn)
+        batch_bytes += size
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+class FileTimeout(Exception):
+    """ Raised in a batch worker when a single file takes longer than its time limit """
+
+def _raise_file_timeout(signum, frame):
+    raise FileTimeout('File took longer than its time limit')
+
+def _report_progress(slot: int, finished: int):
+    """ Tell the parent that the batch in `slot` is alive and how many of its files are done """
+    if _progress is not None and slot is not None:
+        heartbeats, done = _progress
+        done[slot] = finished
+        heartbeats[slot] = time()
+
+def convert_batch(pdffiles: list, search_term: str = None, timeout: int = TIMEOUT, fallback: bool = False, slot: int = None,
+                  heading_term: str = None):
+    """
+    Convert a batch of pdfs in a worker, each one with its own time limit.
+
+    The time limit is enforced with SIGALRM, which only interrupts Python
+    code: a file stuck inside MuPDF is stopped once control comes back
+    (e.g. at the next page). The worker also reports its progress after
+    every file, and the parent stops it when it made none for longer than
+    the time limit, see `iter_convert_results`. In the fallback lane, the
+    time limit is per page instead, see `extract_fulltext_fallback`.
+
+    Parameters
+    ----------
+    pdffiles : list of str
+        Locations of the PDF files
+
+    search_term : str
+        If given, PDFs without this term are rejected, see `fulltext`
+
+    timeout : int
+        Time limit in seconds for every single file
+
+    fallback : bool
+        Use the extraction strategy of the fallback lane
+
+    slot : int
+        Slot of the batch in the progress arrays, see `init_worker`
+
+    heading_term : str
+        If given, index the headings of the pages holding this term, see `extract_fulltext`
+
+    Returns
+    -------
+    results : list of tuple
+        (pdffile, location of the text file or None) for every PDF
+    """
+    use_alarm = not fallback and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_file_timeout)
+
+    results = []
+    try:
+        for index, pdffile in enumerate(pdffiles):
+            _report_progress(slot, index)
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                results.append((pdffile, convert_safe(pdffile, search_term, fallback, heading_term)))
+            except FileTimeout as e:
+                ## Raised outside of the conversion itself, e.g. while logging
+                log.error('File conversion failed for {}: {}'.format(pdffile, e))
+                results.append((pdffile, None))
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+        _report_progress(slot, len(pdffiles))
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    return results
+
+def _batch_results(future, batch: list):
+    """ Results of a finished batch, None if the batch itself was lost, see `_lost_batch` """
+    try:
+        return future.result()
+    except CancelledError:
+        log.debug("batch of %d files was stopped without progress" % len(batch))
+    except ProcessExpired as error:
+        log.debug("%s. Exit code: %d" % (error, error.exitcode))
+    except Exception as error:
+        log.debug("function raised %s" % error)
+        log.debug(getattr(error, 'traceback', ''))  # Python's traceback of remote process
+
+    return None
+
+def _lost_batch(batch: list, finished: int):
+    """
+    Results of the files a lost batch finished, read back from the disk, and
+    its unfinished files. A single PDF lost on its own counts as failed.
+    """
+    results = []
+    for pdffile in batch[:finished]:
+        txtfile = reextension(pdffile, 'txt')
+        results.append((pdffile, txtfile if os.path.exists(txtfile) else None))
+
+    unfinished = batch[finished:]
+    if len(batch) == 1:
+        for pdffile in unfinished:
+            log.error('File conversion failed for {}: worker lost'.format(pdffile))
+        return results + [(pdffile, None) for pdffile in unfinished], []
+    return results, unfinished
+
+def iter_convert_results(pdffiles: list, processes: int = None, search_term: str = None,
+                         batch_files: int = BATCH_FILES, batch_bytes: int = BATCH_BYTES,
+                         start_method: str = START_METHOD, governor=None, fallback: bool = False,
+                         heading_term: str = None):
+    """
+    Convert pdfs in batches on a pool of processes, and yield the result of
+    every PDF as soon as its batch completes, in no particular order.
+
+    The PDFs can also be taken from a staging area as they are downloaded,
+    until it is closed, see `staging.StagingArea`. With a `governor`, the pool is sized to the number of workers that fit in
+    its memory budget, and is recycled (once the batches in flight are done)
+    whenever that number changes or a worker grew past its share.
+
+    When a batch is lost, e.g. its worker crashed or was stopped, the files it
+    hadn't finished are sent again one by one, so only the PDF that fails on
+    its own counts as failed, not its batch-mates.
+
+    A worker that finished no file for longer than the time limit, plus
+    `WATCHDOG_MARGIN`, is stopped: SIGALRM can't interrupt a file stuck in
+    MuPDF, so a hang costs about one time limit, whatever the batch size.
+
+    Parameters
+    ----------
+    pdffiles : list of str or StagingArea
+        Locations of the PDF files, or the staging area they are taken from
+
+    processes : int
+        Number of worker processes, defaults to the number of CPUs
+
+    search_term : str
+        If given, PDFs without this term are rejected, see `fulltext`
+
+    batch_files : int
+        Maximum number of PDFs per task
+
+    batch_bytes : int
+        Maximum total size in bytes of the PDFs of a task, None for no limit
+
+    start_method : str
+        Start method of the workers, e.g. 'spawn', None for the platform default
+
+    governor : MemoryGovernor
+        Keeps the workers within a memory budget, see `governor.py`
+
+    fallback : bool
+        Run the fallback lane: low priority workers and the extraction
+        strategy of `extract_fulltext_fallback`
+
+    heading_term : str
+        If given, index the headings of the pages holding this term, see `extract_fulltext`
+
+    Yields
+    ------
+    (pdffile, txtfile) : tuple of str
+        txtfile is None if the PDF was rejected or its conversion failed
+    """
+    processes = processes or cpu_count()
+
+    ## A staging area hands over the PDFs in batches as they are downloaded, until it is closed
+    if hasattr(pdffiles, 'take'):
+        staging = pdffiles
+        batches = deque()
+        log.info('Converting the pdfs as they are downloaded')
+    else:
+        staging = None
+        batches = deque(make_batches(pdffiles, batch_files, batch_bytes))
+        log.info('Converting {} pdfs in {} batches'.format(len(pdffiles), len(batches)))
+
+    ## The workers only import this module (and PyMuPDF), their start-up time is logged by `init_worker`
+    context = multiprocessing.get_context(start_method)
+    timeout = FALLBACK_TIMEOUT if fallback else TIMEOUT
+    niceness = FALLBACK_NICENESS if fallback else 0
+
+    ## Every batch in flight has a slot, where its worker writes when it last made progress and how many files it did
+    heartbeats = context.RawArray('d', processes)
+    finished = context.RawArray('i', processes)
+
+    while batches or staging is not None:
+        recycle = False
+
+        ## Idle workers hold memory too, so the pool itself is sized to the budget
+        pool_size = min(governor.target_workers(), processes) if governor is not None else processes
+
+        with ProcessPool(max_workers=pool_size, initializer=init_worker, initargs=(time(), LOG_FOLDER, niceness, (heartbeats, finished)), context=context) as pool:
+            futures = {}
+            slots = list(range(pool_size))
+
+            while batches or futures or staging is not None:
+                ## Fill the free workers with the PDFs downloaded since, only waiting for downloads when idle
+                while staging is not None and not recycle and len(futures) + len(batches) < pool_size:
+                    batch = staging.take(batch_files, batch_bytes, timeout=0 if futures or batches else STAGING_INTERVAL)
+                    if batch is None:
+                        staging = None
+                    elif batch:
+                        batches.append(batch)
+                    else:
+                        break
+
+                while batches and not recycle and len(futures) < pool_size:
+                    batch = batches.popleft()
+                    slot = slots.pop()
+                    heartbeats[slot], finished[slot] = time(), 0
+                    future = pool.schedule(convert_batch, args=(batch, search_term, timeout, fallback, slot, heading_term))
+                    futures[future] = (batch, slot)
+
+                if not futures:
+                    if staging is not None and not recycle:
+                        continue
+                    break
+
+                done, _ = wait(futures, timeout=STAGING_INTERVAL if staging is not None else GOVERNOR_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, slot = futures.pop(future)
+                    slots.append(slot)
+                    results = _batch_results(future, batch)
+                    if results is None:
+                        results, unfinished = _lost_batch(batch, finished[slot])
+                        log.info('Lost a batch of {} files, sending its {} unfinished files one by one'.format(len(batch), len(unfinished)))
+                        batches.extendleft([pdffile] for pdffile in reversed(unfinished))
+                    yield from results
+
+                ## Each file has its own time limit inside the batch, this catches the files stuck in MuPDF
+                for future, (batch, slot) in futures.items():
+                    if not future.done() and time() - heartbeats[slot] > timeout + WATCHDOG_MARGIN:
+                        log.error('Stopping the worker stuck on {}'.format(batch[min(finished[slot], len(batch) - 1)]))
+                        future.cancel()
+
+                if governor is None or recycle:
+                    continue
+
+                ## Let the batches in flight finish, then start over with a pool that fits: shrink it when it no
+                ## longer does, grow it when there is clearly room, and replace workers that outgrew their share
+                target = min(governor.target_workers(), processes)
+                bloated = governor.bloated_workers(pool_size)
+                if bloated or target < pool_size or target > pool_size * 1.25:
+                    log.info('Recycling the pool of {} workers for {}, {} of them outgrew their memory share'.format(pool_size, target, len(bloated)))
+                    recycle = True
+
+        if governor is not None:
+            log.info('Peak memory of the conversion: {:.0f} MB'.format(governor.peak / 2**20))
+
+def convert_directory_parallel(path: str, processes: int = None, search_term: str = None,
+                               batch_files: int = BATCH_FILES, batch_bytes: int = BATCH_BYTES,
+                               start_method: str = START_METHOD, governor=None,
+                               quarantine_attempts: int = QUARANTINE_ATTEMPTS, staging=None,
+                               heading_term: str = None):
     """
     Convert all pdfs in a given `path` to full plain text. For each pdf, a file
     of the same name but extension .txt will be created. If that file exists,
     it will be skipped.
 
+    PDFs are sent to the workers in batches to cut the per-task overhead on
+    small files, see `iter_convert_results`.
+
+    Empty and unreadable PDFs are rejected right away. PDFs whose conversion
+    failed on their own (including timeouts and crashed workers) get a
+    .failed file counting the failures, and are retried in a fallback lane
+    once the main lane is done: one PDF per task on a few low priority
+    workers, with the strategy of `extract_fulltext_fallback`. PDFs that
+    failed before go straight to the fallback lane, and are quarantined after
+    `quarantine_attempts` failures, see `record_failure`.
+
+    With a `staging` area, the PDFs are converted as they are downloaded into
+    it, while the download goes on, and every PDF is deleted as soon as it is
+    converted or rejected, to make room for the next ones. PDFs for the
+    fallback lane are held on disk until the download is done.
+
     Parameters
     ----------
     path : str
         Directory in which to search for pdfs and convert to text
 
+    processes : int
+        Number of worker processes, defaults to the number of CPUs
+
+    search_term : str
+        If given, PDFs without this term are rejected, see `fulltext`
+
+    batch_files : int
+        Maximum number of PDFs per task
+
+    batch_bytes : int
+        Maximum total size in bytes of the PDFs of a task, None for no limit
+
+    start_method : str
+        Start method of the workers, e.g. 'spawn', None for the platform default
+
+    governor : MemoryGovernor
+        Keeps the workers within a memory budget, see `iter_convert_results`
+
+    quarantine_attempts : int
+        Number of failed conversions after which a PDF is quarantined
+
+    staging : StagingArea
+        The bounded staging area the PDFs are downloaded into, see `staging.py`
+
+    heading_term : str
+        If given, index the headings of the pages holding this term, see
+        `extract_fulltext`. The fallback lane indexes no heading.
+
     Returns
     -------
     output : list of str
@@ -243,46 +1026,91 @@ def convert_directory_parallel(path: str, processes: int = cpu_count()):
     log.info('Searching "{}"...'.format(globber))
     log.info('Found: {} pdfs'.format(len(pdffiles)))
 
-    with ProcessPool(max_workers=processes) as pool:
-        future = pool.map(convert_safe, pdffiles, timeout=TIMEOUT) # timeout in seconds
-        iterator = future.result()
+    processes = processes or cpu_count()
+
+    ## Empty files (e.g. failed downloads) are rejected up front, see `open_pdf`
+    empty = {pdffile for pdffile in pdffiles if os.path.getsize(pdffile) == 0}
+    for pdffile in empty:
+        log.info('Rejected empty "{}"'.format(pdffile))
+        record_rejection(RejectedPDF(pdffile, 'empty', 'zero-byte file'))
+        if staging is not None:
+            staging.remove(pdffile)
+    pdffiles = [pdffile for pdffile in pdffiles if pdffile not in empty]
+
+    ## The main lane never spends time on PDFs known to fail
+    fallback_pdfs = [pdffile for pdffile in pdffiles if os.path.exists(failure_path(pdffile))]
+    main_pdfs = [pdffile for pdffile in pdffiles if not os.path.exists(failure_path(pdffile))]
+
+    ## The PDFs left over by an interrupted run go first, the downloaded ones follow
+    if staging is not None:
+        for pdffile in fallback_pdfs:
+            staging.hold(pdffile)
+        for pdffile in main_pdfs:
+            staging.add(pdffile)
+        main_pdfs = staging
 
-        while True:
-            try:
-                result = next(iterator)
-                if result:
-                    log.info('Converted "{}"'.format(result))
-            except StopIteration:
-                break
-            except TimeoutError as error:
-                log.debug("function took longer than %d seconds" % error.args[1])
-            except ProcessExpired as error:
-                log.debug("%s. Exit code: %d" % (error, error.exitcode))
-            except Exception as error:
-                log.debug("function raised %s" % error)
-                log.debug(error.traceback)  # Python's traceback of remote process
-                
-def convert_safe(pdffile: str):
+    outlist = []
+    for pdffile, result in iter_convert_results(main_pdfs, processes, search_term, batch_files, batch_bytes, start_method, governor, heading_term=heading_term):
+        if result:
+            log.info('Converted "{}"'.format(result))
+            outlist.append(pdffile)
+        elif not os.path.exists(rejection_path(pdffile)) and not record_failure(pdffile, 'main', quarantine_attempts):
+            fallback_pdfs.append(pdffile)
+            if staging is not None:
+                staging.hold(pdffile)
+            continue
+
+        ## Converted, rejected or quarantined, the PDF is no longer needed
+        if staging is not None:
+            staging.remove(pdffile)
+
+    if not fallback_pdfs:
+        return outlist
+
+    log.info('Retrying {} pdfs in the fallback lane'.format(len(fallback_pdfs)))
+    for pdffile, result in iter_convert_results(fallback_pdfs, max(1, processes // 4), search_term, 1, None, start_method, governor, fallback=True):
+        if result:
+            log.info('Converted "{}" in the fallback lane'.format(result))
+            clear_failure(pdffile)
+            outlist.append(pdffile)
+        elif not os.path.exists(rejection_path(pdffile)):
+            record_failure(pdffile, 'fallback', quarantine_attempts)
+
+        if staging is not None and (result or os.path.exists(rejection_path(pdffile))):
+            staging.remove(pdffile)
+    return outlist
+
+def convert_safe(pdffile: str, search_term: str = None, fallback: bool = False, heading_term: str = None):
     """ Conversion function that never fails """
     try:
-        convert(pdffile)
+        return convert(pdffile, search_term, fallback, heading_term)
     except Exception as e:
         log.error('File conversion failed for {}: {}'.format(pdffile, e))
 
 
-def convert(path: str) -> str:
+def convert(path: str, search_term: str = None, fallback: bool = False, heading_term: str = None) -> str:
     """
-    Convert a single PDF to text.
+    Convert a single PDF to text. PDFs rejected by the quality checks get a
+    .rejected file recording the reason instead of a text file.
 
     Parameters
     ----------
     path : str
         Location of a PDF file.
 
+    search_term : str
+        If given, PDFs without this term are rejected, see `fulltext`
+
+    fallback : bool
+        Use the extraction strategy of the fallback lane, see `extract_fulltext_fallback`
+
+    heading_term : str
+        If given, index the headings of the pages holding this term, see `extract_fulltext`
+
     Returns
     -------
     str
-        Location of text file.
+        Location of text file, or None if the PDF was rejected.
     """
     if not os.path.exists(path):
         raise RuntimeError('No such path: %s' % path)
@@ -294,16 +1122,31 @@ def convert(path: str) -> str:
         log.info('Skipping "{}"'.format(path))
         return outpath
 
+    ## Skip conversion when the pdf was rejected (or quarantined) before
+    if os.path.exists(rejection_path(path)):
+        log.info('Skipping rejected "{}"'.format(path))
+        return None
+
     try:
-        content = fulltext(path)
+        if fallback:
+            content, stats = extract_fulltext_fallback(path, search_term)
+        else:
+            content, stats = extract_fulltext(path, search_term, heading_term)
 
         log.debug('Writing text to "{}"'.format(outpath))
 
+        ## The statistics first, a txt file is only considered done once it exists
+        write_stats(outpath, stats)
         with open(outpath, 'w', encoding='utf-8') as f:
             f.write(content)
             
         log.debug('Wrote text to "{}"'.format(outpath))
 
+    except RejectedPDF as e:
+        log.info(e)
+        record_rejection(e)
+        return None
+
     except Exception as e:
         msg = "Conversion failed for '%s': %s"
         log.error(msg, path, e)
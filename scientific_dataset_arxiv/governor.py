@@ -0,0 +1,139 @@
+#####################################################################################################################
+
+## Memory governor for the worker pools
+## It samples the RSS of this process and its workers, and the memory available on the machine, to decide how many
+## workers fit in a RAM budget and which workers grew too large and should be recycled.
+## RSS counts pages shared with the parent (e.g. after a fork), so the estimates err on the safe side.
+
+import logging
+import re
+
+import psutil
+
+#####################################################################################################################
+
+WORKER_ESTIMATE = 512 * 2**20  # Bytes assumed per worker until one can be measured
+SYSTEM_RESERVE = 1 * 2**30  # Bytes of system memory always left to other processes
+
+UNITS = {'': 1, 'B': 1, 'K': 2**10, 'KB': 2**10, 'M': 2**20, 'MB': 2**20, 'G': 2**30, 'GB': 2**30, 'T': 2**40, 'TB': 2**40}
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+## Function to read a size like '16GB'
+def parse_size(size):
+    """
+    Convert a size to bytes.
+
+    Args:
+        size (int, str or None): A number of bytes, or a string like '512MB' or '16 GB'.
+
+    Returns:
+        int: The size in bytes, None if `size` is None.
+    """
+    if size is None or isinstance(size, int):
+        return size
+
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', size.upper())
+    if match is None:
+        raise ValueError(f'Invalid size: {size!r}')
+
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+class MemoryGovernor:
+    """
+    Decide how many workers fit in a memory budget.
+
+    Args:
+        budget (int): Bytes available to this process and its workers together.
+        max_workers (int): The largest number of workers, e.g. the number of CPUs.
+        min_workers (int, optional): The smallest number of workers, even when over budget. Defaults to 1.
+        worker_estimate (int, optional): Bytes assumed per worker before any worker is running.
+    """
+    def __init__(self, budget, max_workers, min_workers=1, worker_estimate=WORKER_ESTIMATE):
+        self.budget = budget
+        self.max_workers = max(1, max_workers)
+        self.min_workers = max(1, min(min_workers, self.max_workers))
+        self.worker_estimate = worker_estimate
+        self.process = psutil.Process()
+        self.peak = 0
+
+    def sample(self):
+        """
+        Measure the memory in use.
+
+        Returns:
+            tuple: The RSS of this process, a dict of the RSS of every worker by pid, and the available system memory.
+        """
+        parent_rss = self.process.memory_info().rss
+
+        workers = {}
+        for child in self.process.children(recursive=True):
+            try:
+                workers[child.pid] = child.memory_info().rss
+            except psutil.Error:
+                ## The worker exited in the meantime
+                continue
+
+        self.peak = max(self.peak, parent_rss + sum(workers.values()))
+        return parent_rss, workers, psutil.virtual_memory().available
+
+    def target_workers(self):
+        """
+        The number of workers that fit in the budget right now.
+
+        The size of a worker is the largest RSS among the running workers, or the estimate if none is running.
+        Memory used by other processes on the machine is taken into account through the available system memory.
+
+        Returns:
+            int: The number of workers, between min_workers and max_workers.
+        """
+        parent_rss, workers, available = self.sample()
+
+        per_worker = max(workers.values()) if workers else self.worker_estimate
+        if workers:
+            ## Keep the estimate in line with what workers actually use
+            self.worker_estimate = per_worker
+
+        ## Workers already running are part of the available memory once they are gone
+        room = min(self.budget - parent_rss, available + sum(workers.values()) - SYSTEM_RESERVE)
+        target = int(room // max(per_worker, 1))
+
+        target = min(max(target, self.min_workers), self.max_workers)
+        log.debug('Memory: parent {:.0f} MB, {} workers of up to {:.0f} MB, target {} workers'.format(parent_rss / 2**20, len(workers), per_worker / 2**20, target))
+        return target
+
+    def bloated_workers(self, workers_count):
+        """
+        The workers using more than their share of the budget, and worth recycling.
+
+        Args:
+            workers_count (int): The number of workers sharing the budget.
+
+        Returns:
+            list: The pids of the bloated workers.
+        """
+        parent_rss, workers, _ = self.sample()
+        share = (self.budget - parent_rss) / max(workers_count, 1)
+        return [pid for pid, rss in workers.items() if rss > share]
+
+
+## Function to create a governor from the config
+def governor_from_config(max_workers):
+    """
+    Create a governor from the memory settings of the config.
+
+    Args:
+        max_workers (int): The largest number of workers.
+
+    Returns:
+        MemoryGovernor: The governor, or None if no memory budget is configured.
+    """
+    from .config import memory_budget, worker_memory_estimate
+
+    if memory_budget is None:
+        return None
+
+    return MemoryGovernor(parse_size(memory_budget), max_workers, worker_estimate=parse_size(worker_memory_estimate))
@@ -0,0 +1,257 @@
+#####################################################################################################################
+
+## Coordinator-free distribution of work units (e.g. yymm) over several machines sharing a folder
+## A node claims a unit by creating `{unit}.lease` exclusively, keeps it alive with a heartbeat, and marks the unit
+## with `{unit}.done` when it is finished. Leases of crashed nodes expire and are taken over by other nodes.
+## The done markers carry a fingerprint of the settings of the work, so a unit finished with other settings (e.g.
+## before a config change) is done again.
+## Expiry compares wall clock times of different machines, so their clocks must agree to well within the ttl.
+
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from time import sleep, time
+
+from .stages import fingerprint
+
+#####################################################################################################################
+
+LEASE_TTL = 30*60  # Seconds after which a lease that wasn't renewed can be taken over
+POLL_INTERVAL = 60  # Seconds between two looks at the units claimed by other nodes
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+## Function to get a name for this node
+def default_node_id():
+    """ Unique name of this process, made of the host name and the process id """
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+class LeaseDirectory:
+    """
+    Lease files for work units in a folder shared by every node.
+
+    Args:
+        path (str): The shared folder, one per kind of work (e.g. one for the downloads and one for the merges).
+        node_id (str, optional): The name of this node. Defaults to the host name and process id.
+        ttl (float, optional): Seconds after which a lease that wasn't renewed expires. Defaults to LEASE_TTL.
+        params (dict, optional): The settings the outputs of the units depend on, units finished with other
+            settings aren't done. Must be JSON serializable. Defaults to None, any finished unit is done.
+    """
+    def __init__(self, path, node_id=None, ttl=LEASE_TTL, params=None):
+        self.path = path
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.tag = None if params is None else fingerprint(params, {})[:16]
+        os.makedirs(path, exist_ok=True)
+
+    def lease_path(self, unit):
+        return os.path.join(self.path, f'{unit}.lease')
+
+    def done_path(self, unit):
+        if self.tag is None:
+            return os.path.join(self.path, f'{unit}.done')
+        return os.path.join(self.path, f'{unit}.{self.tag}.done')
+
+    def is_done(self, unit):
+        """ Whether a node finished the unit """
+        return os.path.exists(self.done_path(unit))
+
+    def _content(self):
+        ## The token tells the writes of a node apart, see `renew`
+        return json.dumps({'node': self.node_id, 'expires': time() + self.ttl, 'token': uuid.uuid4().hex})
+
+    def _read(self, path):
+        """ Read a lease, None if it can't be read (e.g. it is being written or was removed) """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _create(self, unit):
+        """ Create the lease, only if no other node holds one """
+        try:
+            fd = os.open(self.lease_path(unit), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self._content())
+        return True
+
+    def try_claim(self, unit):
+        """
+        Try to claim a unit, taking over the lease of another node if it expired.
+
+        Args:
+            unit (str): The work unit, e.g. a yymm.
+
+        Returns:
+            bool: True if this node now holds the lease.
+        """
+        if self.is_done(unit):
+            return False
+
+        if self._create(unit):
+            return self._check_not_done(unit)
+
+        lease = self._read(self.lease_path(unit))
+        if lease is None or lease['expires'] > time():
+            return False
+
+        ## The lease expired: move it aside, only one node can win the rename
+        stale_path = '{}.stale.{}'.format(self.lease_path(unit), uuid.uuid4().hex)
+        try:
+            os.rename(self.lease_path(unit), stale_path)
+        except FileNotFoundError:
+            return False
+
+        ## The holder may have renewed it between the read and the rename, then give it back
+        stale = self._read(stale_path)
+        if stale is not None and stale['expires'] > time():
+            try:
+                os.link(stale_path, self.lease_path(unit))
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+        log.info('{} took over the expired lease of {} from {}'.format(self.node_id, unit, lease['node']))
+
+        ## Another node may have created a fresh lease in the meantime
+        return self._create(unit) and self._check_not_done(unit)
+
+    def _check_not_done(self, unit):
+        """ Give a fresh lease back if the unit was finished while it was being claimed """
+        if self.is_done(unit):
+            self.release(unit, done=False)
+            return False
+        return True
+
+    def holds(self, unit):
+        """ Whether this node still holds the lease of a unit """
+        lease = self._read(self.lease_path(unit))
+        return lease is not None and lease['node'] == self.node_id
+
+    def renew(self, unit):
+        """
+        Push the expiry of a lease back.
+
+        The lease is replaced atomically, then read back: another node may have taken it over between the ownership
+        check and the write, and the last writer holds it.
+
+        Returns:
+            bool: False if the lease was lost to another node.
+        """
+        if not self.holds(unit):
+            return False
+
+        content = self._content()
+        tmp_path = '{}.{}.tmp'.format(self.lease_path(unit), uuid.uuid4().hex)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.lease_path(unit))
+
+        return self._read(self.lease_path(unit)) == json.loads(content)
+
+    def release(self, unit, done):
+        """
+        Give a lease back.
+
+        Args:
+            unit (str): The work unit.
+            done (bool): Mark the unit as finished, otherwise another node can claim it right away.
+        """
+        if done:
+            with open(self.done_path(unit), 'w', encoding='utf-8') as f:
+                f.write(self.node_id)
+
+        if self.holds(unit):
+            try:
+                os.remove(self.lease_path(unit))
+            except FileNotFoundError:
+                pass
+
+
+class Heartbeat:
+    """
+    Renew a lease in a background thread while the unit is being processed.
+
+    Args:
+        leases (LeaseDirectory): The lease directory.
+        unit (str): The claimed unit.
+    """
+    def __init__(self, leases, unit):
+        self.leases = leases
+        self.unit = unit
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.leases.ttl / 3):
+            if not self.leases.renew(self.unit):
+                ## The work goes on, the outputs of the stages are safe to compute twice
+                log.warning('{} lost the lease of {}'.format(self.leases.node_id, self.unit))
+                self.lost = True
+                return
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+## Function to iterate over the units claimed by this node
+def claimed_units(units, leases, poll_interval=POLL_INTERVAL):
+    """
+    Yield the units this node managed to claim, until every unit is done by some node.
+
+    The lease is renewed while the caller processes a unit, and the unit is marked as done when the caller asks for
+    the next one. If the caller stops with an exception, the lease is released without marking the unit as done.
+    Units held by other nodes are checked again every `poll_interval` seconds, to pick up the ones whose node crashed.
+
+    Args:
+        units (list): The work units, e.g. yymm strings.
+        leases (LeaseDirectory): The lease directory shared by the nodes.
+        poll_interval (float, optional): Seconds between two passes over the units held by others.
+
+    Yields:
+        str: The claimed units.
+    """
+    remaining = list(units)
+
+    while remaining:
+        held_by_others = []
+
+        for unit in remaining:
+            if leases.is_done(unit):
+                continue
+
+            if not leases.try_claim(unit):
+                held_by_others.append(unit)
+                continue
+
+            heartbeat = Heartbeat(leases, unit).start()
+            completed = False
+            try:
+                yield unit
+                completed = True
+            finally:
+                heartbeat.stop()
+                leases.release(unit, done=completed)
+
+        remaining = [unit for unit in held_by_others if not leases.is_done(unit)]
+        if remaining:
+            print(f"Waiting for {len(remaining)} units held by other nodes.")
+            sleep(poll_interval)
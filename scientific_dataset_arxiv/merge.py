@@ -0,0 +1,187 @@
+#####################################################################################################################
+
+## Merge of the txt files of a year with its metadata, shared by the merge scripts
+## The txt files of every month are processed on a pool of merge workers (see `merge_workers`), joined with the
+## metadata and saved to a part file right away (see `checkpoints`), and the parts are compacted into the yearly
+## parquet file at the end. The scripts only differ by the worker function and the way its results are joined.
+## pandas, datasets and zstandard are imported in the functions: the workers started with the 'spawn' start method
+## import the merge scripts again, and so this module, but don't need them.
+
+import os
+from glob import glob
+from time import time
+from multiprocessing import get_context, cpu_count
+
+from .arxiv_ids import select_versions
+from .checkpoints import part_file, write_part, compact_parts
+from .merge_workers import init_worker, extract_id_from_file
+
+#####################################################################################################################
+
+METADATA_REPO_ID = 'bluuebunny/arxiv_metadata_by_year'  # Hub dataset of the trimmed metadata, one file per year
+
+#####################################################################################################################
+
+## Function to load the metadata of a year
+def load_metadata(yy):
+    """
+    Load the trimmed metadata of a year from the Hugging Face hub.
+
+    Args:
+        yy (str): The year in two-digit format.
+
+    Returns:
+        pd.DataFrame: The metadata dataframe.
+    """
+    from datasets import load_dataset
+
+    FILENAME = f'data/arxiv_metadata_20{yy}.parquet'
+    dataset = load_dataset(METADATA_REPO_ID, data_files=FILENAME, verification_mode='no_checks')
+
+    return dataset['train'].to_pandas()
+
+## Function to process the txt files of a month
+def merge_month(pool, metadata_df, month_folder, dataset_file, process, join, chunksize=None, sampled=False, version='latest'):
+    """
+    Merge the metadata with the results of the workers on the txt files of a month, and save them to a part file.
+
+    Args:
+        pool (multiprocessing.pool.Pool): The pool of merge workers.
+        metadata_df (pd.DataFrame): The metadata dataframe of the year.
+        month_folder (str): The folder holding the txt files of the month.
+        dataset_file (str): The path of the yearly parquet file.
+        process (callable): The worker function, called with the path of every txt file, see `merge_workers`.
+        join (callable): Called with the metadata dataframe and the results of the workers that aren't None,
+            returns the dataframe of the month.
+        chunksize (int, optional): Files sent to a worker at once. Defaults to as many as pool.map would.
+        sampled (bool, optional): Only merge the papers of the metadata, which was sampled. Defaults to False.
+        version (str or int, optional): The version merged when the folder holds several versions of a paper, e.g.
+            downloaded by a run that kept every version, see `select_versions`. Defaults to 'latest'.
+
+    Returns:
+        pd.DataFrame: The results of the month.
+    """
+    ## Imported here, only the packed months need zstandard
+    from .textstore import list_texts
+
+    yymm = os.path.basename(os.path.normpath(month_folder))
+
+    ## Get a list of all txt files of the month, including the compressed ones
+    txt_files = list_texts(month_folder)
+
+    ## Keep the configured version of every paper, results come back in any order
+    txt_files = select_versions(txt_files, version)
+
+    ## Only the sampled papers are merged when building a sample, the folder may hold others from a full run
+    if sampled:
+        sample = set(metadata_df['id'])
+        txt_files = [file_path for file_path in txt_files if extract_id_from_file(file_path) in sample]
+
+    ## Track the progress
+    print(f'Processing {len(txt_files)} files of {yymm}')
+
+    ## Send the files in chunks, as many as pool.map would by default unless configured
+    chunksize = chunksize or max(1, len(txt_files) // (4 * cpu_count()))
+
+    # Collect the results as they complete
+    results = [res for res in pool.imap_unordered(process, txt_files, chunksize=chunksize) if res is not None]
+
+    month_df = join(metadata_df, results)
+
+    ## Save the month right away, a crash won't lose it
+    write_part(month_df, dataset_file, yymm)
+    print(f'Saved {len(month_df)} rows of {yymm}')
+
+    return month_df
+
+## Function to create the dataset of a year
+def merge_year(yy, txt_folder, dataset_file, process, join, chunksize=None, start_method=None,
+               sample_fraction=None, sample_seed=0, keep_parts=False, version='latest'):
+    """
+    Merge the metadata of a year with the results of the workers on its txt files, and save it to a parquet file.
+
+    Every month is saved to a part file as soon as it is done, and months with a part file are skipped, so a
+    crashed run resumes from the last completed month. The parts are compacted into the yearly file at the end.
+    With a memory budget in the config, the pool is sized to it and restarted between months when it no longer fits.
+
+    Args:
+        yy (str): The year in two-digit format.
+        txt_folder (str): The folder holding the txt files in yymm subfolders.
+        dataset_file (str): The path of the parquet file to write.
+        process (callable): The worker function, see `merge_month`.
+        join (callable): The join of the results of a month with the metadata, see `merge_month`.
+        chunksize (int, optional): Files sent to a worker at once. Defaults to as many as pool.map would.
+        start_method (str, optional): Start method of the workers, e.g. 'spawn'. Defaults to the platform default.
+        sample_fraction (float, optional): Only merge a stratified sample of this fraction of the papers, see
+            `sampling`. Defaults to None, every paper.
+        sample_seed (int, optional): The seed of the sample. Defaults to 0.
+        keep_parts (bool, optional): Keep the part files once compacted, so that a later run only merges the months
+            whose part was removed, see `compact_parts`. Defaults to False.
+        version (str or int, optional): The version merged for every paper, see `merge_month`. Defaults to 'latest'.
+
+    Returns:
+        int: The number of rows of the dataset, or None if no file could be processed.
+    """
+    ## Find the months that don't have a part yet
+    month_folders = sorted(glob(f'{txt_folder}/{yy}*/'))
+    pending = [folder for folder in month_folders if not os.path.exists(part_file(dataset_file, os.path.basename(os.path.normpath(folder))))]
+    print(f'{len(month_folders) - len(pending)} of {len(month_folders)} months of 20{yy} already done')
+
+    if pending:
+        from .governor import governor_from_config
+
+        ## Load the trimmed dataframe into memory
+        print('Loading the trimmed metadata dataframe into memory')
+        metadata_df = load_metadata(yy)
+
+        ## Keep only the sampled papers when building a sample, the same ones download_convert.py downloaded
+        if sample_fraction is not None:
+            from .sampling import sample_metadata
+            metadata_df = sample_metadata(metadata_df, sample_fraction, sample_seed)
+            print(f'Sampled {len(metadata_df)} papers of 20{yy}')
+
+        metadata_ids = frozenset(metadata_df['id'])
+
+        ## Size the pool to the memory budget if there is one, after the metadata was loaded
+        governor = governor_from_config(cpu_count())
+        processes = governor.target_workers() if governor is not None else cpu_count()
+
+        ## Process the files in parallel, the workers only get the ids found in the metadata, once
+        pool = get_context(start_method).Pool(processes, initializer=init_worker, initargs=(metadata_ids, time()))
+
+        for month_folder in pending:
+            merge_month(pool, metadata_df, month_folder, dataset_file, process, join, chunksize, sample_fraction is not None, version)
+
+            if governor is None:
+                continue
+
+            ## Shrink the pool when it no longer fits, grow it when there is clearly room, and replace workers that
+            ## outgrew their share
+            target = governor.target_workers()
+            bloated = governor.bloated_workers(processes)
+            if bloated or target < processes or target > processes * 1.25:
+                print(f'Restarting the pool with {target} workers instead of {processes}, {len(bloated)} workers outgrew their memory share')
+                pool.close()
+                pool.join()
+                processes = target
+                pool = get_context(start_method).Pool(processes, initializer=init_worker, initargs=(metadata_ids, time()))
+
+        # Close the pool and wait for all worker processes to finish
+        pool.close()
+        pool.join()
+
+        if governor is not None:
+            print(f'Peak memory of the merge: {governor.peak / 2**20:.0f} MB')
+
+    ## Compact the months into a single parquet file
+    print('Saving the dataset to a parquet file')
+    rows = compact_parts(dataset_file, keep_parts)
+
+    if rows is None:
+        print(f"No texts found for 20{yy}")
+        return None
+
+    ## Print the size of the dataset
+    print(f'Rows in the dataset: {rows}')
+
+    return rows
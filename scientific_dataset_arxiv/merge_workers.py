@@ -0,0 +1,164 @@
+#####################################################################################################################
+
+## Worker entry points of the merge scripts
+## This module only imports what a worker needs, and nothing from pandas or datasets. The workers receive the ids
+## found in the metadata once, through the pool initializer, and return plain dicts that the parent joins with the
+## metadata dataframe. The dicts hold the statistics columns too, see `stats`. The articles start at the heading found
+## in the heading index saved by the conversion when there is one, see `sections`.
+
+import os
+import re
+from time import time
+
+from .arxiv_ids import split_id_version
+from .sections import find_section
+from .stats import STATS_COLUMNS, text_stats, read_stats
+from .textio import read_text_after_term_with_offset, read_text_at, read_nonempty_text
+
+#####################################################################################################################
+
+## Ids found in the metadata, set in every worker by `init_worker`
+metadata_ids = frozenset()
+
+#####################################################################################################################
+
+## Function to set up a worker
+def init_worker(ids, started):
+    """
+    Initializer of the merge workers.
+
+    Args:
+        ids (frozenset): The ids found in the metadata.
+        started (float): time() in the parent when the pool was created, to report the start-up time.
+    """
+    global metadata_ids
+    metadata_ids = ids
+    print(f"Worker {os.getpid()} started in {time() - started:.2f} seconds")
+
+## Function to extract the id from the file path
+def extract_id_from_file(file_path):
+    """
+    Extract the id from the file path.
+
+    Args:
+        file_path (str): The path of the file.
+
+    Returns:
+        str: The id extracted from the file path, in the form of the metadata, e.g. 'math/0701001' for
+            'math0701001v1.txt'.
+    """
+    ## The id without version, see `arxiv_ids`
+    id_without_version, _ = split_id_version(file_path)
+
+    return id_without_version
+
+## Function to gather the statistics columns of a text
+def row_stats(file_path, text, search_term_offset, saved=None):
+    """
+    Gather the statistics columns of the text of a file that goes into the dataset.
+
+    Args:
+        file_path (str): The path of the txt file, whose page count was saved by the conversion.
+        text (str): The text that goes into the dataset.
+        search_term_offset (int): The character offset of the search term in the whole file, None if not found.
+        saved (dict, optional): The statistics saved by the conversion, if they were read already.
+
+    Returns:
+        dict: The statistics columns, the page count is None for files converted before it was saved.
+    """
+    saved = read_stats(file_path) if saved is None else saved
+    stats = dict.fromkeys(STATS_COLUMNS)
+    stats.update(text_stats(text))
+    stats['page_count'] = saved.get('page_count')
+    stats['search_term_offset'] = search_term_offset
+    return stats
+
+## Function to extract the article of a file
+def process_article(file_path, term, sections=True):
+    """
+    Extract the article, i.e. the text after the search term, of a file.
+
+    With `sections`, the article starts at the first heading titled like the search term in the heading index saved
+    by the conversion, read at its offset. Files without such a heading, or converted before the heading index was
+    saved, fall back to the first occurrence of the search term.
+
+    Args:
+        file_path (str): The path of the file to be processed.
+        term (str): The search term.
+        sections (bool, optional): Use the heading index. Defaults to True.
+
+    Returns:
+        dict: The id, the article and its statistics, or None if there is no metadata or no article.
+    """
+    ## Extract the id from the file path
+    id_without_version = extract_id_from_file(file_path)
+
+    ## Check for the metadata before reading the file
+    if id_without_version not in metadata_ids:
+        print(f"Metadata not found for {file_path}")
+        return None
+
+    saved = read_stats(file_path)
+    section = find_section(saved.get('headings'), term) if sections else None
+
+    ## Add a try except block to handle the UnicodeDecodeError or a general error
+    try:
+        found = None
+
+        ## Read the article at the offset of its heading, None if the file changed since the offset was saved
+        if section is not None:
+            offset, byte_offset, heading = section
+            article = read_text_at(file_path, byte_offset, heading)
+            found = None if article is None else (offset, article)
+
+        ## Find the text after the term, only the article (and the text before it, to get its offset) is decoded
+        if found is None:
+            found = read_text_after_term_with_offset(file_path, term)
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+    if found is None:
+        print(f"Article not found for {file_path}")
+        return None
+
+    offset, article = found
+    return {'id': id_without_version, 'article': article, **row_stats(file_path, article, offset, saved)}
+
+## Function to read the full text of a file
+def process_fulltext(file_path, term=None):
+    """
+    Read the full text of a file.
+
+    Args:
+        file_path (str): The path of the file to be processed.
+        term (str, optional): The search term whose offset goes into the statistics, case-insensitive.
+
+    Returns:
+        dict: The id, the full text and its statistics, or None if there is no metadata or the text is empty.
+    """
+    ## Extract the id from the file path
+    id_without_version = extract_id_from_file(file_path)
+
+    ## Check for the metadata before reading the file
+    if id_without_version not in metadata_ids:
+        print(f"Metadata not found for {id_without_version}")
+        return None
+
+    ## Add a try except block to handle the UnicodeDecodeError or a general error
+    try:
+        ## Get the plain text from the file, None if it's empty
+        plain_txt = read_nonempty_text(file_path)
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+    if plain_txt is None:
+        print(f"Empty text for {id_without_version}")
+        return None
+
+    ## The raw dataset keeps every text, the offset tells which ones have the search term
+    match = re.search(re.escape(term), plain_txt, re.IGNORECASE) if term else None
+    offset = match.start() if match else None
+
+    return {'id': id_without_version, 'fulltext': plain_txt, **row_stats(file_path, plain_txt, offset)}
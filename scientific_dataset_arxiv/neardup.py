@@ -0,0 +1,395 @@
+#####################################################################################################################
+
+## Near-duplicate detection with MinHash signatures and locality sensitive hashing (LSH)
+## Every text is turned into a set of word shingles, summarised by a MinHash signature, and its signature is cut into
+## bands. Texts sharing a band are candidates, and candidates whose signatures agree on at least `threshold` of their
+## values are near-duplicates. The first text seen is kept, the later ones point to it.
+## The bands and signatures live in a SQLite file, so the index grows unit by unit (e.g. year by year) across runs
+## with a bounded memory footprint: only a batch of texts and their signatures are held in memory at once.
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import zlib
+from collections import deque
+from multiprocessing import cpu_count, get_context
+
+import numpy as np
+
+#####################################################################################################################
+
+NUM_PERM = 128  # Values in a signature
+SHINGLE_SIZE = 5  # Words in a shingle
+SEED = 1  # Seed of the hash functions, the signatures of different seeds can't be compared
+CANDIDATE_RECALL = 0.95  # Chance for a pair at the threshold to share a band
+CHUNK_VALUES = 2**20  # Shingles times hash functions hashed at once, bounds the memory of a signature
+BATCH_SIZE = 1000  # Texts read from a parquet file and sent to a worker at once
+
+WORD = re.compile(r'\w+')
+MAX_HASH = np.uint64(2**32 - 1)
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+## Function to get the hash functions of the signatures
+def hash_parameters(num_perm=NUM_PERM, seed=SEED):
+    """
+    Draw the parameters of the hash functions h(x) = ((a * x + b) mod 2**64) >> 32, one per value of a signature.
+
+    Returns:
+        tuple: Two uint64 arrays of length num_perm, a (odd) and b.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+## Function to hash the shingles of a text
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    """
+    Hash the word shingles of a text to 32 bits.
+
+    Args:
+        text (str): The text.
+        shingle_size (int, optional): Words in a shingle.
+
+    Returns:
+        np.ndarray: The distinct uint64 hashes (below 2**32) of the shingles, empty for a text without words.
+    """
+    words = WORD.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+
+    word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+
+    ## A short text is a single shingle
+    n = max(len(words) - shingle_size + 1, 1)
+    width = min(shingle_size, len(words))
+
+    ## Polynomial hash of the words of every shingle, wrapping around modulo 2**64
+    hashes = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for k in range(width):
+            hashes = hashes * np.uint64(1000003) + word_hashes[k:k + n]
+
+    return np.unique((hashes >> np.uint64(32)) ^ (hashes & MAX_HASH))
+
+## Function to compute the signature of a text
+def minhash(text, a, b, shingle_size=SHINGLE_SIZE):
+    """
+    Compute the MinHash signature of a text.
+
+    The shingles are hashed by every hash function at once, a chunk of shingles at a time.
+
+    Args:
+        text (str): The text.
+        a (np.ndarray): The multipliers of the hash functions.
+        b (np.ndarray): The increments of the hash functions.
+        shingle_size (int, optional): Words in a shingle.
+
+    Returns:
+        np.ndarray: The uint32 signature, None for a text without words.
+    """
+    shingles = shingle_hashes(text, shingle_size)
+    if shingles.size == 0:
+        return None
+
+    signature = np.full(a.size, MAX_HASH, dtype=np.uint64)
+    chunk = max(CHUNK_VALUES // a.size, 1)
+
+    with np.errstate(over='ignore'):
+        for start in range(0, shingles.size, chunk):
+            hashed = (shingles[start:start + chunk, None] * a[None, :] + b[None, :]) >> np.uint64(32)
+            np.minimum(signature, hashed.min(axis=0), out=signature)
+
+    return signature.astype(np.uint32)
+
+## Function to compute the signatures of a batch of texts, in a worker
+def minhash_batch(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=SEED):
+    """
+    Compute the signatures of a batch of texts.
+
+    Returns:
+        list: The signatures, None for the texts without words.
+    """
+    a, b = hash_parameters(num_perm, seed)
+    return [minhash(text, a, b, shingle_size) if text else None for text in texts]
+
+## Function to cut the signatures in bands
+def lsh_bands(threshold, num_perm=NUM_PERM, recall=CANDIDATE_RECALL):
+    """
+    Choose the number of bands and of rows per band.
+
+    The rows are as many as possible, to get few candidates, while a pair with a similarity equal to the threshold
+    still shares a band with a probability of at least `recall`.
+
+    Args:
+        threshold (float): The similarity above which texts are near-duplicates.
+        num_perm (int, optional): Values in a signature.
+        recall (float, optional): The probability for a pair at the threshold to become a candidate.
+
+    Returns:
+        tuple: The number of bands and the number of rows per band.
+    """
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+## Function to find the column holding the text
+def text_column(columns):
+    """ The text column of the datasets: 'article' for the articles dataset, 'fulltext' for the raw dataset """
+    for column in ('article', 'fulltext'):
+        if column in columns:
+            return column
+    raise ValueError(f'No text column among {list(columns)}')
+
+
+class NearDuplicateIndex:
+    """
+    A persistent LSH index of the texts of parquet files.
+
+    The files are indexed as units: a unit is indexed in a single transaction, so an interrupted run resumes from the
+    last complete unit, and a unit that was already indexed is skipped unless its file changed. Since later units are
+    compared with the earlier ones, a changed unit is indexed again along with every unit indexed after it.
+
+    Args:
+        path (str): The SQLite file of the index.
+        threshold (float, optional): The estimated Jaccard similarity above which two texts are near-duplicates.
+        num_perm (int, optional): Values in a signature.
+        shingle_size (int, optional): Words in a shingle.
+        seed (int, optional): Seed of the hash functions.
+    """
+    def __init__(self, path, threshold=0.8, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=SEED):
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS units (seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, digest TEXT);
+            CREATE TABLE IF NOT EXISTS docs (doc INTEGER PRIMARY KEY, id TEXT UNIQUE, unit INTEGER,
+                                             signature BLOB, original INTEGER, similarity REAL);
+            CREATE TABLE IF NOT EXISTS bands (band INTEGER, key INTEGER, doc INTEGER,
+                                              PRIMARY KEY (band, key, doc)) WITHOUT ROWID;
+        ''')
+        self._check_settings()
+
+    def _check_settings(self):
+        """ Record the settings of a new index, and empty an index built with other settings, to rebuild it """
+        settings = {'threshold': self.threshold, 'num_perm': self.num_perm, 'shingle_size': self.shingle_size, 'seed': self.seed}
+        stored = dict(self.db.execute('SELECT name, value FROM settings'))
+
+        changed = [name for name, value in settings.items() if stored.get(name) != repr(value)]
+        if not changed:
+            return
+
+        with self.db:
+            if stored:
+                ## The signatures and bands of different settings can't be compared, every unit is indexed again
+                log.warning(f'{self.path} was built with other settings ({", ".join(changed)}), rebuilding the index')
+                for table in ('bands', 'docs', 'units', 'settings'):
+                    self.db.execute(f'DELETE FROM {table}')
+            self.db.executemany('INSERT INTO settings VALUES (?, ?)', [(name, repr(value)) for name, value in settings.items()])
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _band_keys(self, signature):
+        """ Hash every band of a signature to a signed 64 bit integer """
+        return [
+            (band, int.from_bytes(hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest(), 'little', signed=True))
+            for band in range(self.bands)
+        ]
+
+    def _add(self, unit, id_, signature):
+        """
+        Add a text to the index, as a near-duplicate of an earlier text if it has one.
+
+        Returns:
+            bool: Whether the text is a near-duplicate.
+        """
+        keys = self._band_keys(signature)
+
+        ## Texts sharing a band with this one, one primary key lookup per band
+        lookups = ' UNION '.join(['SELECT doc FROM bands WHERE band = ? AND key = ?'] * len(keys))
+        candidates = self.db.execute(
+            f'SELECT doc, signature FROM docs WHERE doc IN ({lookups}) ORDER BY doc',
+            [value for key in keys for value in key],
+        ).fetchall()
+
+        original, similarity = None, None
+        if candidates:
+            signatures = np.frombuffer(b''.join(row[1] for row in candidates), dtype=np.uint32).reshape(len(candidates), -1)
+            similarities = (signatures == signature).mean(axis=1)
+
+            ## The earliest text similar enough is the original
+            matches = np.flatnonzero(similarities >= self.threshold)
+            if matches.size:
+                original, similarity = candidates[matches[0]][0], float(similarities[matches[0]])
+
+        if original is not None:
+            ## Near-duplicates aren't added to the bands, every text is compared with the kept texts only
+            self.db.execute('INSERT INTO docs (id, unit, original, similarity) VALUES (?, ?, ?, ?)', (id_, unit, original, similarity))
+            return True
+
+        doc = self.db.execute('INSERT INTO docs (id, unit, signature) VALUES (?, ?, ?)', (id_, unit, signature.tobytes())).lastrowid
+        self.db.executemany('INSERT INTO bands VALUES (?, ?, ?)', [(band, key, doc) for band, key in keys])
+        return False
+
+    def _drop_units_from(self, seq):
+        """ Remove a unit and every unit indexed after it """
+        first_doc = self.db.execute('SELECT MIN(doc) FROM docs WHERE unit >= ?', (seq,)).fetchone()[0]
+        if first_doc is not None:
+            ## The texts of a unit were added after the texts of the units before it
+            self.db.execute('DELETE FROM bands WHERE doc >= ?', (first_doc,))
+            self.db.execute('DELETE FROM docs WHERE doc >= ?', (first_doc,))
+        self.db.execute('DELETE FROM units WHERE seq >= ?', (seq,))
+
+    def prune(self, parquet_files):
+        """
+        Remove the units whose file is no longer among `parquet_files`, or comes in another order, and every unit
+        indexed after them, so that no near-duplicate points to a text that is no longer in the files and the earlier
+        files keep precedence. The dropped units that are still in the files are indexed again by `index_file`.
+
+        Args:
+            parquet_files (list): The parquet files that make up the dataset, in the order in which they take
+                precedence.
+
+        Returns:
+            int: The number of units removed.
+        """
+        names = [os.path.basename(parquet_file) for parquet_file in parquet_files]
+        units = self.db.execute('SELECT seq, name FROM units ORDER BY seq').fetchall()
+
+        ## The units indexed in the order of the files are kept
+        kept = 0
+        while kept < len(units) and kept < len(names) and units[kept][1] == names[kept]:
+            kept += 1
+        if kept == len(units):
+            return 0
+
+        log.info(f'{", ".join(name for _, name in units[kept:])} no longer indexed in this order, dropping them')
+        with self.db:
+            self._drop_units_from(units[kept][0])
+        return len(units) - kept
+
+    def index_file(self, parquet_file, processes=None, start_method=None, batch_size=BATCH_SIZE):
+        """
+        Index the texts of a parquet file, unless it was already indexed and didn't change.
+
+        The file is read in batches of `batch_size` rows, and the signatures of a few batches at a time are computed
+        by a pool of `processes` workers, while the texts are added to the index in the order of the file.
+
+        Args:
+            parquet_file (str): A parquet file with an 'id' column and an 'article' or 'fulltext' column.
+            processes (int, optional): The number of workers. Defaults to the number of CPUs.
+            start_method (str, optional): The multiprocessing start method, None for the platform default.
+            batch_size (int, optional): Rows read at once.
+
+        Returns:
+            int: The near-duplicates found in the file, None if it was already indexed.
+        """
+        import pyarrow.parquet as pq
+
+        name = os.path.basename(parquet_file)
+        stat = os.stat(parquet_file)
+        digest = f'{stat.st_size}-{stat.st_mtime_ns}'
+
+        row = self.db.execute('SELECT seq, digest FROM units WHERE name = ?', (name,)).fetchone()
+        if row is not None and row[1] == digest:
+            log.info(f'{name} is already indexed')
+            return None
+
+        parquet = pq.ParquetFile(parquet_file)
+        column = text_column(parquet.schema_arrow.names)
+        processes = processes or cpu_count()
+
+        duplicates = 0
+        with self.db:
+            if row is not None:
+                log.info(f'{name} changed, indexing it and the files indexed after it again')
+                self._drop_units_from(row[0])
+
+            unit = self.db.execute('INSERT INTO units (name, digest) VALUES (?, ?)', (name, digest)).lastrowid
+
+            with get_context(start_method).Pool(processes) as pool:
+                ## A few batches in flight keep every worker busy, without reading the whole file ahead
+                pending = deque()
+                batches = parquet.iter_batches(batch_size=batch_size, columns=['id', column])
+
+                for batch in batches:
+                    ids, texts = batch.column('id').to_pylist(), batch.column(column).to_pylist()
+                    pending.append((ids, pool.apply_async(minhash_batch, (texts, self.num_perm, self.shingle_size, self.seed))))
+
+                    while len(pending) > 2 * processes or (pending and pending[0][1].ready()):
+                        duplicates += self._add_batch(unit, *pending.popleft())
+
+                while pending:
+                    duplicates += self._add_batch(unit, *pending.popleft())
+
+        log.info(f'{name}: {duplicates} near-duplicates')
+        return duplicates
+
+    def _add_batch(self, unit, ids, result):
+        """ Add the texts of a batch once their signatures are ready """
+        duplicates = 0
+        for id_, signature in zip(ids, result.get()):
+            ## Empty texts and ids already indexed from another file are left out
+            if signature is None or self.db.execute('SELECT 1 FROM docs WHERE id = ?', (id_,)).fetchone():
+                continue
+            duplicates += self._add(unit, id_, signature)
+        return duplicates
+
+    def duplicates(self):
+        """
+        Get the near-duplicates found so far.
+
+        Returns:
+            list: Tuples of the id of a near-duplicate, the id of the text it duplicates, and their similarity.
+        """
+        return self.db.execute('''
+            SELECT dup.id, orig.id, dup.similarity FROM docs AS dup JOIN docs AS orig ON dup.original = orig.doc
+            ORDER BY dup.doc
+        ''').fetchall()
+
+    def duplicate_ids(self):
+        """ The ids of the near-duplicates found so far, as a set """
+        return {row[0] for row in self.db.execute('SELECT id FROM docs WHERE original IS NOT NULL')}
+
+
+## Function to index a list of parquet files
+def index_files(index_file, parquet_files, threshold=0.8, processes=None, start_method=None):
+    """
+    Index parquet files in order, and return the near-duplicates found in all of them. Files indexed before that are
+    no longer in the list, or in another order, are removed from the index, see `NearDuplicateIndex.prune`.
+
+    Args:
+        index_file (str): The SQLite file of the index, created if it doesn't exist.
+        parquet_files (list): The parquet files, in the order in which they take precedence.
+        threshold (float, optional): The similarity above which texts are near-duplicates.
+        processes (int, optional): The number of workers.
+        start_method (str, optional): The multiprocessing start method.
+
+    Returns:
+        list: Tuples of the id of a near-duplicate, the id of the text it duplicates, and their similarity.
+    """
+    with NearDuplicateIndex(index_file, threshold) as index:
+        index.prune(parquet_files)
+        for parquet_file in parquet_files:
+            index.index_file(parquet_file, processes, start_method)
+        return index.duplicates()
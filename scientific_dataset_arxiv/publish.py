@@ -0,0 +1,404 @@
+#####################################################################################################################
+
+## Publishing of the datasets to the Hugging Face Hub
+## The outputs are cut into shards of a target size, written to a staging folder, and a manifest records the sha256 of
+## every shard once it is committed to the repo. A run only uploads the shards whose hash changed (or that are missing
+## from the repo), in parallel, and commits them in groups, so an interrupted run resumes where it stopped; the Hub
+## skips the files it already received before a commit. Shards that are no longer produced are deleted from the repo.
+## Sharding is deterministic, so unchanged outputs give identical shards.
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import sleep
+
+#####################################################################################################################
+
+COMMIT_EVERY = 50  # Shards per commit
+RETRIES = 5  # Attempts to upload a shard or make a commit
+RETRY_DELAY = 2  # Seconds before the first retry, doubled at every attempt
+HASH_CHUNK = 2**24  # Bytes hashed at once
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+## Function to hash a file
+def sha256_file(path):
+    """ The hex sha256 of a file, read in chunks """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+## Function to name the shards of a file
+def shard_names(stem, extension, count):
+    """ The file names of `count` shards, following the Hub convention, or the plain name for a single shard """
+    if count == 1:
+        return [f'{stem}.{extension}']
+    return [f'{stem}-{i:05d}-of-{count:05d}.{extension}' for i in range(count)]
+
+## Function to cut a parquet file into shards
+def shard_parquet(parquet_file, out_dir, stem, target_bytes):
+    """
+    Cut a parquet file into shards of about `target_bytes`, with the same number of rows each.
+
+    A file that fits in a single shard is copied as it is, under its own name, so that the repo keeps the same file
+    (e.g. data/arxiv_dataset_2007.parquet) until the file outgrows a shard.
+
+    Args:
+        parquet_file (str): The parquet file.
+        out_dir (str): The folder of the shards, whose older shards of the same stem are removed.
+        stem (str): The name of the shards, e.g. the name of the file without extension.
+        target_bytes (int): The target size of a shard.
+
+    Returns:
+        list: The paths of the shards.
+    """
+    import pyarrow.parquet as pq
+
+    if os.path.getsize(parquet_file) <= target_bytes:
+        path = os.path.join(out_dir, shard_names(stem, 'parquet', 1)[0])
+        clear_shards(out_dir, stem)
+        shutil.copyfile(parquet_file, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return [path]
+
+    parquet = pq.ParquetFile(parquet_file)
+    num_rows = parquet.metadata.num_rows
+
+    count = max(1, math.ceil(os.path.getsize(parquet_file) / target_bytes))
+    rows_per_shard = max(1, math.ceil(num_rows / count))
+    count = max(1, math.ceil(num_rows / rows_per_shard))
+
+    paths = [os.path.join(out_dir, name) for name in shard_names(stem, 'parquet', count)]
+    clear_shards(out_dir, stem)
+
+    ## Stream the rows into the shards, a batch at a time
+    writer, shard, written = None, -1, rows_per_shard
+    for batch in parquet.iter_batches(batch_size=min(rows_per_shard, 10000)):
+        start = 0
+        while start < batch.num_rows:
+            if written == rows_per_shard:
+                if writer is not None:
+                    writer.close()
+                shard += 1
+                writer, written = pq.ParquetWriter(paths[shard] + '.tmp', parquet.schema_arrow), 0
+
+            rows = batch.slice(start, rows_per_shard - written)
+            writer.write_batch(rows)
+            written += rows.num_rows
+            start += rows.num_rows
+
+    if writer is None:
+        ## An empty file is a single empty shard
+        writer = pq.ParquetWriter(paths[0] + '.tmp', parquet.schema_arrow)
+    writer.close()
+
+    for path in paths:
+        os.replace(path + '.tmp', path)
+    return paths
+
+## Function to cut a folder of txt files into tar shards
+def shard_folder(folder, out_dir, stem, target_bytes, suffixes=('.txt', '.json', '.sqlite')):
+    """
+    Pack the files of a folder into tar shards of about `target_bytes`.
+
+    The members are sorted and their metadata is reset, so that the same files always give the same shards.
+
+    Args:
+        folder (str): The folder, e.g. the txt files of a month, possibly packed in a store.
+        out_dir (str): The folder of the shards, whose older shards of the same stem are removed.
+        stem (str): The name of the shards, e.g. the month.
+        target_bytes (int): The target size of a shard.
+        suffixes (tuple, optional): The suffixes of the files to pack.
+
+    Returns:
+        list: The paths of the shards.
+    """
+    files = []
+    for root, _, filenames in os.walk(folder):
+        files.extend(os.path.join(root, fn) for fn in filenames if fn.endswith(suffixes))
+    files.sort()
+
+    ## Split the files in groups of about the target size
+    groups, size = [[]], 0
+    for fn in files:
+        file_size = os.path.getsize(fn)
+        if groups[-1] and size + file_size > target_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(fn)
+        size += file_size
+
+    paths = [os.path.join(out_dir, name) for name in shard_names(stem, 'tar', len(groups))]
+    clear_shards(out_dir, stem)
+
+    for path, group in zip(paths, groups):
+        with tarfile.open(path + '.tmp', 'w', format=tarfile.PAX_FORMAT) as tar:
+            for fn in group:
+                info = tar.gettarinfo(fn, arcname=os.path.relpath(fn, folder))
+                info.mtime, info.uid, info.gid, info.uname, info.gname = 0, 0, 0, '', ''
+                with open(fn, 'rb') as f:
+                    tar.addfile(info, f)
+        os.replace(path + '.tmp', path)
+
+    return paths
+
+## Function to get the prefixes of the shards of a stem
+def shard_prefixes(stem):
+    """ The prefixes of the shard names of a stem, for any number of shards """
+    return (f'{stem}.', f'{stem}-')
+
+## Function to remove the shards of a stem
+def clear_shards(out_dir, stem):
+    """ Remove the shards of a previous run, which may be more than the new ones """
+    os.makedirs(out_dir, exist_ok=True)
+    for fn in os.listdir(out_dir):
+        if fn.startswith(shard_prefixes(stem)):
+            os.remove(os.path.join(out_dir, fn))
+
+## Function to cut a source into shards unless it didn't change
+def cached_shards(source, out_dir, stem, make_shards, target_bytes):
+    """
+    Cut a source into shards and hash them, unless the shards of the same source are already in the staging folder.
+
+    Args:
+        source (str): The file or folder to shard.
+        out_dir (str): The folder of the shards.
+        stem (str): The name of the shards.
+        make_shards (callable): Called with (source, out_dir, stem) to write the shards, returns their paths.
+        target_bytes (int): The target size of a shard, shards of another size are made again.
+
+    Returns:
+        dict: The sha256 of every shard, by path.
+    """
+    from .stages import digest_outputs
+
+    record_path = os.path.join(out_dir, f'.{stem}.json')
+    digest = '{}-{}'.format(digest_outputs([source]), target_bytes)
+
+    try:
+        with open(record_path, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        if record['digest'] == digest and all(os.path.exists(path) for path in record['shards']):
+            return record['shards']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shards = {path: sha256_file(path) for path in make_shards(source, out_dir, stem)}
+    with open(record_path, 'w', encoding='utf-8') as f:
+        json.dump({'digest': digest, 'shards': shards}, f)
+    return shards
+
+## Function to retry a call with an exponential backoff
+def with_retries(call, what):
+    """ Call `call()` until it succeeds, at most RETRIES times """
+    for attempt in range(RETRIES):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == RETRIES - 1:
+                raise
+            delay = RETRY_DELAY * 2 ** attempt
+            log.warning(f'{what} failed ({e}), retrying in {delay} seconds')
+            sleep(delay)
+
+
+class HubRepo:
+    """
+    A dataset repo on the Hugging Face Hub.
+
+    Args:
+        repo_id (str): The repo, e.g. 'bluuebunny/arxiv_dataset_by_year'.
+        token (str, optional): The access token. Defaults to the HUGGINGFACE_TOKEN environment variable.
+        endpoint (str, optional): The url of the Hub. Defaults to the public Hub.
+    """
+    def __init__(self, repo_id, token=None, endpoint=None):
+        from huggingface_hub import HfApi
+
+        self.repo_id = repo_id
+        self.api = HfApi(endpoint=endpoint, token=token or os.environ.get('HUGGINGFACE_TOKEN'))
+
+    def list_files(self):
+        """ The paths of the files in the repo, which is created if it doesn't exist yet """
+        self.api.create_repo(self.repo_id, repo_type='dataset', exist_ok=True)
+        return set(self.api.list_repo_files(self.repo_id, repo_type='dataset'))
+
+    def upload(self, local_path, path_in_repo):
+        """ Upload a file ahead of the commit that adds it, and return the operation to commit """
+        from huggingface_hub import CommitOperationAdd
+
+        operation = CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=local_path)
+        self.api.preupload_lfs_files(self.repo_id, [operation], repo_type='dataset', num_threads=1)
+        return operation
+
+    def commit(self, operations, deletions, message):
+        """ Commit uploaded files and deletions """
+        from huggingface_hub import CommitOperationDelete
+
+        deletions = [CommitOperationDelete(path_in_repo=path) for path in deletions]
+        self.api.create_commit(self.repo_id, list(operations) + deletions, commit_message=message, repo_type='dataset')
+
+
+class LocalRepo:
+    """
+    A stand-in for a Hub repo in a local folder, with the same interface as `HubRepo`, to try the publishing.
+
+    Args:
+        root (str): The folder holding the repos.
+        repo_id (str): The repo, a subfolder of `root`.
+    """
+    def __init__(self, root, repo_id):
+        self.repo_id = repo_id
+        self.path = os.path.join(root, repo_id)
+        os.makedirs(self.path, exist_ok=True)
+
+    def list_files(self):
+        files = set()
+        for root, _, filenames in os.walk(self.path):
+            files.update(os.path.relpath(os.path.join(root, fn), self.path).replace(os.sep, '/') for fn in filenames)
+        return files
+
+    def upload(self, local_path, path_in_repo):
+        return local_path, path_in_repo
+
+    def commit(self, operations, deletions, message):
+        for local_path, path_in_repo in operations:
+            destination = os.path.join(self.path, path_in_repo)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copyfile(local_path, destination)
+        for path_in_repo in deletions:
+            os.remove(os.path.join(self.path, path_in_repo))
+        log.info(f'{self.repo_id}: {message}')
+
+
+## Function to open a repo
+def open_repo(repo_id, endpoint=None):
+    """
+    Open a repo on the Hub, or in a local folder to test the publishing.
+
+    Args:
+        repo_id (str): The repo.
+        endpoint (str, optional): The url of the Hub, or a local folder (path or 'file://' url). Defaults to the Hub.
+
+    Returns:
+        HubRepo or LocalRepo: The repo.
+    """
+    if endpoint is not None and not endpoint.startswith(('http://', 'https://')):
+        return LocalRepo(endpoint[len('file://'):] if endpoint.startswith('file://') else endpoint, repo_id)
+    return HubRepo(repo_id, endpoint=endpoint)
+
+
+class Manifest:
+    """
+    The sha256 of the shards committed to a repo, in a json file of the staging folder.
+
+    Args:
+        path (str): The json file.
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.shards = json.load(f)
+        except FileNotFoundError:
+            self.shards = {}
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.shards, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+## Function to publish shards
+def publish_shards(repo, shards, staging_dir, stems, workers=8):
+    """
+    Upload the shards that changed since they were last committed, and delete the older shards of the same stems.
+
+    Args:
+        repo (HubRepo or LocalRepo): The repo.
+        shards (dict): The local path and sha256 of every shard, by path in the repo.
+        staging_dir (str): The folder holding the manifest of the repo.
+        stems (list): The paths in the repo of the published stems, e.g. 'data/arxiv_dataset_2007'. Files of these
+            stems that aren't shards any more are deleted, the other files of the repo are left alone.
+        workers (int, optional): The number of parallel uploads.
+
+    Returns:
+        int: The number of shards uploaded.
+    """
+    manifest = Manifest(os.path.join(staging_dir, 'manifest.json'))
+    remote = repo.list_files()
+
+    prefixes = tuple(prefix for stem in stems for prefix in shard_prefixes(stem))
+    pending = sorted(path for path, (_, sha) in shards.items() if path not in remote or manifest.shards.get(path) != sha)
+    stale = sorted(path for path in remote if path.startswith(prefixes) and path not in shards)
+
+    log.info(f'{repo.repo_id}: {len(pending)} of {len(shards)} shards to upload, {len(stale)} to delete')
+
+    for start in range(0, max(len(pending), 1), COMMIT_EVERY):
+        group = pending[start:start + COMMIT_EVERY]
+        ## The deletions go with the last commit
+        deletions = stale if start + COMMIT_EVERY >= len(pending) else []
+        if not group and not deletions:
+            break
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(with_retries, lambda path=path: repo.upload(shards[path][0], path), f'Upload of {path}') for path in group]
+            operations = [future.result() for future in as_completed(futures)]
+
+        message = f'Upload {len(group)} shards' + (f', delete {len(deletions)}' if deletions else '')
+        with_retries(lambda: repo.commit(operations, deletions, message), f'Commit of {len(group)} shards')
+
+        ## Only committed shards are recorded
+        for path in group:
+            manifest.shards[path] = shards[path][1]
+        for path in deletions:
+            manifest.shards.pop(path, None)
+        manifest.save()
+
+    return len(pending)
+
+
+## Function to publish files and folders
+def publish(repo, sources, staging_dir, target_bytes, workers=8, path_in_repo='data'):
+    """
+    Shard files and folders to a staging folder, and upload the shards that changed.
+
+    Args:
+        repo (HubRepo or LocalRepo): The repo.
+        sources (list): Parquet files, each sharded under its own name, or folders, each packed into tar shards
+            named after the folder (e.g. a month of txt files). Sources that don't exist are skipped.
+        staging_dir (str): The folder of the shards and the manifest, one per repo.
+        target_bytes (int): The target size of a shard.
+        workers (int, optional): The number of parallel uploads.
+        path_in_repo (str, optional): The folder of the shards in the repo. Defaults to 'data'.
+
+    Returns:
+        int: The number of shards uploaded.
+    """
+    shards, stems = {}, []
+
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+
+        if os.path.isdir(source):
+            stem = os.path.basename(os.path.normpath(source))
+            make_shards = lambda source, out_dir, stem: shard_folder(source, out_dir, stem, target_bytes)
+        else:
+            stem = os.path.splitext(os.path.basename(source))[0]
+            make_shards = lambda source, out_dir, stem: shard_parquet(source, out_dir, stem, target_bytes)
+
+        stems.append(f'{path_in_repo}/{stem}')
+        for local_path, sha in cached_shards(source, staging_dir, stem, make_shards, target_bytes).items():
+            shards[f'{path_in_repo}/{os.path.basename(local_path)}'] = (local_path, sha)
+
+    return publish_shards(repo, shards, staging_dir, stems, workers)
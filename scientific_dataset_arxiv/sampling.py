@@ -0,0 +1,78 @@
+#####################################################################################################################
+
+## Reproducible stratified sample of the papers, to build a small dataset quickly
+## The sample is drawn from the metadata: the papers are grouped by month (the yymm prefix of their id) and primary
+## arXiv category, when the metadata has a 'categories' column, and every group keeps the papers with the smallest
+## hash of their id and the seed. The same papers are picked on every run and every machine, whatever the order of
+## the bucket listing, and a larger fraction keeps every paper of a smaller one. The sample is drawn when listing the
+## bucket, so that only the sampled papers are downloaded and converted, and again in the merge scripts.
+
+import hashlib
+from collections import defaultdict
+
+from .arxiv_ids import id_month
+
+#####################################################################################################################
+
+MIN_PER_STRATUM = 1  # Papers kept in every group, so that small categories are represented
+
+#####################################################################################################################
+
+## Function to hash an id with the seed
+def sample_key(arxiv_id, seed=0):
+    """ A number in [0, 1) drawn from the id and the seed, the papers with the smallest ones are sampled """
+    digest = hashlib.blake2b(f'{seed}:{arxiv_id}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2**64
+
+## Function to get the primary category of a paper
+def primary_category(categories):
+    """ The first of the space-separated categories of the metadata, e.g. 'hep-th' for 'hep-th gr-qc' """
+    if not isinstance(categories, str) or not categories.split():
+        return 'unknown'
+    return categories.split()[0]
+
+## Function to draw a stratified sample of ids
+def select_sample(ids, categories=None, fraction=0.01, seed=0, min_per_stratum=MIN_PER_STRATUM):
+    """
+    Draw a stratified sample of ids, by month and primary category.
+
+    Args:
+        ids (iterable): The ids of the papers, e.g. '0704.0001'.
+        categories (iterable, optional): The categories of every paper, as in the metadata. None stratifies by
+            month only.
+        fraction (float, optional): The fraction of the papers of every group to keep. Defaults to 0.01.
+        seed (int, optional): The seed of the sample. Defaults to 0.
+        min_per_stratum (int, optional): The papers kept in every group, however small. Defaults to 1.
+
+    Returns:
+        set: The sampled ids.
+    """
+    ids = list(ids)
+    categories = [None] * len(ids) if categories is None else list(categories)
+
+    strata = defaultdict(list)
+    for arxiv_id, category in zip(ids, categories):
+        strata[(id_month(arxiv_id), primary_category(category))].append(arxiv_id)
+
+    sample = set()
+    for members in strata.values():
+        count = min(len(members), max(min_per_stratum, round(fraction * len(members))))
+        sample.update(sorted(members, key=lambda arxiv_id: sample_key(arxiv_id, seed))[:count])
+    return sample
+
+## Function to keep the sampled papers of the metadata
+def sample_metadata(metadata_df, fraction, seed=0):
+    """
+    Keep the sampled papers of a metadata dataframe, stratified by primary category if it has a 'categories' column.
+
+    Args:
+        metadata_df (pd.DataFrame): The metadata of a year, with an 'id' column.
+        fraction (float): The fraction of the papers to keep.
+        seed (int, optional): The seed of the sample. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The rows of the sampled papers.
+    """
+    categories = metadata_df['categories'] if 'categories' in metadata_df.columns else None
+    sample = select_sample(metadata_df['id'], categories, fraction, seed)
+    return metadata_df[metadata_df['id'].isin(sample)]
@@ -0,0 +1,145 @@
+#####################################################################################################################
+
+## Full-text search index over the datasets, in a SQLite FTS5 table
+## The title, abstract and text of every paper are indexed by id, so a topic can be spot-checked in milliseconds
+## instead of loading the whole corpus. The index is built from the parquet files month by month (the month being
+## the yymm prefix of the ids): when a file changes, only the months whose ids (or text lengths) changed are indexed
+## again.
+
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+
+from .arxiv_ids import id_month
+from .neardup import text_column
+
+#####################################################################################################################
+
+BATCH_SIZE = 1000  # Rows read from a parquet file at once
+SNIPPET_TOKENS = 16  # Tokens around the matches in the snippets
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+class SearchIndex:
+    """
+    A persistent full-text index of the title, abstract and text of the papers.
+
+    Args:
+        path (str): The SQLite file of the index, created if it doesn't exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS months (file TEXT, month TEXT, digest TEXT, PRIMARY KEY (file, month));
+            CREATE TABLE IF NOT EXISTS docs (doc INTEGER PRIMARY KEY, id TEXT, file TEXT, month TEXT);
+            CREATE INDEX IF NOT EXISTS docs_month ON docs (file, month);
+            CREATE VIRTUAL TABLE IF NOT EXISTS papers USING fts5 (title, abstract, body, tokenize = 'porter unicode61');
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _month_digests(self, parquet):
+        """ Digest the ids of every month of a parquet file, and their char_count if known, without the texts """
+        columns = ['id', 'char_count'] if 'char_count' in parquet.schema_arrow.names else ['id']
+        digests = defaultdict(hashlib.sha256)
+
+        for batch in parquet.iter_batches(batch_size=BATCH_SIZE * 100, columns=columns):
+            for row in zip(*(batch.column(column).to_pylist() for column in columns)):
+                digests[id_month(row[0])].update(repr(row).encode('utf-8'))
+
+        return {month: digest.hexdigest() for month, digest in digests.items()}
+
+    def _drop(self, name, month):
+        """ Remove the papers of a month of a file """
+        self.db.execute('DELETE FROM papers WHERE rowid IN (SELECT doc FROM docs WHERE file = ? AND month = ?)', (name, month))
+        self.db.execute('DELETE FROM docs WHERE file = ? AND month = ?', (name, month))
+        self.db.execute('DELETE FROM months WHERE file = ? AND month = ?', (name, month))
+
+    def index_file(self, parquet_file):
+        """
+        Index the months of a parquet file that aren't indexed yet or changed since.
+
+        The ids are read first to find the months to index, then the texts are read in batches and only the rows of
+        those months are indexed. Every file is indexed in a single transaction.
+
+        Args:
+            parquet_file (str): A parquet file with 'id', 'title', 'abstract' and 'article' or 'fulltext' columns.
+
+        Returns:
+            list: The months that were indexed.
+        """
+        import pyarrow.parquet as pq
+
+        name = os.path.basename(parquet_file)
+        parquet = pq.ParquetFile(parquet_file)
+        body = text_column(parquet.schema_arrow.names)
+
+        digests = self._month_digests(parquet)
+        indexed = dict(self.db.execute('SELECT month, digest FROM months WHERE file = ?', (name,)))
+        pending = {month for month, digest in digests.items() if indexed.get(month) != digest}
+        removed = set(indexed) - set(digests)
+
+        if not pending and not removed:
+            log.info(f'{name} is already indexed')
+            return []
+
+        with self.db:
+            for month in pending | removed:
+                self._drop(name, month)
+
+            if pending:
+                for batch in parquet.iter_batches(batch_size=BATCH_SIZE, columns=['id', 'title', 'abstract', body]):
+                    for row in batch.to_pylist():
+                        month = id_month(row['id'])
+                        if month not in pending:
+                            continue
+                        doc = self.db.execute('INSERT INTO docs (id, file, month) VALUES (?, ?, ?)', (row['id'], name, month)).lastrowid
+                        self.db.execute('INSERT INTO papers (rowid, title, abstract, body) VALUES (?, ?, ?, ?)', (doc, row['title'], row['abstract'], row[body]))
+
+            self.db.executemany('INSERT INTO months VALUES (?, ?, ?)', [(name, month, digests[month]) for month in pending])
+
+        log.info(f'{name}: indexed {len(pending)} months')
+        return sorted(pending)
+
+    def search(self, query, limit=10):
+        """
+        Find the papers matching a query, best matches first.
+
+        Args:
+            query (str): An FTS5 query, e.g. 'dark matter', '"dark matter" NOT halo' or 'title:transformer'.
+            limit (int, optional): The largest number of results. Defaults to 10.
+
+        Returns:
+            list: Tuples of the id, the title and a snippet of the text around the matches.
+        """
+        return self.db.execute(f'''
+            SELECT docs.id, papers.title, snippet(papers, 2, '[', ']', '...', {SNIPPET_TOKENS})
+            FROM papers JOIN docs ON docs.doc = papers.rowid
+            WHERE papers MATCH ? ORDER BY rank LIMIT ?
+        ''', (query, limit)).fetchall()
+
+
+## Function to index a list of parquet files
+def index_files(index_file, parquet_files):
+    """
+    Index the months of parquet files that aren't indexed yet or changed since.
+
+    Args:
+        index_file (str): The SQLite file of the index.
+        parquet_files (list): The parquet files, e.g. the yearly files of a dataset.
+    """
+    with SearchIndex(index_file) as index:
+        for parquet_file in parquet_files:
+            index.index_file(parquet_file)
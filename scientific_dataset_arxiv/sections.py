@@ -0,0 +1,151 @@
+#####################################################################################################################
+
+## Structural index of the converted texts: the heading candidates of a document and their offsets in its txt file
+## The conversion reads the font size and weight of every line of a page from the same PyMuPDF text page as the
+## plain text, keeps the lines that look like headings (larger than the body text, or bold) and saves them with their
+## character and byte offsets in the json file next to the txt file, see `stats`. The article dataset then starts at
+## the real Introduction heading, read at its byte offset, instead of the first occurrence of the search term in the
+## text, which is often in the table of contents or the abstract. Section rules can change without converting again.
+## Like `stats`, the merge side of this module imports nothing heavy: fitz is only used through the pages it gets.
+
+import re
+from collections import Counter
+
+#####################################################################################################################
+
+HEADING_SIZE_RATIO = 1.15  # Lines this much larger than the body text are heading candidates
+MIN_HEADING_SIZE_RATIO = 0.95  # Bold lines smaller than this, e.g. in footnotes or captions, are not
+MAX_HEADING_CHARS = 100  # Longer lines are not heading candidates
+MAX_HEADINGS = 200  # Heading candidates saved per document, in order
+BOLD_FLAG = 16  # Bold bit of the span flags of PyMuPDF
+BOLD_FONT = re.compile(r'bold|black|heavy|medi|cmbx', re.IGNORECASE)  # Bold fonts not flagged as such, e.g. LaTeX's CMBX
+
+## Section numbers in front of a heading, e.g. '1', '1.2.', 'IV.' or 'A)'
+NUMBERING = re.compile(r'^(?:\d+(?:\.\d+)*[.:)]?\s*|(?:[IVXLC]+|[A-Z])(?:[.:)]\s*|\s+))')
+
+#####################################################################################################################
+
+## Function to get the lines of a page with their font
+def page_lines(page, textpage):
+    """
+    Get the lines of a page with their font size and weight.
+
+    Args:
+        page (fitz.Page): The page.
+        textpage (fitz.TextPage): The text page of `page` the plain text was extracted from, so the lines match it.
+
+    Returns:
+        list: Tuples of the text of the line, its largest font size and whether all its text is bold.
+    """
+    lines = []
+    for block in page.get_text('dict', textpage=textpage)['blocks']:
+        for line in block.get('lines', ()):
+            spans = [span for span in line['spans'] if span['text']]
+            if not spans:
+                continue
+            text = ''.join(span['text'] for span in spans)
+            size = max(span['size'] for span in spans)
+            bold = all(span['flags'] & BOLD_FLAG or BOLD_FONT.search(span['font']) or not span['text'].strip() for span in spans)
+            lines.append((text, size, bold))
+    return lines
+
+## Function to get the font size of the body text
+def body_font_size(lines):
+    """ The font size of most characters of a document, None if it has no text """
+    sizes = Counter()
+    for text, size, _ in lines:
+        sizes[round(size, 1)] += len(text)
+    return sizes.most_common(1)[0][0] if sizes else None
+
+## Function to find the heading candidates of a document
+def detect_headings(raw_pages, pages, lines, fix=None):
+    """
+    Find the heading candidates of a document and their offsets in its text.
+
+    Every line is located in the raw text of its page, in order, so a heading is never matched earlier than where
+    it is, e.g. in the table of contents or the abstract. Its offset is then carried over to the normalized text.
+
+    Args:
+        raw_pages (list): The text of every page, as extracted.
+        pages (list): The normalized text of every page, as saved in the txt file once joined.
+        lines (list): The lines of every page, see `page_lines`.
+        fix (callable, optional): The normalization of the text of the pages, e.g. `fixunicode.fix_unicode`.
+
+    Returns:
+        tuple: The heading candidates, as dicts with the 'text' of the line, its character 'offset' and
+            'byte_offset' in the text, its font size relative to the body text ('scale') and whether it is 'bold';
+            and the font size of the body text.
+    """
+    fix = fix or (lambda text: text)
+    body_size = body_font_size([line for page in lines for line in page])
+    if not body_size:
+        return [], None
+
+    headings = []
+    page_offset = 0
+    page_byte_offset = 0
+    for raw, text, page in zip(raw_pages, pages, lines):
+        position = 0
+        for line, size, bold in page:
+            index = raw.find(line, position)
+            if index < 0:
+                continue
+            position = index + len(line)
+
+            scale = size / body_size
+            if not (scale >= HEADING_SIZE_RATIO or (bold and scale >= MIN_HEADING_SIZE_RATIO)):
+                continue
+
+            heading = fix(line).strip()
+            if not heading or len(heading) > MAX_HEADING_CHARS or not any(c.isalpha() for c in heading):
+                continue
+
+            index = text.find(heading, len(fix(raw[:index])))
+            if index < 0:
+                continue
+
+            headings.append({
+                'text': heading,
+                'offset': page_offset + index,
+                'byte_offset': page_byte_offset + len(text[:index].encode('utf-8')),
+                'scale': round(scale, 2),
+                'bold': bool(bold),
+            })
+
+            if len(headings) == MAX_HEADINGS:
+                return headings, body_size
+
+        page_offset += len(text)
+        page_byte_offset += len(text.encode('utf-8'))
+
+    return headings, body_size
+
+## Function to normalize the title of a heading
+def heading_title(text):
+    """ The title of a heading without its section number, lowercased, e.g. 'introduction' for 'I. INTRODUCTION' """
+    return ' '.join(NUMBERING.sub('', text, count=1).split()).lower().rstrip('.:')
+
+## Function to find a section in the heading candidates
+def find_section(headings, term):
+    """
+    Find the first heading with a given title, e.g. the Introduction heading.
+
+    Args:
+        headings (list): The heading candidates saved by the conversion, see `detect_headings`.
+        term (str): The title to look for, case-insensitive.
+
+    Returns:
+        tuple: The character offset and the byte offset of the term in the text, and the term as written in the
+            text; None if no heading has this title.
+    """
+    term = term.lower()
+    for heading in headings or ():
+        if heading_title(heading['text']) != term:
+            continue
+
+        ## Start at the term, as the article dataset always did, rather than at the section number
+        index = heading['text'].lower().rfind(term)
+        prefix = heading['text'][:index]
+        return heading['offset'] + index, heading['byte_offset'] + len(prefix.encode('utf-8')), heading['text'][index:index + len(term)]
+
+    return None
@@ -0,0 +1,272 @@
+#####################################################################################################################
+
+## A small DAG runner with stage-level caching
+## Every stage is fingerprinted from its parameters and the outputs of the stages it depends on.
+## A stage is skipped when its fingerprint matches the one recorded at its last run and its outputs are unchanged,
+## so a config tweak only recomputes the stages it actually affects (and the ones downstream of them).
+
+import hashlib
+import json
+import os
+from time import time
+
+#####################################################################################################################
+
+class Stage:
+    """
+    A unit of work in the pipeline.
+
+    Args:
+        name (str): The unique name of the stage, e.g. 'convert/0704'.
+        run (callable): Called without arguments to (re)compute the outputs.
+        outputs (list): Files or folders written by the stage.
+        params (dict, optional): The configuration the outputs depend on. Must be JSON serializable.
+        deps (list, optional): The names of the stages this one depends on.
+        patterns (tuple, optional): File name suffixes taken into account when digesting output folders.
+            Defaults to every file.
+        clean (callable, optional): Called before the stage runs again with another fingerprint, with the set of
+            the names of the parameters and dependencies that changed since its last run, to remove the outputs the
+            change invalidates and that the stage would otherwise keep, e.g. with `clear_outputs`. Outputs that
+            are still valid should be kept, so that the stage only does the extra work. An interrupted or forced
+            run resumes from its outputs instead.
+    """
+    def __init__(self, name, run, outputs, params=None, deps=None, patterns=None, clean=None):
+        self.name = name
+        self.run = run
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.deps = list(deps or [])
+        self.patterns = tuple(patterns) if patterns else None
+        self.clean = clean
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+
+## Function to digest the outputs of a stage
+def digest_outputs(paths, patterns=None):
+    """
+    Digest files and folders by name, size and modification time, without reading them.
+
+    Args:
+        paths (list): Files or folders.
+        patterns (tuple, optional): File name suffixes to take into account in folders. Defaults to every file.
+
+    Returns:
+        str: The hex digest, or None if one of the paths doesn't exist.
+    """
+    sha = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            return None
+
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = []
+            for root, _, filenames in os.walk(path):
+                files.extend(os.path.join(root, fn) for fn in filenames if patterns is None or fn.endswith(patterns))
+            files.sort()
+
+        for fn in files:
+            stat = os.stat(fn)
+            sha.update(f'{os.path.relpath(fn, path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+
+    return sha.hexdigest()
+
+## Function to remove the outputs of a stage
+def clear_outputs(paths, patterns=None):
+    """
+    Remove output files, and the files of output folders whose name ends with one of the patterns.
+
+    Args:
+        paths (list): Files or folders.
+        patterns (tuple, optional): File name suffixes to remove in folders. Defaults to every file.
+
+    Returns:
+        int: The number of files removed.
+    """
+    removed = 0
+    for path in paths:
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = []
+            for root, _, filenames in os.walk(path):
+                files.extend(os.path.join(root, fn) for fn in filenames if patterns is None or fn.endswith(tuple(patterns)))
+
+        for fn in files:
+            os.remove(fn)
+            removed += 1
+
+    return removed
+
+## Function to find the inputs of a stage that changed since its last run
+def changed_inputs(record, params, upstream_digests):
+    """
+    Find the parameters and dependencies of a stage whose value differs from the ones recorded at its last run.
+
+    Args:
+        record (dict): The record of the last run, see `StageCache`.
+        params (dict): The configuration of the stage.
+        upstream_digests (dict): The output digest of every dependency, by stage name.
+
+    Returns:
+        set: The names of the changed parameters and dependencies, all of them for a record that predates them.
+    """
+    ## Compared as stored in the record, e.g. tuples come back as lists
+    params, upstream_digests = json.loads(json.dumps([params, upstream_digests], default=str))
+    if 'params' not in record or 'upstream' not in record:
+        return set(params) | set(upstream_digests)
+
+    changed = set()
+    for current, previous in ((params, record['params']), (upstream_digests, record['upstream'])):
+        changed.update(key for key in set(current) | set(previous) if current.get(key) != previous.get(key))
+
+    return changed
+
+## Function to fingerprint the inputs of a stage
+def fingerprint(params, upstream_digests):
+    """
+    Fingerprint the parameters of a stage and the digests of its upstream outputs.
+
+    Args:
+        params (dict): The configuration of the stage.
+        upstream_digests (dict): The output digest of every dependency, by stage name.
+
+    Returns:
+        str: The hex digest.
+    """
+    payload = json.dumps({'params': params, 'upstream': upstream_digests}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    """
+    The record of the last successful run of every stage, kept in a JSON file.
+
+    Args:
+        path (str): The path of the JSON file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.records = json.load(f)
+
+    def get(self, name):
+        return self.records.get(name)
+
+    def set(self, name, record):
+        self.records[name] = record
+        self.save()
+
+    def save(self):
+        ## Write atomically, an interrupted run must not lose the records of the previous stages
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.records, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+## Function to order the stages so that dependencies come first
+def topological_order(stages):
+    """
+    Order stages so that every stage comes after its dependencies, keeping the given order otherwise.
+
+    Args:
+        stages (list): The stages.
+
+    Returns:
+        list: The ordered stages.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    ordered = []
+    state = {}
+
+    def visit(stage):
+        if state.get(stage.name) == 'done':
+            return
+        if state.get(stage.name) == 'visiting':
+            raise ValueError(f'Dependency cycle through {stage.name}')
+
+        state[stage.name] = 'visiting'
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f'{stage.name} depends on unknown stage {dep}')
+            visit(by_name[dep])
+        state[stage.name] = 'done'
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+
+    return ordered
+
+
+## Function to run the stages that are out of date
+def run_stages(stages, cache, force=(), dry_run=False):
+    """
+    Run the stages whose inputs or outputs changed since their last run, in dependency order.
+
+    Args:
+        stages (list): The stages of the pipeline.
+        cache (StageCache): The record of previous runs.
+        force (iterable, optional): Name prefixes of stages to run even if they are up to date, e.g. ['merge/'].
+        dry_run (bool, optional): Only report which stages would run. Defaults to False.
+
+    Returns:
+        list: The names of the stages that ran (or would run).
+    """
+    force = tuple(force)
+    digests = {}
+    ran = []
+
+    for stage in topological_order(stages):
+        upstream = {dep: digests[dep] for dep in stage.deps}
+        current = fingerprint(stage.params, upstream)
+
+        record = cache.get(stage.name)
+        output_digest = digest_outputs(stage.outputs, stage.patterns)
+
+        forced = bool(force) and stage.name.startswith(force)
+        up_to_date = (
+            not forced
+            and record is not None
+            and record['fingerprint'] == current
+            and output_digest is not None
+            and record['outputs'] == output_digest
+        )
+
+        if up_to_date:
+            print(f'{stage.name} is up to date, skipping.')
+            digests[stage.name] = output_digest
+            continue
+
+        ran.append(stage.name)
+
+        if dry_run:
+            print(f'{stage.name} would run.')
+            ## Downstream stages would see new outputs
+            digests[stage.name] = None
+            continue
+
+        ## The outputs invalidated by the change would be kept and skipped by the stage, e.g. the PDFs rejected for
+        ## another search term
+        if stage.clean is not None and record is not None and record['fingerprint'] != current:
+            changed = changed_inputs(record, stage.params, upstream)
+            print(f"Changed inputs of {stage.name}: {', '.join(sorted(changed))}.")
+            stage.clean(changed)
+
+        print(f'Running {stage.name}.')
+        tic = time()
+        stage.run()
+        elapsed = time() - tic
+
+        digests[stage.name] = digest_outputs(stage.outputs, stage.patterns)
+        cache.set(stage.name, {'fingerprint': current, 'outputs': digests[stage.name], 'seconds': round(elapsed, 2),
+                               'params': stage.params, 'upstream': upstream})
+        print(f'Finished {stage.name} in {elapsed:.2f} seconds.')
+
+    return ran
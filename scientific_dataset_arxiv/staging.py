@@ -0,0 +1,196 @@
+#####################################################################################################################
+
+## Bounded staging area for the PDFs of a month, so the downloads and the conversion overlap on a small disk
+## The downloader reserves the size of every PDF (known from the bucket listing) before fetching it, and waits while
+## the staged PDFs reach the byte budget or the disk runs low. Downloaded PDFs are taken for conversion in batches as
+## they arrive, and every PDF is deleted and released as soon as it is converted or rejected. PDFs that failed are
+## held for the fallback lane: their bytes stay on disk but nothing waits for them, so they can't block the downloads.
+## The area is shared by the download thread and the conversion, every method is thread-safe.
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+from collections import deque
+
+#####################################################################################################################
+
+POLL_INTERVAL = 0.5  # Seconds between two checks of the budget, for the waiting downloads
+
+log = logging.getLogger(__name__)
+
+#####################################################################################################################
+
+class StagingArea:
+    """
+    Account for the bytes of the PDFs staged on disk, within a budget.
+
+    Every staged PDF is either reserved (being downloaded), ready (waiting for the conversion), taken (being
+    converted) or held (kept on disk for the fallback lane), until it is removed or discarded.
+
+    Args:
+        path (str): The folder the PDFs are staged in, whose disk is checked for free space.
+        budget (int): The largest number of bytes of staged PDFs.
+        min_free (int, optional): The free bytes to leave on the disk. Defaults to 0.
+    """
+    def __init__(self, path, budget, min_free=0):
+        self.path = path
+        self.budget = budget
+        self.min_free = min_free
+
+        self.sizes = {}  # Bytes of every staged PDF
+        self.incoming = set()  # PDFs reserved and not downloaded yet
+        self.held = set()  # PDFs kept on disk with nothing to release them soon
+        self.ready = deque()  # PDFs waiting for the conversion, in order
+        self.closed = False
+        self.aborted = False
+
+        self.used = 0
+        self.peak = 0  # High-water mark of the staged bytes
+        self.lowest_free = None  # Lowest free space seen on the disk
+        self._condition = threading.Condition()
+
+    def _free(self):
+        """ Free bytes of the disk, not counting the PDFs that are still being downloaded """
+        free = shutil.disk_usage(self.path).free - sum(self.sizes[path] for path in self.incoming)
+        self.lowest_free = free if self.lowest_free is None else min(self.lowest_free, free)
+        return free
+
+    def _account(self, path, nbytes):
+        self.sizes[path] = nbytes
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def _release(self, path):
+        self.used -= self.sizes.pop(path, 0)
+        self.incoming.discard(path)
+        self.held.discard(path)
+        self._condition.notify_all()
+
+    def try_reserve(self, path, nbytes):
+        """
+        Reserve the bytes of a PDF about to be downloaded, if they fit.
+
+        They always fit when every staged PDF is held (or there is none), since nothing would make room otherwise:
+        the budget can then be exceeded, which shows in the high-water mark.
+
+        Args:
+            path (str): The local path of the PDF.
+            nbytes (int): The size of the PDF.
+
+        Returns:
+            bool: Whether the bytes were reserved.
+
+        Raises:
+            RuntimeError: If the area was aborted, nothing would make room anymore.
+        """
+        with self._condition:
+            if self.aborted:
+                raise RuntimeError('The staging area of {} was aborted'.format(self.path))
+
+            releasable = self.used - sum(self.sizes[held] for held in self.held)
+            if releasable > 0 and (self.used + nbytes > self.budget or self._free() - nbytes < self.min_free):
+                return False
+
+            self._account(path, nbytes)
+            self.incoming.add(path)
+            return True
+
+    def add(self, path):
+        """
+        Mark a PDF on disk as ready for the conversion, e.g. once downloaded or left over by an interrupted run.
+
+        PDFs that weren't reserved are accounted with their size on disk. Adding a PDF twice does nothing.
+        """
+        with self._condition:
+            if path in self.incoming:
+                self.incoming.discard(path)
+            elif path in self.sizes:
+                return
+            else:
+                self._account(path, os.path.getsize(path))
+
+            self.ready.append(path)
+            self._condition.notify_all()
+
+    def hold(self, path):
+        """ Keep a PDF on disk, e.g. for the fallback lane, without the downloads waiting for its bytes """
+        with self._condition:
+            if path not in self.sizes:
+                self._account(path, os.path.getsize(path))
+            self.held.add(path)
+            self._condition.notify_all()
+
+    def held_files(self):
+        """ The PDFs held on disk, sorted """
+        with self._condition:
+            return sorted(self.held)
+
+    def discard(self, path):
+        """ Release the bytes of a PDF without deleting it, e.g. after its download failed """
+        with self._condition:
+            self._release(path)
+
+    def remove(self, path):
+        """ Delete a PDF, once converted or rejected, and release its bytes """
+        try:
+            os.remove(path)
+        except OSError as e:
+            log.error('Error deleting PDF: {} - {}'.format(path, e))
+
+        with self._condition:
+            self._release(path)
+
+    def close(self):
+        """ No more PDFs will be added, the conversion stops once the ready ones are taken """
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def abort(self):
+        """ Stop the conversion, the downloads waiting for room fail instead of waiting forever """
+        with self._condition:
+            self.closed = True
+            self.aborted = True
+            self._condition.notify_all()
+
+    def take(self, max_files, max_bytes=None, timeout=None):
+        """
+        Take a batch of the PDFs ready for the conversion, waiting for one if there is none.
+
+        Args:
+            max_files (int): The largest number of PDFs in the batch.
+            max_bytes (int, optional): The largest number of bytes in the batch, a larger PDF making its own batch.
+            timeout (float, optional): Seconds to wait for a PDF, None to wait until there is one or the area is closed.
+
+        Returns:
+            list: The PDFs of the batch, empty if none was ready in time, or None once the area is closed and empty.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.ready or self.closed, timeout=timeout)
+
+            if not self.ready:
+                return None if self.closed else []
+
+            batch = []
+            batch_bytes = 0
+            while self.ready and len(batch) < max_files:
+                size = self.sizes[self.ready[0]]
+                if batch and max_bytes is not None and batch_bytes + size > max_bytes:
+                    break
+                batch.append(self.ready.popleft())
+                batch_bytes += size
+            return batch
+
+    async def reserve(self, path, nbytes):
+        """ Wait until the bytes of a PDF about to be downloaded fit, then reserve them, see `try_reserve` """
+        while not self.try_reserve(path, nbytes):
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def report(self):
+        """ A line on the high-water marks of the staging area """
+        line = 'Staged at most {:.0f} MB of PDFs for a budget of {:.0f} MB'.format(self.peak / 2**20, self.budget / 2**20)
+        if self.lowest_free is not None:
+            line += ', lowest free disk space {:.0f} MB'.format(self.lowest_free / 2**20)
+        return line
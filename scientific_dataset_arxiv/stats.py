@@ -0,0 +1,85 @@
+#####################################################################################################################
+
+## Cheap per-document statistics stored as columns of the datasets, to filter them without reading the texts
+## The conversion saves the statistics of the whole text, with the page count, to a json file next to the txt file.
+## The merge workers add the statistics of the text that goes into the dataset, which for the article dataset is
+## only the part after the search term. Like the merge workers, this module imports nothing heavy.
+
+import json
+import os
+
+#####################################################################################################################
+
+## The statistics columns of the datasets, in order
+STATS_COLUMNS = ['char_count', 'word_count', 'average_word_length', 'non_ascii_ratio', 'page_count', 'search_term_offset']
+
+#####################################################################################################################
+
+## Function to compute the statistics of a text
+def text_stats(text):
+    """
+    Compute the statistics of a text.
+
+    The average word length is computed as in the quality checks of the conversion, so it can be compared with
+    their threshold.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        dict: The char_count, word_count, average_word_length and non_ascii_ratio of the text.
+    """
+    char_count = len(text)
+    word_count = len(text.split())
+
+    ## Encoding to ASCII drops the other characters, without a loop in Python
+    non_ascii = char_count - len(text.encode('ascii', 'ignore'))
+
+    return {
+        'char_count': char_count,
+        'word_count': word_count,
+        'average_word_length': char_count / (word_count + 1),
+        'non_ascii_ratio': non_ascii / char_count if char_count else 0.0,
+    }
+
+## Function to get the path of the statistics of a txt file
+def stats_path(txtfile):
+    """
+    Get the path of the json file holding the statistics of a txt file.
+
+    Args:
+        txtfile (str): The path of the txt file (or of its pdf).
+
+    Returns:
+        str: The path of the json file.
+    """
+    return os.path.splitext(txtfile)[0] + '.json'
+
+## Function to save the statistics of a txt file
+def write_stats(txtfile, stats):
+    """
+    Save the statistics of a txt file next to it.
+
+    Args:
+        txtfile (str): The path of the txt file.
+        stats (dict): The statistics.
+    """
+    with open(stats_path(txtfile), 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+
+## Function to load the statistics of a txt file
+def read_stats(txtfile):
+    """
+    Load the statistics saved next to a txt file.
+
+    Args:
+        txtfile (str): The path of the txt file.
+
+    Returns:
+        dict: The statistics, empty if the file was converted before they were saved or they can't be read.
+    """
+    try:
+        with open(stats_path(txtfile), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,147 @@
+#####################################################################################################################
+
+## Helpers to read the converted txt files in the merge workers
+## The files are memory-mapped and searched as bytes, so only the part that goes into the dataset is decoded.
+## Files packed into the compressed store of their month are decompressed instead, see `textstore`.
+
+import mmap
+import os
+import re
+from contextlib import contextmanager
+
+#####################################################################################################################
+
+NON_WHITESPACE = re.compile(rb'\S')
+
+#####################################################################################################################
+
+## Function to decode a part of a memory map without copying the bytes first
+def decode_from(mm, start=0, end=None):
+    """
+    Decode a memory-mapped utf-8 file from a byte offset to another one.
+
+    Args:
+        mm (mmap.mmap or bytes): The memory-mapped file, or its bytes.
+        start (int, optional): The byte offset to start decoding from. Defaults to 0.
+        end (int, optional): The byte offset to stop decoding at. Defaults to the end of the file.
+
+    Returns:
+        str: The decoded text.
+    """
+    with memoryview(mm) as view:
+        with view[start:end] as selection:
+            return str(selection, 'utf-8')
+
+## Function to get the bytes of a txt file
+@contextmanager
+def open_text_bytes(file_path):
+    """
+    Give access to the bytes of a txt file: memory-mapped, or decompressed if the file was packed into a store.
+
+    Args:
+        file_path (str): The path of the utf-8 encoded file.
+
+    Yields:
+        mmap.mmap or bytes: The bytes of the file, None if it is empty.
+    """
+    if not os.path.exists(file_path):
+        ## Imported here, only the packed months need zstandard
+        from .textstore import read_packed
+        yield read_packed(file_path) or None
+        return
+
+    ## Empty files can't be memory-mapped
+    if os.path.getsize(file_path) == 0:
+        yield None
+        return
+
+    with open(file_path, 'rb') as rf, mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
+
+## Function to extract the text after a term from a file, with the position of the term
+def read_text_after_term_with_offset(file_path, term):
+    """
+    Read the text of a file starting at the first occurrence of a term, and find the character offset of the term.
+
+    The term is searched in the memory-mapped bytes, case-insensitively for ASCII letters,
+    and only the text after it is decoded. The text before it is decoded as well to count its characters, which is
+    cheap as long as the term comes early in the file.
+
+    Args:
+        file_path (str): The path of the utf-8 encoded file.
+        term (str): The term to search for.
+
+    Returns:
+        tuple: The character offset of the term and the text starting with it, or None if the term is not found.
+    """
+    pattern = re.compile(re.escape(term.encode('utf-8')), re.IGNORECASE)
+
+    with open_text_bytes(file_path) as mm:
+        ## Empty files hold no term
+        if mm is None:
+            return None
+
+        match = pattern.search(mm)
+
+        if match is None:
+            return None
+
+        return len(decode_from(mm, 0, match.start())), decode_from(mm, match.start())
+
+## Function to extract the text of a file from a known position
+def read_text_at(file_path, byte_offset, prefix):
+    """
+    Read the text of a file starting at a byte offset, e.g. the offset of a heading saved by the conversion.
+
+    Only the text after the offset is decoded, nothing is searched.
+
+    Args:
+        file_path (str): The path of the utf-8 encoded file.
+        byte_offset (int): The byte offset to start reading from.
+        prefix (str): The text expected at the offset, to detect offsets that don't match the file anymore.
+
+    Returns:
+        str: The text starting at the offset, or None if it doesn't start with `prefix`.
+    """
+    expected = prefix.encode('utf-8')
+
+    with open_text_bytes(file_path) as mm:
+        if mm is None or mm[byte_offset:byte_offset + len(expected)] != expected:
+            return None
+
+        return decode_from(mm, byte_offset)
+
+## Function to extract the text after a term from a file
+def read_text_after_term(file_path, term):
+    """
+    Read the text of a file starting at the first occurrence of a term.
+
+    Args:
+        file_path (str): The path of the utf-8 encoded file.
+        term (str): The term to search for.
+
+    Returns:
+        str: The text starting with the term, or None if the term is not found.
+    """
+    found = read_text_after_term_with_offset(file_path, term)
+    return None if found is None else found[1]
+
+## Function to read a file unless it is empty
+def read_nonempty_text(file_path):
+    """
+    Read the text of a file, unless it is empty or holds only whitespace.
+
+    Emptiness is tested with the file size first, then by scanning the bytes up to the first non-whitespace one,
+    so the text is only decoded when it is kept.
+
+    Args:
+        file_path (str): The path of the utf-8 encoded file.
+
+    Returns:
+        str: The text of the file, or None if it is empty.
+    """
+    with open_text_bytes(file_path) as mm:
+        if mm is None or NON_WHITESPACE.search(mm) is None:
+            return None
+
+        return decode_from(mm)
@@ -0,0 +1,219 @@
+#####################################################################################################################
+
+## Compressed store of the txt files of a month
+## The txt files of a month folder are packed into `texts.sqlite` in that folder: every text is compressed on its own
+## with zstd, using a dictionary trained on texts of the month, so that a single text can be read by its path without
+## decompressing the others. The packed txt files are removed; their paths keep working with `textio`, which falls
+## back to the store for txt files that aren't on disk anymore.
+
+import os
+import sqlite3
+from functools import lru_cache
+
+import zstandard
+
+#####################################################################################################################
+
+STORE_NAME = 'texts.sqlite'  # Name of the store in a month folder
+LEVEL = 10  # zstd compression level
+DICT_SIZE = 112640  # Bytes of the trained dictionary, zstd's default
+DICT_SAMPLES = 2000  # Texts sampled to train the dictionary
+DICT_SAMPLE_BYTES = 32 * 2**10  # Bytes of every text used to train the dictionary
+MIN_DICT_SAMPLES = 64  # Below this number of texts, they are compressed without a dictionary
+
+#####################################################################################################################
+
+## Function to get the path of the store of a folder
+def store_path(folder):
+    """ The path of the store of a month folder """
+    return os.path.join(folder, STORE_NAME)
+
+## Function to train a dictionary on the texts of a folder
+def train_dictionary(files):
+    """
+    Train a zstd dictionary on a sample of the files.
+
+    Args:
+        files (list): The paths of the txt files, sampled evenly.
+
+    Returns:
+        bytes: The dictionary, or None if there are too few files to train one.
+    """
+    if len(files) < MIN_DICT_SAMPLES:
+        return None
+
+    step = max(1, len(files) // DICT_SAMPLES)
+    samples = []
+    for fn in files[::step][:DICT_SAMPLES]:
+        with open(fn, 'rb') as f:
+            samples.append(f.read(DICT_SAMPLE_BYTES))
+
+    return zstandard.train_dictionary(DICT_SIZE, samples).as_bytes()
+
+
+class TextStore:
+    """
+    The compressed texts of a month folder, by path relative to the folder.
+
+    Args:
+        folder (str): The month folder.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.db = sqlite3.connect(store_path(folder))
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value BLOB);
+            CREATE TABLE IF NOT EXISTS texts (name TEXT PRIMARY KEY, size INTEGER, data BLOB);
+        ''')
+
+        row = self.db.execute("SELECT value FROM settings WHERE name = 'dictionary'").fetchone()
+        self.dictionary = zstandard.ZstdCompressionDict(row[0]) if row is not None else None
+        self.decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary) if self.dictionary else zstandard.ZstdDecompressor()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def names(self):
+        """ The paths of the texts, relative to the folder """
+        return [row[0] for row in self.db.execute('SELECT name FROM texts ORDER BY name')]
+
+    def read_bytes(self, name):
+        """
+        Decompress a text.
+
+        Args:
+            name (str): The path of the text, relative to the folder.
+
+        Returns:
+            bytes: The utf-8 encoded text.
+
+        Raises:
+            KeyError: If the text isn't in the store.
+        """
+        row = self.db.execute('SELECT data FROM texts WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return self.decompressor.decompress(row[0])
+
+    def add_files(self, files, level=LEVEL):
+        """
+        Compress txt files into the store, replacing the texts of the same paths.
+
+        The dictionary is trained on these files when the store doesn't have one yet.
+
+        Args:
+            files (list): The paths of the txt files, inside the folder.
+            level (int, optional): The zstd compression level.
+        """
+        with self.db:
+            if self.dictionary is None and not self.db.execute('SELECT 1 FROM texts LIMIT 1').fetchone():
+                dictionary = train_dictionary(files)
+                if dictionary is not None:
+                    self.db.execute("INSERT INTO settings VALUES ('dictionary', ?)", (dictionary,))
+                    self.dictionary = zstandard.ZstdCompressionDict(dictionary)
+                    self.decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+
+            compressor = zstandard.ZstdCompressor(level=level, dict_data=self.dictionary) if self.dictionary else zstandard.ZstdCompressor(level=level)
+
+            for fn in files:
+                with open(fn, 'rb') as f:
+                    data = f.read()
+                name = os.path.relpath(fn, self.folder).replace(os.sep, '/')
+                self.db.execute('INSERT OR REPLACE INTO texts VALUES (?, ?, ?)', (name, len(data), compressor.compress(data)))
+
+
+## Function to pack the txt files of a month
+def pack_folder(folder, level=LEVEL):
+    """
+    Compress the txt files of a month folder into its store, and remove them once they are safely stored.
+
+    Args:
+        folder (str): The month folder.
+        level (int, optional): The zstd compression level.
+
+    Returns:
+        int: The number of files packed.
+    """
+    files = []
+    for root, _, filenames in os.walk(folder):
+        files.extend(os.path.join(root, fn) for fn in filenames if fn.endswith('.txt'))
+    files.sort()
+
+    if not files:
+        return 0
+
+    with TextStore(folder) as store:
+        store.add_files(files, level)
+
+    for fn in files:
+        os.remove(fn)
+    return len(files)
+
+## Function to list the txt files of a month, on disk or packed
+def list_texts(folder):
+    """
+    List the paths of the txt files of a month folder, including the ones packed in its store.
+
+    Args:
+        folder (str): The month folder.
+
+    Returns:
+        list: The sorted paths, packed texts have the path they had on disk.
+    """
+    paths = set()
+    for root, _, filenames in os.walk(folder):
+        paths.update(os.path.join(root, fn) for fn in filenames if fn.endswith('.txt'))
+
+    if os.path.exists(store_path(folder)):
+        with TextStore(folder) as store:
+            paths.update(os.path.join(folder, *name.split('/')) for name in store.names())
+
+    return sorted(paths)
+
+## Function to find the store holding a path, cached per directory
+@lru_cache(maxsize=64)
+def _find_store_folder(directory):
+    """ The nearest folder above `directory` (included) with a store, None if there is none """
+    while True:
+        if os.path.exists(store_path(directory)):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+## Function to open the store of a folder once per process
+@lru_cache(maxsize=8)
+def _open_store(folder):
+    return TextStore(folder)
+
+## Function to read a packed txt file
+def read_packed(file_path):
+    """
+    Read a txt file that was packed into the store of its month.
+
+    The store is opened once per process and kept open, e.g. in the merge workers.
+
+    Args:
+        file_path (str): The path the txt file had on disk.
+
+    Returns:
+        bytes: The utf-8 encoded text.
+
+    Raises:
+        FileNotFoundError: If the file is neither on disk nor in a store.
+    """
+    folder = _find_store_folder(os.path.dirname(os.path.abspath(file_path)))
+    if folder is None:
+        raise FileNotFoundError(file_path)
+
+    try:
+        return _open_store(folder).read_bytes(os.path.relpath(os.path.abspath(file_path), folder).replace(os.sep, '/'))
+    except KeyError:
+        raise FileNotFoundError(file_path) from None
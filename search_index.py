@@ -0,0 +1,53 @@
+## This script searches the papers of a dataset for a topic, through a full-text index of their title, abstract and
+## text, to spot-check the dataset without loading it.
+##
+## Usage:
+##   python search_index.py "dark matter"                  # the 10 best matches in the articles dataset
+##   python search_index.py '"neural network" NOT graph'   # FTS5 query syntax, see https://sqlite.org/fts5.html
+##   python search_index.py --build "dark matter"          # index the years that changed first
+##   python search_index.py --dataset raw --limit 50 "title:quantum"
+#####################################################################################################################
+## Importing the required libraries
+import os
+import argparse
+from glob import glob
+from time import time
+from scientific_dataset_arxiv.config import start_year, end_year
+from scientific_dataset_arxiv.search import SearchIndex, index_files
+
+#####################################################################################################################
+## Main code
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Search the papers of a dataset.')
+    parser.add_argument('query', help='The FTS5 query.')
+    parser.add_argument('--dataset', choices=['articles', 'raw'], default='articles', help='Which dataset to search.')
+    parser.add_argument('--dataset-path', help='The folder of the yearly parquet files. Defaults to the one of the merge script.')
+    parser.add_argument('--limit', type=int, default=10, help='The largest number of results.')
+    parser.add_argument('--build', action='store_true', help='Index the yearly parquet files that changed before searching.')
+    args = parser.parse_args()
+
+    dataset_prefix = 'arxiv_dataset' if args.dataset == 'articles' else 'arxiv_raw_dataset'
+    dataset_path = args.dataset_path or f'{dataset_prefix}_{start_year}_to_{end_year}'
+    index_file = os.path.join(dataset_path, 'search_index.sqlite')
+
+    if args.build:
+        tic = time()
+        index_files(index_file, sorted(glob(os.path.join(dataset_path, f'{dataset_prefix}_20*.parquet'))))
+        print(f"Indexed in {time() - tic:.2f} seconds")
+
+    if not os.path.exists(index_file):
+        raise SystemExit(f"No index in {dataset_path}, run with --build or set search_index = True in the config")
+
+    ## Track time
+    tic = time()
+
+    with SearchIndex(index_file) as index:
+        results = index.search(args.query, args.limit)
+
+    for id_, title, snippet in results:
+        print(f"{id_}  {title}")
+        print(f"    {' '.join(snippet.split())}")
+
+    print(f"{len(results)} results in {(time() - tic) * 1000:.1f} ms")
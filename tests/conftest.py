@@ -0,0 +1,25 @@
+## The package and the scripts are imported from the root of the repo, as when running the scripts
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """ Write a PDF of a few pages of plain text to tmp_path, returns its path """
+    def make_pdf(name, pages=2, text='1 Introduction\nThe body of the paper, with enough words to pass the checks.'):
+        import fitz
+
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        doc = fitz.open()
+        for _ in range(pages):
+            doc.new_page().insert_text((72, 72), text, fontsize=11)
+        doc.save(str(path))
+        doc.close()
+        return str(path)
+
+    return make_pdf
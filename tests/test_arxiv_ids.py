@@ -0,0 +1,43 @@
+## Tests of the arxiv ids of the bucket file names, new and old style
+
+import pytest
+
+from scientific_dataset_arxiv.arxiv_ids import id_month, select_versions, split_id_version
+from scientific_dataset_arxiv.sampling import select_sample
+
+#####################################################################################################################
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('arxiv/arxiv/pdf/0704/0704.0001v2.pdf', ('0704.0001', 2)),
+    ('1501.00001v1.txt', ('1501.00001', 1)),
+    ('arxiv/arxiv/pdf/0701/math0701001v1.pdf', ('math/0701001', 1)),
+    ('solv-int9901001v3.txt', ('solv-int/9901001', 3)),
+    ('math.GT0309136v2.pdf', ('math/0309136', 2)),
+    ('hep-th0701001.pdf', ('hep-th/0701001', None)),
+    ('0704.0001.pdf', ('0704.0001', None)),
+    ('notes.txt', ('notes', None)),
+])
+def test_split_id_version(path, expected):
+    assert split_id_version(path) == expected
+
+
+def test_select_versions_of_old_style_ids():
+    paths = ['0701/math0701001v1.pdf', '0701/math0701001v3.pdf', '0701/hep-th0701001v1.pdf', '0701/math0701001v2.pdf']
+
+    assert select_versions(paths, 'latest') == ['0701/math0701001v3.pdf', '0701/hep-th0701001v1.pdf']
+    assert select_versions(paths, 'first') == ['0701/math0701001v1.pdf', '0701/hep-th0701001v1.pdf']
+
+
+def test_id_month():
+    assert id_month('0704.0001') == '0704'
+    assert id_month('math/0701001') == '0701'
+    assert id_month('unknown') == 'other'
+
+
+def test_old_style_ids_are_sampled_by_month():
+    ids = [f'math/07{month:02d}{i:03d}' for month in (1, 2) for i in range(100)]
+    sample = select_sample(ids, fraction=0.1, seed=0)
+
+    assert len(sample) == 20
+    assert {id_month(arxiv_id) for arxiv_id in sample} == {'0701', '0702'}
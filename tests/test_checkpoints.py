@@ -0,0 +1,93 @@
+## Tests of the monthly part files of the merge scripts: a crashed year resumes from its parts
+
+import os
+
+import pandas as pd
+import pytest
+
+from merge_metadata_unprocessed_by_year import join_fulltexts
+from scientific_dataset_arxiv import merge
+from scientific_dataset_arxiv.checkpoints import compact_parts, part_file, parts_folder, write_part
+from scientific_dataset_arxiv.merge_workers import process_fulltext
+
+#####################################################################################################################
+
+METADATA = pd.DataFrame({
+    'id': ['0701.0001', '0701.0002', '0702.0001'],
+    'title': ['first', 'second', 'third'],
+})
+
+
+@pytest.fixture
+def txt_folder(tmp_path, monkeypatch):
+    """ The txt files of two months, with the metadata of the year loaded from memory instead of the Hub """
+    monkeypatch.setattr(merge, 'load_metadata', lambda yy: METADATA)
+
+    folder = tmp_path / 'unprocessed_txts'
+    for name in ('0701/0701.0001v1.txt', '0701/0701.0002v2.txt', '0702/0702.0001v1.txt'):
+        (folder / name).parent.mkdir(parents=True, exist_ok=True)
+        (folder / name).write_text(f'text of {name}')
+    return str(folder)
+
+
+def merge_year(txt_folder, dataset_file, **kwargs):
+    return merge.merge_year('07', txt_folder, dataset_file, process_fulltext, join_fulltexts, **kwargs)
+
+
+def test_merge_year(tmp_path, txt_folder):
+    dataset_file = str(tmp_path / 'arxiv_raw_dataset_2007.parquet')
+
+    assert merge_year(txt_folder, dataset_file) == 3
+
+    df = pd.read_parquet(dataset_file)
+    assert sorted(df['id']) == ['0701.0001', '0701.0002', '0702.0001']
+    assert set(df['fulltext']) == {'text of 0701/0701.0001v1.txt', 'text of 0701/0701.0002v2.txt', 'text of 0702/0702.0001v1.txt'}
+    assert not os.path.exists(parts_folder(dataset_file))
+
+
+def test_crashed_year_resumes_from_its_parts(tmp_path, txt_folder):
+    dataset_file = str(tmp_path / 'arxiv_raw_dataset_2007.parquet')
+
+    ## The run that crashed saved 0701, which isn't merged again
+    write_part(join_fulltexts(METADATA, [{'id': '0701.0001', 'fulltext': 'saved before the crash'}]), dataset_file, '0701')
+
+    assert merge_year(txt_folder, dataset_file) == 2
+    df = pd.read_parquet(dataset_file)
+    assert list(df['fulltext']) == ['saved before the crash', 'text of 0702/0702.0001v1.txt']
+
+
+def test_kept_parts_only_merge_the_removed_months(tmp_path, txt_folder):
+    dataset_file = str(tmp_path / 'arxiv_raw_dataset_2007.parquet')
+    merge_year(txt_folder, dataset_file, keep_parts=True)
+    assert os.path.exists(part_file(dataset_file, '0701')) and os.path.exists(part_file(dataset_file, '0702'))
+
+    ## Both months changed, only the part of 0702 is removed
+    for name in ('0701/0701.0001v1.txt', '0702/0702.0001v1.txt'):
+        with open(os.path.join(txt_folder, name), 'w') as f:
+            f.write('new text')
+    os.remove(part_file(dataset_file, '0702'))
+
+    assert merge_year(txt_folder, dataset_file, keep_parts=True) == 3
+    df = pd.read_parquet(dataset_file).set_index('id')
+    assert df.loc['0701.0001', 'fulltext'] == 'text of 0701/0701.0001v1.txt'
+    assert df.loc['0702.0001', 'fulltext'] == 'new text'
+
+
+def test_parts_are_cast_to_a_common_schema(tmp_path):
+    dataset_file = str(tmp_path / 'arxiv_dataset_2007.parquet')
+    write_part(pd.DataFrame({'id': ['0701.0001'], 'page_count': [None]}), dataset_file, '0701')
+    write_part(pd.DataFrame({'id': pd.Series([], dtype=str), 'page_count': pd.Series([], dtype='Int64')}), dataset_file, '0702')
+    write_part(pd.DataFrame({'id': ['0703.0001'], 'page_count': [12]}), dataset_file, '0703')
+
+    assert compact_parts(dataset_file) == 2
+    df = pd.read_parquet(dataset_file)
+    assert list(df['id']) == ['0701.0001', '0703.0001']
+    assert pd.isna(df['page_count'][0]) and df['page_count'][1] == 12
+
+
+def test_year_without_rows_has_no_file(tmp_path):
+    dataset_file = str(tmp_path / 'arxiv_dataset_2007.parquet')
+    write_part(pd.DataFrame({'id': pd.Series([], dtype=str)}), dataset_file, '0701')
+
+    assert compact_parts(dataset_file) is None
+    assert not os.path.exists(dataset_file)
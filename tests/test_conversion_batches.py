@@ -0,0 +1,89 @@
+## Tests of the conversion in batches: per-file time limits, lost batches and the watchdog of the workers stuck in MuPDF
+
+import os
+import signal
+from time import sleep, time
+
+import pytest
+
+from scientific_dataset_arxiv import fulltext
+from scientific_dataset_arxiv.fulltext import iter_convert_results, make_batches
+
+#####################################################################################################################
+
+## The workers are forked, so that they see the extraction patched by the tests
+START_METHOD = 'fork'
+
+
+def misbehaving_extraction(behaviours):
+    """ The regular extraction, except for the files named in `behaviours`, which hang, sleep or crash their worker """
+    extract = fulltext.extract_fulltext
+
+    def extract_fulltext(pdffile, search_term=None, heading_term=None):
+        behaviour = behaviours.get(os.path.basename(pdffile))
+        if behaviour == 'hang':
+            ## Stuck in C code: SIGALRM is never handled
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+            sleep(60)
+        elif behaviour == 'slow':
+            sleep(60)
+        elif behaviour == 'crash':
+            os._exit(1)
+        return extract(pdffile, search_term, heading_term)
+
+    return extract_fulltext
+
+
+@pytest.fixture
+def short_limits(monkeypatch):
+    monkeypatch.setattr(fulltext, 'TIMEOUT', 1)
+    monkeypatch.setattr(fulltext, 'WATCHDOG_MARGIN', 1)
+    monkeypatch.setattr(fulltext, 'GOVERNOR_INTERVAL', 0.2)
+
+
+def convert(pdffiles, **kwargs):
+    return dict(iter_convert_results(pdffiles, processes=2, batch_files=4, start_method=START_METHOD, **kwargs))
+
+
+def test_make_batches(tmp_path):
+    sizes = [10, 10, 50, 10, 10, 10]
+    files = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f'{i}.pdf'
+        path.write_bytes(b'x' * size)
+        files.append(str(path))
+
+    batches = make_batches(files, max_files=3, max_bytes=40)
+    assert [[os.path.basename(fn) for fn in batch] for batch in batches] == [['0.pdf', '1.pdf'], ['2.pdf'], ['3.pdf', '4.pdf', '5.pdf']]
+    assert make_batches(files, max_files=4, max_bytes=None) == [files[:4], files[4:]]
+
+
+def test_batches_are_converted(make_pdf):
+    pdffiles = [make_pdf(f'0701.{i:04d}v1.pdf') for i in range(6)]
+
+    results = convert(pdffiles)
+    assert results == {pdffile: fulltext.reextension(pdffile, 'txt') for pdffile in pdffiles}
+    assert all(os.path.exists(txtfile) for txtfile in results.values())
+
+
+def test_slow_file_times_out_alone(make_pdf, monkeypatch, short_limits):
+    pdffiles = [make_pdf(f'0701.{i:04d}v1.pdf') for i in range(4)]
+    monkeypatch.setattr(fulltext, 'extract_fulltext', misbehaving_extraction({'0701.0001v1.pdf': 'slow'}))
+
+    results = convert(pdffiles)
+    assert results.pop(pdffiles[1]) is None
+    assert all(results.values())
+
+
+@pytest.mark.parametrize('behaviour', ['hang', 'crash'])
+def test_lost_batch_only_fails_its_culprit(make_pdf, monkeypatch, short_limits, behaviour):
+    pdffiles = [make_pdf(f'0701.{i:04d}v1.pdf') for i in range(4)]
+    monkeypatch.setattr(fulltext, 'extract_fulltext', misbehaving_extraction({'0701.0002v1.pdf': behaviour}))
+
+    tic = time()
+    results = convert(pdffiles)
+
+    ## A hang is stopped after about the time limit and the margin, twice: in its batch, then on its own
+    assert time() - tic < 15
+    assert results.pop(pdffiles[2]) is None
+    assert results == {pdffile: fulltext.reextension(pdffile, 'txt') for pdffile in pdffiles if pdffile != pdffiles[2]}
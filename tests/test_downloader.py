@@ -0,0 +1,129 @@
+## Tests of the asynchronous downloader against a local http.server, with resumed and complete partial files
+
+import functools
+import http.server
+import os
+import re
+import threading
+
+import pytest
+
+from scientific_dataset_arxiv.downloader import PermanentDownloadError, download_many_to_path
+
+#####################################################################################################################
+
+CONTENT = bytes(range(256)) * 1000  # A 256 kB blob
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """ Serve files like `python -m http.server`, honouring 'Range: bytes=N-' and recording the requests """
+    requests = []
+    honour_range = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('Range')))
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        path = self.translate_path(self.path)
+        if not match or not self.honour_range or not os.path.isfile(path):
+            return super().do_GET()
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        start = int(match.group(1))
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(data)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture
+def server(tmp_path):
+    """ A server of the 'bucket' folder of tmp_path, yields its base url """
+    bucket = tmp_path / 'served' / 'bucket' / 'pdf'
+    bucket.mkdir(parents=True)
+    (bucket / 'a.pdf').write_bytes(CONTENT)
+    (bucket / 'b.pdf').write_bytes(CONTENT[::-1])
+
+    RangeHandler.requests = []
+    RangeHandler.honour_range = True
+    handler = functools.partial(RangeHandler, directory=str(tmp_path / 'served'))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def download(base_url, destination, blob_names):
+    return download_many_to_path('bucket', blob_names, str(destination), base_url=base_url, initial_concurrency=2, max_concurrency=4)
+
+
+def test_download_many(server, tmp_path):
+    results = download(server, tmp_path / 'out', ['pdf/a.pdf', 'pdf/b.pdf'])
+
+    assert results == [None, None]
+    assert (tmp_path / 'out' / 'pdf' / 'a.pdf').read_bytes() == CONTENT
+    assert (tmp_path / 'out' / 'pdf' / 'b.pdf').read_bytes() == CONTENT[::-1]
+    assert not list((tmp_path / 'out' / 'pdf').glob('*.part'))
+
+
+def test_missing_blob_is_a_permanent_failure(server, tmp_path):
+    results = download(server, tmp_path / 'out', ['pdf/a.pdf', 'pdf/missing.pdf'])
+
+    assert results[0] is None
+    assert isinstance(results[1], PermanentDownloadError)
+    assert not (tmp_path / 'out' / 'pdf' / 'missing.pdf').exists()
+    ## Not retried
+    assert sum(path.endswith('missing.pdf') for path, _ in RangeHandler.requests) == 1
+
+
+def test_existing_files_are_skipped(server, tmp_path):
+    (tmp_path / 'out' / 'pdf').mkdir(parents=True)
+    (tmp_path / 'out' / 'pdf' / 'a.pdf').write_bytes(b'kept')
+
+    assert download(server, tmp_path / 'out', ['pdf/a.pdf']) == [None]
+    assert (tmp_path / 'out' / 'pdf' / 'a.pdf').read_bytes() == b'kept'
+    assert RangeHandler.requests == []
+
+
+def test_resume_from_partial_file(server, tmp_path):
+    (tmp_path / 'out' / 'pdf').mkdir(parents=True)
+    (tmp_path / 'out' / 'pdf' / 'a.pdf.part').write_bytes(CONTENT[:1000])
+
+    assert download(server, tmp_path / 'out', ['pdf/a.pdf']) == [None]
+    assert (tmp_path / 'out' / 'pdf' / 'a.pdf').read_bytes() == CONTENT
+    assert RangeHandler.requests == [('/bucket/pdf/a.pdf', 'bytes=1000-')]
+
+
+def test_complete_partial_file_gets_416(server, tmp_path):
+    (tmp_path / 'out' / 'pdf').mkdir(parents=True)
+    (tmp_path / 'out' / 'pdf' / 'a.pdf.part').write_bytes(CONTENT)
+
+    assert download(server, tmp_path / 'out', ['pdf/a.pdf']) == [None]
+    assert (tmp_path / 'out' / 'pdf' / 'a.pdf').read_bytes() == CONTENT
+    assert not (tmp_path / 'out' / 'pdf' / 'a.pdf.part').exists()
+    assert RangeHandler.requests == [('/bucket/pdf/a.pdf', f'bytes={len(CONTENT)}-')]
+
+
+def test_server_ignoring_range_starts_over(server, tmp_path):
+    RangeHandler.honour_range = False
+    (tmp_path / 'out' / 'pdf').mkdir(parents=True)
+    (tmp_path / 'out' / 'pdf' / 'a.pdf.part').write_bytes(b'stale bytes')
+
+    assert download(server, tmp_path / 'out', ['pdf/a.pdf']) == [None]
+    assert (tmp_path / 'out' / 'pdf' / 'a.pdf').read_bytes() == CONTENT
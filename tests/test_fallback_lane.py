@@ -0,0 +1,94 @@
+## Tests of the failure runs of the conversion: rejected files, the fallback lane and the quarantine
+
+import os
+
+import pytest
+
+from scientific_dataset_arxiv import fulltext
+from scientific_dataset_arxiv.fulltext import (clear_failure, convert_directory_parallel, failed_attempts, failure_path,
+                                               record_failure, rejection_path)
+
+#####################################################################################################################
+
+## The workers are forked, so that they see the extraction patched by the tests
+START_METHOD = 'fork'
+
+
+def failing(pdffile, *args, **kwargs):
+    raise ValueError('broken')
+
+
+def convert_folder(folder, **kwargs):
+    return convert_directory_parallel(str(folder), processes=2, start_method=START_METHOD, **kwargs)
+
+
+def rejection(pdffile):
+    with open(rejection_path(pdffile), 'r', encoding='utf-8') as f:
+        return f.read().split('\t', 1)[0]
+
+
+def test_failures_are_counted_until_the_quarantine(tmp_path):
+    pdffile = str(tmp_path / '0701.0001v1.pdf')
+
+    assert failed_attempts(pdffile) == 0
+    assert not record_failure(pdffile, 'main', max_attempts=3)
+    assert not record_failure(pdffile, 'fallback', max_attempts=3)
+    assert failed_attempts(pdffile) == 2
+
+    assert record_failure(pdffile, 'fallback', max_attempts=3)
+    assert not os.path.exists(failure_path(pdffile))
+    assert rejection(pdffile) == 'quarantined'
+
+    ## Cleared failures start over
+    other = str(tmp_path / '0701.0002v1.pdf')
+    record_failure(other, 'main')
+    clear_failure(other)
+    clear_failure(other)
+    assert failed_attempts(other) == 0
+
+
+def test_empty_and_unreadable_pdfs_are_rejected_right_away(tmp_path, make_pdf):
+    good = make_pdf('0701/0701.0001v1.pdf')
+    empty = tmp_path / '0701' / '0701.0002v1.pdf'
+    empty.write_bytes(b'')
+    garbage = tmp_path / '0701' / '0701.0003v1.pdf'
+    garbage.write_bytes(b'not a pdf at all')
+
+    assert convert_folder(tmp_path / '0701') == [good]
+    assert rejection(str(empty)) == 'empty'
+    assert rejection(str(garbage)) == 'unreadable'
+    assert not any(name.endswith('.failed') for name in os.listdir(tmp_path / '0701'))
+
+
+def test_main_lane_failure_is_converted_in_the_fallback_lane(tmp_path, make_pdf, monkeypatch):
+    pdffile = make_pdf('0701/0701.0001v1.pdf')
+    monkeypatch.setattr(fulltext, 'extract_fulltext', failing)
+
+    assert convert_folder(tmp_path / '0701') == [pdffile]
+    assert os.path.exists(fulltext.reextension(pdffile, 'txt'))
+    assert not os.path.exists(failure_path(pdffile))
+
+
+def test_pdf_failing_in_both_lanes_is_quarantined(tmp_path, make_pdf, monkeypatch):
+    pdffile = make_pdf('0701/0701.0001v1.pdf')
+    monkeypatch.setattr(fulltext, 'extract_fulltext', failing)
+    monkeypatch.setattr(fulltext, 'extract_fulltext_fallback', failing)
+
+    assert convert_folder(tmp_path / '0701', quarantine_attempts=3) == []
+    assert failed_attempts(pdffile) == 2
+
+    ## The next run goes straight to the fallback lane, and gives up
+    assert convert_folder(tmp_path / '0701', quarantine_attempts=3) == []
+    assert rejection(pdffile) == 'quarantined'
+    assert not os.path.exists(failure_path(pdffile))
+
+
+@pytest.mark.parametrize('attempts', [1, 2])
+def test_pdf_failing_before_skips_the_main_lane(tmp_path, make_pdf, monkeypatch, attempts):
+    pdffile = make_pdf('0701/0701.0001v1.pdf')
+    for _ in range(attempts):
+        record_failure(pdffile, 'main')
+    monkeypatch.setattr(fulltext, 'extract_fulltext', failing)
+
+    assert convert_folder(tmp_path / '0701') == [pdffile]
+    assert not os.path.exists(failure_path(pdffile))
@@ -0,0 +1,67 @@
+## Tests of the memory governor sizing the worker pools
+
+import pytest
+
+from scientific_dataset_arxiv.governor import SYSTEM_RESERVE, MemoryGovernor, parse_size
+
+#####################################################################################################################
+
+MB = 2**20
+GB = 2**30
+
+
+@pytest.mark.parametrize('size, expected', [
+    (None, None), (1024, 1024), ('512', 512), ('512MB', 512 * MB), ('16 GB', 16 * GB), ('1.5g', int(1.5 * GB)), ('2KB', 2048),
+])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize('size', ['', 'lots', '12 PB', '1e3GB'])
+def test_parse_invalid_size(size):
+    with pytest.raises(ValueError):
+        parse_size(size)
+
+
+def governor_sampling(budget, max_workers, parent_rss, workers, available, **kwargs):
+    """ A governor measuring the given memory instead of the processes of the test """
+    governor = MemoryGovernor(budget, max_workers, **kwargs)
+    governor.sample = lambda: (parent_rss, workers, available)
+    return governor
+
+
+def test_estimate_is_used_before_any_worker_runs():
+    governor = governor_sampling(4 * GB, 16, 1 * GB, {}, 100 * GB, worker_estimate=512 * MB)
+    assert governor.target_workers() == 6
+
+
+def test_largest_worker_sets_the_size_of_the_workers():
+    governor = governor_sampling(4 * GB, 16, 1 * GB, {1: 256 * MB, 2: 1 * GB}, 100 * GB, worker_estimate=128 * MB)
+    assert governor.target_workers() == 3
+    assert governor.worker_estimate == 1 * GB
+
+
+def test_available_memory_limits_the_workers():
+    ## The running workers give back their memory, the reserve is left to other processes
+    governor = governor_sampling(64 * GB, 16, 1 * GB, {1: 1 * GB}, SYSTEM_RESERVE + 2 * GB)
+    assert governor.target_workers() == 3
+
+
+@pytest.mark.parametrize('budget, expected', [(0, 2), (1000 * GB, 8)])
+def test_target_stays_within_the_bounds(budget, expected):
+    governor = governor_sampling(budget, 8, 1 * GB, {}, 1000 * GB, min_workers=2)
+    assert governor.target_workers() == expected
+
+
+def test_bloated_workers():
+    governor = governor_sampling(4 * GB, 16, 1 * GB, {1: 512 * MB, 2: 1 * GB, 3: 2 * GB}, 100 * GB)
+    assert governor.bloated_workers(3) == [3]
+    assert governor.bloated_workers(6) == [2, 3]
+
+
+def test_sample_measures_this_process():
+    governor = MemoryGovernor(4 * GB, 2)
+    parent_rss, workers, available = governor.sample()
+
+    assert parent_rss > 0 and available > 0
+    assert governor.peak >= parent_rss
@@ -0,0 +1,75 @@
+## Tests of the lease files shared by several nodes, with a node that crashes while holding a unit
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from time import time
+
+from scientific_dataset_arxiv.leases import LeaseDirectory, claimed_units
+
+#####################################################################################################################
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TTL = 1  # Seconds, short so the lease of the crashed node expires quickly
+
+
+def crash_holding(path, units):
+    """ Claim the first unit in another process, which dies without releasing its lease """
+    code = textwrap.dedent(f'''
+        import os
+        from scientific_dataset_arxiv.leases import LeaseDirectory, claimed_units
+        for unit in claimed_units({units!r}, LeaseDirectory({str(path)!r}, 'crashed', ttl={TTL})):
+            os._exit(1)
+    ''')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT))
+    assert result.returncode == 1
+
+
+def test_units_of_a_crashed_node_are_taken_over(tmp_path):
+    crash_holding(tmp_path, ['0701', '0702'])
+    with open(tmp_path / '0701.lease', encoding='utf-8') as f:
+        assert json.load(f)['node'] == 'crashed'
+
+    leases = LeaseDirectory(str(tmp_path), 'survivor', ttl=TTL)
+    tic = time()
+    claimed = list(claimed_units(['0701', '0702'], leases, poll_interval=0.2))
+
+    ## The free unit first, the one of the crashed node once its lease expired
+    assert claimed == ['0702', '0701']
+    assert time() - tic >= 0.5
+    assert leases.is_done('0701') and leases.is_done('0702')
+    assert not os.path.exists(tmp_path / '0701.lease')
+
+
+def test_unit_is_not_done_when_the_caller_fails(tmp_path):
+    leases = LeaseDirectory(str(tmp_path), 'node', ttl=TTL)
+    units = claimed_units(['0701'], leases)
+
+    assert next(units) == '0701'
+    units.close()
+
+    assert not leases.is_done('0701')
+    assert not os.path.exists(tmp_path / '0701.lease')
+
+
+def test_done_units_are_skipped_unless_the_settings_changed(tmp_path):
+    assert list(claimed_units(['0701'], LeaseDirectory(str(tmp_path), 'a', params={'search_term': 'introduction'}))) == ['0701']
+    assert list(claimed_units(['0701'], LeaseDirectory(str(tmp_path), 'b', params={'search_term': 'introduction'}))) == []
+    assert list(claimed_units(['0701'], LeaseDirectory(str(tmp_path), 'c', params={'search_term': 'conclusion'}))) == ['0701']
+
+
+def test_renew_fails_once_the_lease_was_taken_over(tmp_path):
+    first = LeaseDirectory(str(tmp_path), 'first', ttl=60)
+    second = LeaseDirectory(str(tmp_path), 'second', ttl=60)
+
+    assert first.try_claim('0701')
+    assert not second.try_claim('0701')
+    assert first.renew('0701')
+
+    ## The lease of `first` expired and `second` took it over
+    os.remove(tmp_path / '0701.lease')
+    assert second.try_claim('0701')
+    assert not first.renew('0701')
+    assert second.renew('0701')
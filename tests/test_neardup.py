@@ -0,0 +1,39 @@
+## Tests of the near-duplicate index across runs, with years added, removed and reordered
+
+import pandas as pd
+
+from scientific_dataset_arxiv.neardup import index_files
+
+#####################################################################################################################
+
+TEXT = ' '.join(f'word{i}' for i in range(300))
+
+
+def year_file(tmp_path, year, ids):
+    path = tmp_path / f'arxiv_dataset_{year}.parquet'
+    pd.DataFrame({'id': ids, 'article': [TEXT] * len(ids)}).to_parquet(path, index=False)
+    return str(path)
+
+
+def test_original_of_a_removed_year_is_forgotten(tmp_path):
+    index = str(tmp_path / 'near_duplicates.sqlite')
+    y2007, y2008 = year_file(tmp_path, 2007, ['0704.0001']), year_file(tmp_path, 2008, ['0801.0001'])
+
+    assert index_files(index, [y2007, y2008], processes=1) == [('0801.0001', '0704.0001', 1.0)]
+
+    ## Without 2007, the paper of 2008 is no longer a near-duplicate, it would be lost from the merged file otherwise
+    assert index_files(index, [y2008], processes=1) == []
+
+
+def test_earlier_years_keep_precedence(tmp_path):
+    index = str(tmp_path / 'near_duplicates.sqlite')
+    y2007, y2008 = year_file(tmp_path, 2007, ['0704.0001']), year_file(tmp_path, 2008, ['0801.0001'])
+
+    index_files(index, [y2008], processes=1)
+
+    ## 2007 comes first, 2008 is indexed again after it
+    assert index_files(index, [y2007, y2008], processes=1) == [('0801.0001', '0704.0001', 1.0)]
+
+    ## A year added at the end only indexes that year
+    y2009 = year_file(tmp_path, 2009, ['0901.0001'])
+    assert index_files(index, [y2007, y2008, y2009], processes=1) == [('0801.0001', '0704.0001', 1.0), ('0901.0001', '0704.0001', 1.0)]
@@ -0,0 +1,167 @@
+## Tests of the publishing of the datasets, to a local endpoint and to a fake Hub client standing in for the Hub
+
+import os
+
+import pandas as pd
+import pytest
+
+from scientific_dataset_arxiv import publish as publish_module
+from scientific_dataset_arxiv.publish import HubRepo, open_repo, publish, sha256_file
+
+#####################################################################################################################
+
+REPO_ID = 'user/arxiv_dataset_by_year'
+
+
+@pytest.fixture
+def year_file(tmp_path):
+    """ A small yearly parquet file """
+    path = tmp_path / 'arxiv_dataset_2007.parquet'
+    pd.DataFrame({'id': [f'0701.{i:04d}' for i in range(3000)], 'article': ['introduction ' * 10] * 3000}).to_parquet(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return open_repo(REPO_ID, endpoint=f'file://{tmp_path / "hub"}')
+
+
+def test_year_that_fits_keeps_its_name(tmp_path, repo, year_file):
+    assert publish(repo, [year_file], str(tmp_path / 'staging'), os.path.getsize(year_file)) == 1
+
+    assert repo.list_files() == {'data/arxiv_dataset_2007.parquet'}
+    assert sha256_file(os.path.join(repo.path, 'data', 'arxiv_dataset_2007.parquet')) == sha256_file(year_file)
+
+
+def test_unchanged_shards_are_not_uploaded_again(tmp_path, repo, year_file):
+    staging = str(tmp_path / 'staging')
+    assert publish(repo, [year_file], staging, 2**20) == 1
+    assert publish(repo, [year_file], staging, 2**20) == 0
+
+    ## A shard missing from the repo is uploaded again
+    os.remove(os.path.join(repo.path, 'data', 'arxiv_dataset_2007.parquet'))
+    assert publish(repo, [year_file], staging, 2**20) == 1
+
+
+def test_larger_year_is_sharded_and_the_single_file_deleted(tmp_path, repo, year_file):
+    staging = str(tmp_path / 'staging')
+    publish(repo, [year_file], staging, os.path.getsize(year_file))
+
+    target = os.path.getsize(year_file) // 2 + 1
+    assert publish(repo, [year_file], staging, target) == 2
+    assert repo.list_files() == {'data/arxiv_dataset_2007-00000-of-00002.parquet', 'data/arxiv_dataset_2007-00001-of-00002.parquet'}
+
+    shards = [pd.read_parquet(os.path.join(repo.path, 'data', name)) for name in sorted(os.listdir(os.path.join(repo.path, 'data')))]
+    assert pd.concat(shards, ignore_index=True).equals(pd.read_parquet(year_file))
+
+    ## Back to a single file once it fits again
+    publish(repo, [year_file], staging, os.path.getsize(year_file))
+    assert repo.list_files() == {'data/arxiv_dataset_2007.parquet'}
+
+
+def test_other_files_of_the_repo_are_left_alone(tmp_path, repo, year_file):
+    os.makedirs(os.path.join(repo.path, 'data'))
+    with open(os.path.join(repo.path, 'README.md'), 'w') as f:
+        f.write('card')
+    with open(os.path.join(repo.path, 'data', 'arxiv_dataset_2008.parquet'), 'w') as f:
+        f.write('another year')
+
+    publish(repo, [year_file, str(tmp_path / 'missing_2009.parquet')], str(tmp_path / 'staging'), 2**20)
+
+    assert repo.list_files() == {'README.md', 'data/arxiv_dataset_2007.parquet', 'data/arxiv_dataset_2008.parquet'}
+
+
+def test_month_folders_are_packed_in_tar_shards(tmp_path, repo):
+    month = tmp_path / 'unprocessed_txts' / '0701'
+    month.mkdir(parents=True)
+    (month / '0701.0001v1.txt').write_text('text')
+    (month / '0701.0001v1.json').write_text('{}')
+    (month / '0701.0001v1.pdf').write_text('not published')
+
+    assert publish(repo, [str(month)], str(tmp_path / 'staging'), 2**20) == 1
+    assert repo.list_files() == {'data/0701.tar'}
+
+
+def test_failed_uploads_are_retried(tmp_path, repo, year_file, monkeypatch):
+    monkeypatch.setattr(publish_module, 'RETRY_DELAY', 0)
+    upload = repo.upload
+    failures = []
+
+    def flaky_upload(local_path, path_in_repo):
+        if not failures:
+            failures.append(path_in_repo)
+            raise ConnectionError('connection reset')
+        return upload(local_path, path_in_repo)
+
+    monkeypatch.setattr(repo, 'upload', flaky_upload)
+
+    assert publish(repo, [year_file], str(tmp_path / 'staging'), 2**20) == 1
+    assert failures == ['data/arxiv_dataset_2007.parquet']
+    assert repo.list_files() == {'data/arxiv_dataset_2007.parquet'}
+
+
+class FakeHfApi:
+    """ The calls of `HfApi` used by HubRepo, on repos kept in memory; a commit only adds files uploaded before """
+    repos = {}
+
+    def __init__(self, endpoint=None, token=None):
+        self.uploaded = {}
+
+    def create_repo(self, repo_id, repo_type=None, exist_ok=False):
+        assert repo_type == 'dataset'
+        if repo_id in self.repos and not exist_ok:
+            raise ValueError(f'{repo_id} already exists')
+        self.repos.setdefault(repo_id, {})
+
+    def list_repo_files(self, repo_id, repo_type=None):
+        if repo_id not in self.repos:
+            raise LookupError(f'{repo_id} not found')
+        return list(self.repos[repo_id])
+
+    def preupload_lfs_files(self, repo_id, additions, repo_type=None, num_threads=5):
+        for operation in additions:
+            with open(operation.path_or_fileobj, 'rb') as f:
+                self.uploaded[operation.path_in_repo] = f.read()
+
+    def create_commit(self, repo_id, operations, commit_message, repo_type=None):
+        from huggingface_hub import CommitOperationAdd, CommitOperationDelete
+
+        files = self.repos[repo_id]
+        for operation in operations:
+            if isinstance(operation, CommitOperationAdd):
+                files[operation.path_in_repo] = self.uploaded.pop(operation.path_in_repo)
+            else:
+                assert isinstance(operation, CommitOperationDelete)
+                del files[operation.path_in_repo]
+
+
+@pytest.fixture
+def hub_repo(monkeypatch):
+    import huggingface_hub
+
+    FakeHfApi.repos = {}
+    monkeypatch.setattr(huggingface_hub, 'HfApi', FakeHfApi)
+    return HubRepo(REPO_ID, token='token')
+
+
+def test_hub_repo_is_created_when_missing(tmp_path, hub_repo, year_file):
+    assert publish(hub_repo, [year_file], str(tmp_path / 'staging'), 2**20) == 1
+
+    with open(year_file, 'rb') as f:
+        assert FakeHfApi.repos[REPO_ID] == {'data/arxiv_dataset_2007.parquet': f.read()}
+
+
+def test_hub_repo_shards_replace_the_single_file(tmp_path, hub_repo, year_file):
+    staging = str(tmp_path / 'staging')
+    FakeHfApi.repos[REPO_ID] = {'README.md': b'card'}
+    publish(hub_repo, [year_file], staging, os.path.getsize(year_file))
+
+    target = os.path.getsize(year_file) // 2 + 1
+    assert publish(hub_repo, [year_file], staging, target) == 2
+    assert hub_repo.list_files() == {'README.md', 'data/arxiv_dataset_2007-00000-of-00002.parquet', 'data/arxiv_dataset_2007-00001-of-00002.parquet'}
+
+    ## Nothing changed, nothing uploaded
+    assert publish(hub_repo, [year_file], staging, target) == 0
+
+    publish(hub_repo, [year_file], staging, os.path.getsize(year_file))
+    assert hub_repo.list_files() == {'README.md', 'data/arxiv_dataset_2007.parquet'}
@@ -0,0 +1,53 @@
+## Tests of the stratified sample of the papers, the same on every run and in the download and the merge
+
+import random
+from collections import Counter
+
+import pandas as pd
+
+from scientific_dataset_arxiv.arxiv_ids import id_month
+from scientific_dataset_arxiv.sampling import primary_category, sample_metadata, select_sample
+
+#####################################################################################################################
+
+## 1000 papers over two months, mostly hep-th, a few astro-ph and a single math paper
+IDS = [f'07{month:02d}.{i:04d}' for month in (4, 5) for i in range(500)]
+CATEGORIES = ['math.GT hep-th' if i == 0 else 'astro-ph' if i % 50 == 1 else 'hep-th gr-qc' for i in range(len(IDS))]
+
+
+def test_sample_is_reproducible_whatever_the_order():
+    sample = select_sample(IDS, CATEGORIES, fraction=0.1, seed=3)
+
+    shuffled = list(zip(IDS, CATEGORIES))
+    random.Random(0).shuffle(shuffled)
+    assert select_sample([i for i, _ in shuffled], [c for _, c in shuffled], fraction=0.1, seed=3) == sample
+
+    assert select_sample(IDS, CATEGORIES, fraction=0.1, seed=4) != sample
+
+
+def test_sample_is_stratified_by_month_and_category():
+    sample = select_sample(IDS, CATEGORIES, fraction=0.1, seed=0)
+    categories = dict(zip(IDS, CATEGORIES))
+    strata = Counter((id_month(i), primary_category(categories[i])) for i in sample)
+
+    assert strata == {('0704', 'hep-th'): 49, ('0705', 'hep-th'): 49, ('0704', 'astro-ph'): 1, ('0705', 'astro-ph'): 1, ('0704', 'math.GT'): 1}
+
+
+def test_larger_fraction_keeps_the_smaller_sample():
+    small = select_sample(IDS, CATEGORIES, fraction=0.05, seed=0)
+    large = select_sample(IDS, CATEGORIES, fraction=0.2, seed=0)
+
+    assert small < large
+    assert select_sample(IDS, CATEGORIES, fraction=1.0, seed=0) == set(IDS)
+
+
+def test_sample_metadata():
+    metadata_df = pd.DataFrame({'id': IDS, 'categories': CATEGORIES, 'title': ['a title'] * len(IDS)})
+
+    sampled = sample_metadata(metadata_df, 0.1, seed=0)
+    assert set(sampled['id']) == select_sample(IDS, CATEGORIES, fraction=0.1, seed=0)
+    assert list(sampled.columns) == ['id', 'categories', 'title']
+
+    ## Without categories, by month only
+    sampled = sample_metadata(metadata_df[['id', 'title']], 0.1, seed=0)
+    assert Counter(id_month(i) for i in sampled['id']) == {'0704': 50, '0705': 50}
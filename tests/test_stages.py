@@ -0,0 +1,127 @@
+## Tests of the stage runner of run_pipeline.py: fingerprints, skipped stages and the clean hook
+
+import os
+
+import pytest
+
+from run_pipeline import clean_month, clean_year
+from scientific_dataset_arxiv.checkpoints import part_file
+from scientific_dataset_arxiv.stages import Stage, StageCache, run_stages
+
+#####################################################################################################################
+
+
+class Pipeline:
+    """ A convert stage writing a txt file per paper and a merge stage counting them, recording what ran and cleaned """
+    def __init__(self, tmp_path):
+        self.folder = tmp_path / 'unprocessed_txts' / '0701'
+        self.dataset_file = tmp_path / 'arxiv_dataset_2007.parquet'
+        self.cache = StageCache(str(tmp_path / '.pipeline.json'))
+        self.papers = 2
+        self.cleaned = []
+
+    def convert(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        for i in range(self.papers):
+            path = self.folder / f'0701.{i:04d}v1.txt'
+            if not path.exists():
+                path.write_text('introduction')
+
+    def merge(self):
+        self.dataset_file.write_text(str(len(list(self.folder.glob('*.txt')))))
+
+    def stages(self, convert_params=None, merge_params=None):
+        return [
+            Stage('convert/0701', self.convert, [str(self.folder)], convert_params, patterns=('.txt',),
+                  clean=lambda changed: self.cleaned.append(('convert/0701', changed))),
+            Stage('merge/articles/07', self.merge, [str(self.dataset_file)], merge_params, deps=['convert/0701'],
+                  clean=lambda changed: self.cleaned.append(('merge/articles/07', changed))),
+        ]
+
+    def run(self, **kwargs):
+        force = kwargs.pop('force', ())
+        return run_stages(self.stages(**kwargs), self.cache, force=force)
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    return Pipeline(tmp_path)
+
+
+def test_up_to_date_stages_are_skipped(pipeline):
+    assert pipeline.run() == ['convert/0701', 'merge/articles/07']
+    assert pipeline.run() == []
+
+    ## The record survives the process
+    pipeline.cache = StageCache(pipeline.cache.path)
+    assert pipeline.run() == []
+    assert pipeline.cleaned == []
+
+
+def test_changed_params_rerun_the_stage_and_what_depends_on_it(pipeline):
+    pipeline.run(convert_params={'max_pdfs_per_month': 2})
+
+    pipeline.papers = 3
+    assert pipeline.run(convert_params={'max_pdfs_per_month': 3}) == ['convert/0701', 'merge/articles/07']
+    assert pipeline.dataset_file.read_text() == '3'
+    assert pipeline.cleaned == [('convert/0701', {'max_pdfs_per_month'}), ('merge/articles/07', {'convert/0701'})]
+
+
+def test_downstream_stage_is_skipped_when_the_upstream_outputs_are_unchanged(pipeline):
+    pipeline.run(convert_params={'compress_texts': False})
+
+    assert pipeline.run(convert_params={'compress_texts': True}) == ['convert/0701']
+
+
+def test_modified_outputs_rerun_the_stage(pipeline):
+    pipeline.run()
+
+    pipeline.dataset_file.write_text('edited by hand')
+    assert pipeline.run() == ['merge/articles/07']
+    assert pipeline.dataset_file.read_text() == '2'
+
+    ## Changed outputs with the same inputs are not a reason to clean
+    assert pipeline.cleaned == []
+
+
+def test_forced_stages_run_without_cleaning(pipeline):
+    pipeline.run()
+
+    assert pipeline.run(force=['merge/']) == ['merge/articles/07']
+    assert pipeline.cleaned == []
+
+
+def test_dry_run_runs_nothing(pipeline):
+    assert run_stages(pipeline.stages(), pipeline.cache, dry_run=True) == ['convert/0701', 'merge/articles/07']
+    assert not pipeline.folder.exists()
+    assert pipeline.cache.records == {}
+
+
+def test_clean_month_only_clears_the_rejections_of_the_search_term(tmp_path):
+    month = tmp_path / '0701'
+    month.mkdir()
+    (month / '0701.0001v1.txt').write_text('text')
+    (month / '0701.0002v1.rejected').write_text('search_term\t"introduction" not found\n')
+    (month / '0701.0003v1.rejected').write_text('scanned\t3 of the first 3 pages are images without text\n')
+    (month / 'texts.sqlite').write_bytes(b'store')
+
+    ## Settings that only add work keep everything
+    clean_month(str(month), {'max_pdfs_per_month', 'compress_texts', 'quarantine_attempts'})
+    assert len(os.listdir(month)) == 4
+
+    clean_month(str(month), {'conversion_search_term'})
+    assert sorted(os.listdir(month)) == ['0701.0001v1.txt', '0701.0003v1.rejected', 'texts.sqlite']
+
+
+def test_clean_year_only_clears_the_parts_of_the_changed_months(tmp_path):
+    dataset_file = str(tmp_path / 'arxiv_dataset_2007.parquet')
+    for yymm in ('0701', '0702', '0703'):
+        os.makedirs(os.path.dirname(part_file(dataset_file, yymm)), exist_ok=True)
+        open(part_file(dataset_file, yymm), 'w').close()
+
+    clean_year(dataset_file, {'convert/0702'})
+    assert [os.path.exists(part_file(dataset_file, yymm)) for yymm in ('0701', '0702', '0703')] == [True, False, True]
+
+    ## Other merge settings change every month
+    clean_year(dataset_file, {'search_term'})
+    assert not any(os.path.exists(part_file(dataset_file, yymm)) for yymm in ('0701', '0702', '0703'))
@@ -0,0 +1,114 @@
+## Tests of the bounded staging area the PDFs are downloaded into and converted from
+
+import asyncio
+import os
+import threading
+
+import pytest
+
+from scientific_dataset_arxiv import staging
+from scientific_dataset_arxiv.fulltext import convert_directory_parallel, reextension
+from scientific_dataset_arxiv.staging import StagingArea
+
+#####################################################################################################################
+
+
+def download(area, path, nbytes):
+    """ What the downloader does: reserve, write the file, add it """
+    assert area.try_reserve(path, nbytes)
+    with open(path, 'wb') as f:
+        f.write(b'x' * nbytes)
+    area.add(path)
+
+
+@pytest.fixture
+def area(tmp_path):
+    return StagingArea(str(tmp_path), budget=100)
+
+
+def test_reservations_stay_within_the_budget(tmp_path, area):
+    a, b, c = (str(tmp_path / f'{name}.pdf') for name in 'abc')
+
+    assert area.try_reserve(a, 60)
+    assert not area.try_reserve(b, 60)
+    assert area.try_reserve(b, 40)
+    assert area.used == 100
+
+    ## A failed download releases its bytes
+    area.discard(b)
+    assert area.try_reserve(c, 40)
+    assert area.peak == 100
+
+
+def test_held_pdfs_do_not_block_the_downloads(tmp_path, area):
+    a, b = str(tmp_path / 'a.pdf'), str(tmp_path / 'b.pdf')
+    download(area, a, 80)
+    assert not area.try_reserve(b, 80)
+
+    ## Nothing would make room anymore, the budget is exceeded
+    area.hold(a)
+    assert area.try_reserve(b, 80)
+    assert area.peak == 160
+    assert area.held_files() == [a]
+
+
+def test_take_batches_in_order(tmp_path, area):
+    paths = [str(tmp_path / f'{i}.pdf') for i in range(4)]
+    for path, nbytes in zip(paths, (10, 10, 30, 10)):
+        download(area, path, nbytes)
+
+    assert area.take(3, max_bytes=30) == paths[:2]
+    assert area.take(3, max_bytes=30) == paths[2:3]
+    assert area.take(3, timeout=0.01) == paths[3:]
+
+    ## Nothing ready in time, then nothing ever again
+    assert area.take(3, timeout=0.01) == []
+    area.close()
+    assert area.take(3) is None
+
+
+def test_take_waits_for_a_download(tmp_path, area):
+    path = str(tmp_path / 'a.pdf')
+    threading.Timer(0.1, download, args=(area, path, 10)).start()
+
+    assert area.take(3, timeout=5) == [path]
+
+
+def test_removed_pdfs_make_room_for_the_waiting_download(tmp_path, area, monkeypatch):
+    monkeypatch.setattr(staging, 'POLL_INTERVAL', 0.01)
+    a, b = str(tmp_path / 'a.pdf'), str(tmp_path / 'b.pdf')
+    download(area, a, 80)
+
+    async def main():
+        waiting = asyncio.ensure_future(area.reserve(b, 80))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        area.remove(a)
+        await asyncio.wait_for(waiting, timeout=5)
+
+    asyncio.run(main())
+    assert not os.path.exists(a)
+    assert area.used == 80
+
+
+def test_aborted_area_fails_the_waiting_downloads(tmp_path, area):
+    download(area, str(tmp_path / 'a.pdf'), 80)
+    area.abort()
+
+    with pytest.raises(RuntimeError):
+        area.try_reserve(str(tmp_path / 'b.pdf'), 80)
+
+    ## The ready PDFs are still taken, without waiting for more
+    assert area.take(3) == [str(tmp_path / 'a.pdf')]
+    assert area.take(3) is None
+
+
+def test_converted_pdfs_are_deleted(tmp_path, make_pdf):
+    pdffiles = [make_pdf(f'0701/0701.{i:04d}v1.pdf') for i in range(3)]
+    area = StagingArea(str(tmp_path / '0701'), budget=10**9)
+    area.close()
+
+    assert convert_directory_parallel(str(tmp_path / '0701'), processes=2, start_method='fork', staging=area) == pdffiles
+    assert all(os.path.exists(reextension(pdffile, 'txt')) and not os.path.exists(pdffile) for pdffile in pdffiles)
+    assert area.used == 0
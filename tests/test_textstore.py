@@ -0,0 +1,81 @@
+## Tests of the compressed store of the txt files of a month, read back through the paths the files had on disk
+
+import os
+
+import pytest
+
+from scientific_dataset_arxiv.textio import read_nonempty_text, read_text_after_term
+from scientific_dataset_arxiv.textstore import MIN_DICT_SAMPLES, TextStore, list_texts, pack_folder, read_packed, store_path
+
+#####################################################################################################################
+
+
+def write_month(folder, count):
+    """ Write `count` txt files, different enough to train a dictionary on """
+    texts = {}
+    for i in range(count):
+        path = os.path.join(folder, f'0701.{i:04d}v1.txt')
+        texts[path] = f'Abstract of paper {i}. 1 Introduction\n' + ' '.join(f'token{(i * 7 + j) % 301} café' for j in range(400))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(texts[path])
+    return texts
+
+
+@pytest.mark.parametrize('count', [3, MIN_DICT_SAMPLES + 10])
+def test_packed_texts_read_back_by_their_path(tmp_path, count):
+    month = str(tmp_path / '0701')
+    os.makedirs(month)
+    texts = write_month(month, count)
+    (tmp_path / '0701' / '0701.0000v1.json').write_text('{}')
+
+    assert pack_folder(month) == count
+    assert sorted(os.listdir(month)) == ['0701.0000v1.json', 'texts.sqlite']
+
+    with TextStore(month) as store:
+        assert (store.dictionary is not None) == (count >= MIN_DICT_SAMPLES)
+        assert store.names() == sorted(os.path.basename(path) for path in texts)
+
+    assert list_texts(month) == sorted(texts)
+    for path, text in texts.items():
+        assert read_packed(path).decode('utf-8') == text
+        assert read_nonempty_text(path) == text
+    assert read_text_after_term(next(iter(texts)), 'introduction').startswith('Introduction\ntoken0')
+
+
+def test_store_is_smaller_than_the_texts(tmp_path):
+    month = str(tmp_path / '0701')
+    os.makedirs(month)
+    texts = write_month(month, MIN_DICT_SAMPLES + 10)
+    size = sum(os.path.getsize(path) for path in texts)
+
+    pack_folder(month)
+    assert os.path.getsize(store_path(month)) < size / 3
+
+
+def test_texts_converted_after_packing_are_added(tmp_path):
+    month = str(tmp_path / '0701')
+    os.makedirs(month)
+    write_month(month, 2)
+    pack_folder(month)
+
+    ## A later run converts another paper of the month, on disk next to the store
+    path = os.path.join(month, '0701.0099v1.txt')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('a late paper')
+    assert len(list_texts(month)) == 3
+
+    assert pack_folder(month) == 1
+    assert len(list_texts(month)) == 3
+    assert read_nonempty_text(path) == 'a late paper'
+
+
+def test_missing_text_is_not_found(tmp_path):
+    month = str(tmp_path / '0701')
+    os.makedirs(month)
+    write_month(month, 2)
+    pack_folder(month)
+
+    with pytest.raises(FileNotFoundError):
+        read_packed(os.path.join(month, '0701.9999v1.txt'))
+    with pytest.raises(FileNotFoundError):
+        read_packed(str(tmp_path / 'elsewhere' / '0701.0000v1.txt'))